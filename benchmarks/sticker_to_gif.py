@@ -0,0 +1,71 @@
+"""
+Benchmark of sticker conversion to GIF for WeChat.
+
+Compares the conversion used before (`legacy_image_to_gif`) with
+`transcode.image_to_gif`, on synthetic 512x512 WebP stickers like those
+from Telegram.
+
+Usage: python3 benchmarks/sticker_to_gif.py [-n ROUNDS] [-s SIZE]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+from PIL import Image, ImageDraw
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import transcode
+
+
+def legacy_image_to_gif(src, dst):
+    img = Image.open(src)
+    try:
+        alpha = img.split()[3]
+        mask = Image.eval(alpha, lambda a: 255 if a <= 128 else 0)
+    except IndexError:
+        mask = Image.eval(img.split()[0], lambda a: 0)
+    img = img.convert('RGB').convert('P', palette=Image.ADAPTIVE, colors=255)
+    img.paste(255, mask)
+    img.save(dst, transparency=255)
+
+
+def make_sticker(path, size, seed):
+    img = Image.new("RGBA", (size, size), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(img)
+    for i in range(40):
+        x, y = (i * 37 + seed * 11) % size, (i * 53 + seed * 7) % size
+        draw.ellipse((x - size // 6, y - size // 5, x + size // 6, y + size // 5),
+                     fill=((i * 6 + seed) % 256, (255 - i * 5) % 256, (i * 3 * seed) % 256, 255 - i * 6))
+    img.save(path, "WEBP")
+
+
+def bench(fn, sources, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for src in sources:
+            fn(src, src + ".gif")
+    return (time.perf_counter() - start) / (rounds * len(sources))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-n", "--rounds", type=int, default=10, help="Conversions of each sticker.")
+    parser.add_argument("-s", "--size", type=int, default=512, help="Width and height of stickers.")
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        sources = []
+        for i in range(5):
+            path = os.path.join(tmp, "sticker_%s.webp" % i)
+            make_sticker(path, args.size, i)
+            sources.append(path)
+        results = [("legacy", bench(legacy_image_to_gif, sources, args.rounds)),
+                   ("transcode", bench(transcode.image_to_gif, sources, args.rounds))]
+        base = results[0][1]
+        for name, t in results:
+            print("%-10s %8.2f ms/image %8.1f images/s  x%.2f" % (name, t * 1000, 1 / t, base / t))
+
+
+if __name__ == "__main__":
+    main()
@@ -50,7 +50,7 @@ class EFBChannel:
         Initialize a channel.
 
         Args:
-            queue (queue.Queue): Global message queue.
+            queue (msgbus.MessageBus): Global message queue.
             mutex (threading.Lock): Global interaction thread lock.
         """
         self.queue = queue
@@ -130,10 +130,21 @@ class EFBMsg:
         type (MsgType): Type of message
         uid (str): Unique ID of message
         url (str): URL of multimedia file/Link share. `None` if N/A
-        path (str): Local path of multimedia file. `None` if N/A
-        file (file): File object to multimedia file, type "ra". `None` if N/A
+        path (str): Local path of multimedia file. `None` if N/A, or if the
+            file is kept in memory as `file`.
+        file (file): File object to multimedia file, type "rb". `None` if N/A.
+            Opened from `path` on first access, call `close()` after use.
         mime (str): MIME type of the file. `None` if N/A
         filename (str): File name of the multimedia file. `None` if N/A
+        spool_seq (int): Sequence number of the message in the message spool,
+            set by the message bus. `None` if not saved in the spool.
+
+    Memory footprint:
+        Attributes are stored in `__slots__`, and no file is opened until
+        `file` is accessed. On 64-bit CPython, a message takes about 180
+        bytes for the object itself, plus about 180 bytes for each of
+        `origin` and `destination`, and 64 bytes for an empty `attributes`,
+        excluding strings. A queued message holds no file descriptor.
 
     `target`:
         There are 3 types of targets: `Member`, `Message`, and `Substitution`
@@ -245,35 +256,77 @@ class EFBMsg:
             }
             ```
     """
-    channel_name = "Empty Channel"
-    channel_emoji = "?"
-    channel_id = "emptyChannel"
-    source = MsgSource.User
-    type = MsgType.Text
-    member = None
-    origin = {
-        "name": "Origin name",
-        'alias': 'Origin alias',
-        'uid': 'Origin UID',
-    }
-    destination = {
-        "channel": "channel_id",
-        "name": "Destination name",
-        'alias': 'Destination alias',
-        'uid': 'Destination UID',
-    }
-    target = None
-    uid = None
-    text = ""
-    url = None
-    path = None
-    file = None
-    mime = None
-    filename = None
-    attributes = {}
+    __slots__ = ("channel_name", "channel_emoji", "channel_id", "source", "type", "member", "origin",
+                 "destination", "target", "uid", "text", "url", "path", "_file", "mime", "filename", "attributes",
+                 "spool_seq")
 
     def __init__(self, channel=None):
         if isinstance(channel, EFBChannel):
             self.channel_name = channel.channel_name
             self.channel_emoji = channel.channel_emoji
             self.channel_id = channel.channel_id
+        else:
+            self.channel_name = "Empty Channel"
+            self.channel_emoji = "?"
+            self.channel_id = "emptyChannel"
+        self.source = MsgSource.User
+        self.type = MsgType.Text
+        self.member = None
+        self.origin = {
+            "name": "Origin name",
+            'alias': 'Origin alias',
+            'uid': 'Origin UID',
+        }
+        self.destination = {
+            "channel": "channel_id",
+            "name": "Destination name",
+            'alias': 'Destination alias',
+            'uid': 'Destination UID',
+        }
+        self.target = None
+        self.uid = None
+        self.text = ""
+        self.url = None
+        self.path = None
+        self._file = None
+        self.mime = None
+        self.filename = None
+        self.attributes = {}
+        self.spool_seq = None
+
+    @property
+    def file(self):
+        """
+        File object of the multimedia file.
+        Opened from `path` in "rb" mode on first access.
+
+        Returns:
+            file: The file object, `None` if N/A.
+        """
+        if self._file is None and self.path:
+            self._file = open(self.path, "rb")
+        return self._file
+
+    @file.setter
+    def file(self, value):
+        self._file = value
+
+    def close(self):
+        """
+        Close the file object if it is opened.
+        Accessing `file` again reopens it from `path`.
+        """
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __getstate__(self):
+        state = {i: getattr(self, i) for i in self.__slots__}
+        # Files on disk are reopened lazily from `path`.
+        if self.path:
+            state['_file'] = None
+        return state
+
+    def __setstate__(self, state):
+        for i in self.__slots__:
+            setattr(self, i, state.get(i, None))
@@ -21,6 +21,28 @@
 master_channel = 'plugins.eh_telegram_master', 'TelegramChannel'
 slave_channels = [('plugins.eh_wechat_slave', 'WeChatChannel')]
 
+#
+#  Message bus (optional)
+# ------------------------
+# Limits of the global message queue from slave channels to
+# the master channel. Remove to use the default values below.
+#
+# high_water_mark:
+# Maximum number of messages held in memory.
+#
+# policies / default_policy:
+# What to do with a new message when the high-water mark is
+# reached, by message type: "block", "drop", or "spill".
+# Media messages (Image, Sticker, File, Audio, Video) spill
+# to disk by default, others block.
+#
+
+message_bus = {
+    "high_water_mark": 1000,
+    "policies": {"Image": "spill", "Video": "spill"},
+    "default_policy": "block",
+}
+
 #
 #  Plugin specific settings
 # --------------------------
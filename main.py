@@ -1,14 +1,16 @@
 import config
-import queue
 import threading
 import logging
 import argparse
 import sys
 import signal
 from channel import EFBChannel
+from msgbus import MessageBus
+import transcode
+import transfer
 
-if sys.version_info.major < 3:
-    raise Exception("Python 3.x is required. Your version is %s." % sys.version)
+if sys.version_info < (3, 7):
+    raise Exception("Python 3.7 or later is required. Your version is %s." % sys.version)
 
 __version__ = "1.6.0"
 
@@ -24,8 +26,6 @@ parser.add_argument("-V", "--version", action="version",
 parser.add_argument("-l", "--log",
                     help="Set log file path.")
 
-args = parser.parse_args()
-
 q = None
 mutex = None
 slaves = []
@@ -47,6 +47,10 @@ def stop_gracefully(*args, **kwargs):
             l.debug("Stop signal sent to slave: %s" % slaves[i].channel_name)
             while slave_threads[i].is_alive():
                 pass
+    if isinstance(q, MessageBus):
+        q.close()
+    transcode.shutdown()
+    transfer.shutdown()
     sys.exit(0)
 
 
@@ -72,7 +76,9 @@ def init():
     """
     global q, slaves, master, master_thread, slave_threads, mutex
     # Init Queue, thread lock
-    q = queue.Queue()
+    q = MessageBus(**getattr(config, "message_bus", {}))
+    transcode.configure(**getattr(config, "transcode", {}))
+    transfer.configure(**getattr(config, "transfer", {}))
     mutex = threading.Lock()
     # Initialize Plug-ins Library
     # (Load libraries and modules and init them with Queue `q`)
@@ -106,27 +112,31 @@ def poll():
 PID = "/tmp/efb.pid"
 LOG = "EFB.log"
 
-if getattr(args, "V", None):
-    print("EH Forwarder Bot\n"
-          "Version: %s" % __version__)
-else:
-    if args.v == 0:
-        level = logging.ERROR
-    elif args.v == 1:
-        level = logging.INFO
-    else:
-        level = logging.DEBUG
-    logging.basicConfig(format='%(asctime)s: %(name)s [%(levelname)s]\n    %(message)s', level=level)
-    logging.getLogger('requests').setLevel(logging.CRITICAL)
-    logging.getLogger('urllib3').setLevel(logging.CRITICAL)
-    logging.getLogger('telegram.bot').setLevel(logging.CRITICAL)
-
-    signal.signal(signal.SIGINT, stop_gracefully)
-    signal.signal(signal.SIGTERM, stop_gracefully)
+# Worker processes of the transcode service import this module again.
+if __name__ == "__main__":
+    args = parser.parse_args()
 
-    if getattr(args, "log", None):
-        LOG = args.log
-        set_log_file(LOG)
-
-    init()
-    poll()
+    if getattr(args, "V", None):
+        print("EH Forwarder Bot\n"
+              "Version: %s" % __version__)
+    else:
+        if args.v == 0:
+            level = logging.ERROR
+        elif args.v == 1:
+            level = logging.INFO
+        else:
+            level = logging.DEBUG
+        logging.basicConfig(format='%(asctime)s: %(name)s [%(levelname)s]\n    %(message)s', level=level)
+        logging.getLogger('requests').setLevel(logging.CRITICAL)
+        logging.getLogger('urllib3').setLevel(logging.CRITICAL)
+        logging.getLogger('telegram.bot').setLevel(logging.CRITICAL)
+
+        signal.signal(signal.SIGINT, stop_gracefully)
+        signal.signal(signal.SIGTERM, stop_gracefully)
+
+        if getattr(args, "log", None):
+            LOG = args.log
+            set_log_file(LOG)
+
+        init()
+        poll()
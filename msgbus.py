@@ -0,0 +1,386 @@
+import collections
+import itertools
+import logging
+import os
+import pickle
+import queue
+import threading
+import time
+
+from channel import MsgType
+from spool import Spool
+
+
+class MessageBus:
+    """
+    Global message queue delivering messages from slave channels to the
+    master channel, with a bounded in-memory backlog.
+
+    `MessageBus` is a drop-in replacement of `queue.Queue` for channels:
+    `put`, `get`, `task_done`, `join`, `qsize` and `empty` behave the same.
+
+    When the number of messages held in memory reaches the high-water mark,
+    each new message is handled by the policy of its type:
+
+    * "block": `put` blocks until the master channel catches up.
+      Slave channels are slowed down accordingly.
+    * "drop": The message is discarded, and its media file is removed.
+    * "spill": The message is written to disk, and read back when it is
+      its turn. Files on disk are closed and reopened from `path`; files
+      held in memory are written with the message.
+
+    Messages are delivered in the order they are enqueued, whether held
+    in memory or spilled.
+
+    If `spool_path` is given, every message is also saved to a durable
+    `spool.Spool` when it is enqueued, and marked as done when the master
+    channel calls `ack`. Messages not acknowledged before the process stops
+    are enqueued again on the next start. Spilled messages are then read
+    back from the spool instead of separate files.
+
+    Args:
+        high_water_mark (int): Maximum number of messages held in memory.
+        policies (dict): Policy of each message type, `{MsgType: str}`.
+        default_policy (str): Policy of message types not in `policies`.
+        spill_path (str): Directory for spilled messages.
+        spool_path (str): Path to the spool journal. `None` to disable.
+        spool_fsync_interval (float): Maximum seconds before spool records
+            are synced to disk.
+        spool_compact_threshold (int): Number of delivered messages that
+            triggers compaction of the spool.
+    """
+
+    POLICIES = ("block", "drop", "spill")
+    DEFAULT_POLICIES = {
+        MsgType.Image: "spill",
+        MsgType.Sticker: "spill",
+        MsgType.File: "spill",
+        MsgType.Audio: "spill",
+        MsgType.Video: "spill",
+    }
+
+    def __init__(self, high_water_mark=1000, policies=None, default_policy="block",
+                 spill_path=os.path.join("storage", "message_bus"), spool_path=None,
+                 spool_fsync_interval=1.0, spool_compact_threshold=1000):
+        self.high_water_mark = high_water_mark
+        self.policies = self.DEFAULT_POLICIES.copy()
+        self.policies.update(policies or {})
+        self.default_policy = default_policy
+        for i in list(self.policies.values()) + [default_policy]:
+            if i not in self.POLICIES:
+                raise ValueError("Message bus policy must be one of %s, %s given." % (self.POLICIES, i))
+        self.spill_path = spill_path
+        self.logger = logging.getLogger(__name__)
+        self.mutex = threading.Lock()
+        self.not_empty = threading.Condition(self.mutex)
+        self.not_full = threading.Condition(self.mutex)
+        self.all_tasks_done = threading.Condition(self.mutex)
+        self.unfinished_tasks = 0
+        # Order of enqueue, shared by messages in memory and spilled, so
+        # that the oldest message is always delivered first.
+        self.order = itertools.count()
+        # (order, enqueue time, message)
+        self.items = collections.deque()
+        # (order, enqueue time, path to the pickled message, spool seq)
+        self.spilled = collections.deque()
+        self.spill_seq = 0
+        self.dropped = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+        self.delivered = 0
+        # Spool seqs of messages not yet acknowledged
+        self.in_flight = set()
+        self.spool = None
+        self._load_spilled()
+        if spool_path:
+            self.spool = Spool(spool_path, fsync_interval=spool_fsync_interval,
+                               compact_threshold=spool_compact_threshold)
+            self._replay_spool()
+
+    def _load_spilled(self):
+        """
+        Pick up messages spilled by a previous run.
+        """
+        if not os.path.isdir(self.spill_path):
+            return
+        for i in sorted(os.listdir(self.spill_path)):
+            if not i.endswith(".msg"):
+                continue
+            try:
+                spill_seq = int(i.split("_", 1)[0])
+            except ValueError:
+                self.logger.warning("Unknown file %s in %s is ignored.", i, self.spill_path)
+                continue
+            self.spilled.append((next(self.order), time.time(), os.path.join(self.spill_path, i), None))
+            self.spill_seq = max(self.spill_seq, spill_seq + 1)
+        self.unfinished_tasks += len(self.spilled)
+        if self.spilled:
+            self.logger.warning("%s spilled messages from previous run are recovered.", len(self.spilled))
+
+    def _replay_spool(self):
+        """
+        Enqueue messages left undelivered in the spool by a previous run.
+        """
+        pending = self.spool.replay()
+        for seq in pending:
+            if len(self.items) < self.high_water_mark and not self.spilled:
+                msg = self._load(seq)
+                self.in_flight.add(seq)
+                self.items.append((next(self.order), time.time(), msg))
+            else:
+                self.spilled.append((next(self.order), time.time(), None, seq))
+        self.unfinished_tasks += len(pending)
+        if pending:
+            self.logger.warning("%s undelivered messages from previous run are recovered from spool.", len(pending))
+
+    def policy_of(self, msg):
+        return self.policies.get(getattr(msg, "type", None), self.default_policy)
+
+    def put(self, item, block=True, timeout=None):
+        """
+        Enqueue a message.
+
+        Only the queues are updated with the bus locked. Messages are
+        saved to the spool and spilled to disk without the lock, so that a
+        slow disk does not hold back other channels and the master channel.
+
+        Args:
+            item (EFBMsg|None): The message. `None` (the stop signal) is never
+                held back by the high-water mark.
+            block (bool): Block when the policy is "block" and the bus is full.
+            timeout (float): Maximum seconds to block.
+
+        Raises:
+            queue.Full: The bus is still full after blocking.
+        """
+        if item is None:
+            with self.mutex:
+                return self._enqueue(item)
+        policy = self.policy_of(item)
+        seq = self._save(item)
+        with self.not_full:
+            if len(self.items) < self.high_water_mark:
+                return self._enqueue(item, seq)
+            if policy == "block":
+                try:
+                    self._wait_not_full(block, timeout)
+                except queue.Full:
+                    self._discard(seq)
+                    raise
+                return self._enqueue(item, seq)
+            if policy == "spill" and seq is None:
+                # Name the file while locked, so that names follow the order.
+                path = os.path.join(self.spill_path, "%012d_%s.msg" % (self.spill_seq, item.channel_id))
+                self.spill_seq += 1
+            else:
+                path = None
+        if policy == "drop":
+            return self._drop(item, seq)
+        self._spill(item, path, seq)
+
+    def _wait_not_full(self, block, timeout):
+        if not block:
+            raise queue.Full
+        if timeout is None:
+            while len(self.items) >= self.high_water_mark:
+                self.not_full.wait()
+        else:
+            end = time.time() + timeout
+            while len(self.items) >= self.high_water_mark:
+                remaining = end - time.time()
+                if remaining <= 0:
+                    raise queue.Full
+                self.not_full.wait(remaining)
+
+    def put_nowait(self, item):
+        return self.put(item, block=False)
+
+    def _save(self, msg):
+        """
+        Save a message to the spool, if enabled.
+
+        Returns:
+            int|None: Sequence number of the message in the spool.
+        """
+        if self.spool is None:
+            return None
+        msg.spool_seq = self.spool.append(msg)
+        return msg.spool_seq
+
+    def _load(self, seq):
+        """
+        Read a message back from the spool.
+        """
+        msg = self.spool.load(seq)
+        msg.spool_seq = seq
+        return msg
+
+    def _discard(self, seq):
+        """
+        Remove a message not enqueued from the spool, if saved there.
+        """
+        if seq is not None:
+            self.spool.done(seq)
+
+    def _enqueue(self, item, seq=None):
+        if seq is not None:
+            self.in_flight.add(seq)
+        self.items.append((next(self.order), time.time(), item))
+        self.unfinished_tasks += 1
+        self.not_empty.notify()
+
+    def _spill(self, msg, path, seq=None):
+        """
+        Write a message to `path`, or keep it in the spool if `seq` is
+        given, and enqueue it as spilled. Called with the bus unlocked.
+        """
+        if msg.path:
+            # Reopened from `path` when read back.
+            msg.close()
+        if seq is None:
+            if not os.path.exists(self.spill_path):
+                os.makedirs(self.spill_path, exist_ok=True)
+            with open(path, "wb") as f:
+                pickle.dump(msg, f)
+        with self.mutex:
+            self.spilled.append((next(self.order), time.time(), path, seq))
+            self.unfinished_tasks += 1
+            self.not_empty.notify()
+        self.logger.debug("%s message spilled to %s.", msg.type, path or "spool")
+
+    def _drop(self, msg, seq=None):
+        self._discard(seq)
+        with self.mutex:
+            self.dropped += 1
+        msg.close()
+        if msg.path:
+            try:
+                os.remove(msg.path)
+            except FileNotFoundError:
+                pass
+        self.logger.warning("Message bus is full, %s message from %s (%s) is dropped.",
+                            msg.type, msg.channel_id, msg.origin.get('uid', None))
+
+    def _unspill(self, path, seq):
+        """
+        Read a spilled message back. Called with the bus unlocked.
+        """
+        if seq is not None:
+            msg = self._load(seq)
+            with self.mutex:
+                self.in_flight.add(seq)
+            return msg
+        with open(path, "rb") as f:
+            msg = pickle.load(f)
+        os.remove(path)
+        return msg
+
+    def get(self, block=True, timeout=None):
+        """
+        Dequeue a message.
+
+        Args:
+            block (bool): Block until a message is available.
+            timeout (float): Maximum seconds to block.
+
+        Returns:
+            EFBMsg|None: The message.
+
+        Raises:
+            queue.Empty: No message is available.
+        """
+        with self.not_empty:
+            if not block:
+                if not self.items and not self.spilled:
+                    raise queue.Empty
+            elif timeout is None:
+                while not self.items and not self.spilled:
+                    self.not_empty.wait()
+            else:
+                end = time.time() + timeout
+                while not self.items and not self.spilled:
+                    remaining = end - time.time()
+                    if remaining <= 0:
+                        raise queue.Empty
+                    self.not_empty.wait(remaining)
+            spilled = None
+            if self.items and (not self.spilled or self.items[0][0] < self.spilled[0][0]):
+                _, enqueued, item = self.items.popleft()
+            else:
+                _, enqueued, path, seq = spilled = self.spilled.popleft()
+            latency = time.time() - enqueued
+            self.latency_total += latency
+            self.latency_max = max(self.latency_max, latency)
+            self.delivered += 1
+            self.not_full.notify()
+        if spilled is not None:
+            item = self._unspill(path, seq)
+        return item
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+    def ack(self, msg):
+        """
+        Mark a message as delivered by the master channel, so that it is
+        not delivered again after a restart.
+
+        Args:
+            msg (EFBMsg): The message returned by `get`.
+        """
+        seq = msg.spool_seq
+        if seq is None:
+            return
+        with self.mutex:
+            if seq not in self.in_flight:
+                return
+            self.in_flight.remove(seq)
+        self.spool.done(seq)
+
+    def close(self):
+        """
+        Sync and close the spool, if enabled.
+        """
+        if self.spool is not None:
+            self.spool.close()
+
+    def task_done(self):
+        with self.all_tasks_done:
+            unfinished = self.unfinished_tasks - 1
+            if unfinished <= 0:
+                if unfinished < 0:
+                    raise ValueError('task_done() called too many times')
+                self.all_tasks_done.notify_all()
+            self.unfinished_tasks = unfinished
+
+    def join(self):
+        with self.all_tasks_done:
+            while self.unfinished_tasks:
+                self.all_tasks_done.wait()
+
+    def qsize(self):
+        with self.mutex:
+            return len(self.items) + len(self.spilled)
+
+    def empty(self):
+        return not self.qsize()
+
+    def stats(self):
+        """
+        Metrics of the bus.
+
+        Returns:
+            dict: Messages in memory, spilled to disk, dropped, delivered and
+                not yet acknowledged, and average and maximum enqueue-to-dequeue latency in seconds.
+        """
+        with self.mutex:
+            return {
+                "depth": len(self.items),
+                "spilled": len(self.spilled),
+                "high_water_mark": self.high_water_mark,
+                "dropped": self.dropped,
+                "delivered": self.delivered,
+                "in_flight": len(self.in_flight),
+                "latency_avg": self.latency_total / self.delivered if self.delivered else 0.0,
+                "latency_max": self.latency_max,
+            }
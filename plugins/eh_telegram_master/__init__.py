@@ -14,16 +14,20 @@ import magic
 import os
 import re
 import mimetypes
-import pydub
 import threading
 import traceback
 import base64
+import hashlib
+import transcode
+import transfer
+import io
 from . import db, speech
 from .whitelisthandler import WhitelistHandler
+from .workers import WorkerPool
+from .ratelimit import SendScheduler, ScheduledBot
 from channel import EFBChannel, EFBMsg, MsgType, MsgSource, TargetType, ChannelType
 from channelExceptions import EFBChatNotFound, EFBMessageTypeNotSupported, EFBMessageError
 from .msgType import get_msg_type, TGMsgType
-from moviepy.editor import VideoFileClip
 
 
 class Flags:
@@ -107,7 +111,7 @@ class TelegramChannel(EFBChannel):
         Initialization.
 
         Args:
-            queue (queue.Queue): global message queue
+            queue (msgbus.MessageBus): global message queue
             slaves (dict): Dictionary of slaves
         """
         super().__init__(queue, mutex)
@@ -147,6 +151,27 @@ class TelegramChannel(EFBChannel):
         ))
         self.bot.dispatcher.add_error_handler(self.error)
         self.MUTE_CHAT_ID = self.MUTE_CHAT_ID.format(chat_id=self.channel_id)
+        self.workers = WorkerPool(size=self._flag("worker_pool_size", 8),
+                                  queue_size=self._flag("worker_queue_size", 1000),
+                                  overflow=self._flag("worker_overflow", "block"),
+                                  name=self.channel_id)
+        self.scheduler = SendScheduler(global_rate=self._flag("rate_limit_global", 30),
+                                       chat_rate=self._flag("rate_limit_chat", 1),
+                                       group_rate=self._flag("rate_limit_group", 20) / 60,
+                                       burst=self._flag("rate_limit_burst", 3),
+                                       max_retries=self._flag("rate_limit_retries", 3))
+        # Outgoing calls, including those from command handlers, are rate limited.
+        self.tg_bot = ScheduledBot(self.bot.bot, self.scheduler)
+        self.bot.dispatcher.bot = self.tg_bot
+        # chat_id: time of the last chat action, oldest first
+        self.chat_action_last = dict()
+        self.chat_action_saved = 0
+        self.chat_action_lock = threading.Lock()
+        # (method, content hash, file name): Telegram file_id
+        self.file_id_cache = utils.LRUCache(self._flag("file_id_cache_size", 4096))
+        self.speech = speech.SpeechService(getattr(config, self.channel_id))
+        if self._flag("msg_log_archive_interval", 86400):
+            self._schedule_msg_log_archive(60)
 
     # Truncate string by bytes
     # Written by Mark Tolonen
@@ -281,7 +306,7 @@ class TelegramChannel(EFBChannel):
             self.logger.debug("%s, process_msg_step_2", xid)
             append_last_msg = False
             if msg.type == MsgType.Text:
-                self.bot.bot.send_chat_action(tg_dest, telegram.ChatAction.TYPING)
+                self._chat_action(tg_dest, telegram.ChatAction.TYPING)
                 parse_mode = "HTML" if self._flag("text_as_html", False) else None
                 if tg_chat_assoced:
                     last_msg = db.get_last_msg_from_chat(tg_dest)
@@ -303,26 +328,26 @@ class TelegramChannel(EFBChannel):
                     self.logger.debug("%s, process_msg_step_3_0_1", xid)
                     msg.text = "%s\n%s" % (last_msg.text, msg.text)
                     try:
-                        tg_msg = self.bot.bot.editMessageText(chat_id=tg_dest,
+                        tg_msg = self.tg_bot.editMessageText(chat_id=tg_dest,
                                                               message_id=last_msg.master_msg_id.split(".", 1)[1],
                                                               text=msg_template + msg.text,
                                                               parse_mode=parse_mode)
                     except telegram.error.BadRequest:
-                        tg_msg = self.bot.bot.editMessageText(chat_id=tg_dest,
+                        tg_msg = self.tg_bot.editMessageText(chat_id=tg_dest,
                                                               message_id=last_msg.master_msg_id.split(".", 1)[1],
                                                               text=msg_template + msg.text)
                 else:
                     self.logger.debug("%s, process_msg_step_3_0_3", xid)
                     try:
-                        tg_msg = self.bot.bot.send_message(tg_dest,
+                        tg_msg = self.tg_bot.send_message(tg_dest,
                                                            text=msg_template + msg.text,
                                                            parse_mode=parse_mode)
                     except telegram.error.BadRequest:
-                        tg_msg = self.bot.bot.send_message(tg_dest, text=msg_template + msg.text)
+                        tg_msg = self.tg_bot.send_message(tg_dest, text=msg_template + msg.text)
                     self.logger.debug("%s, process_msg_step_3_0_4, tg_msg = %s", xid, tg_msg)
                 self.logger.debug("%s, process_msg_step_3_1", xid)
             elif msg.type == MsgType.Link:
-                self.bot.bot.send_chat_action(tg_dest, telegram.ChatAction.TYPING)
+                self._chat_action(tg_dest, telegram.ChatAction.TYPING)
                 thumbnail = urllib.parse.quote(msg.attributes["image"] or "", safe="?=&#:/")
                 thumbnail = "<a href=\"%s\">🔗</a>" % thumbnail if thumbnail else "🔗"
                 text = "%s <a href=\"%s\">%s</a>\n%s" % \
@@ -333,7 +358,7 @@ class TelegramChannel(EFBChannel):
                 if msg.text:
                     text += "\n\n" + msg.text
                 try:
-                    tg_msg = self.bot.bot.send_message(tg_dest,
+                    tg_msg = self.tg_bot.send_message(tg_dest,
                                                        text=msg_template + text,
                                                        parse_mode="HTML")
                 except telegram.error.BadRequest:
@@ -342,15 +367,16 @@ class TelegramChannel(EFBChannel):
                                                 urllib.parse.quote(msg.attributes["url"] or "", safe="?=&#:/"))
                     if msg.text:
                         text += "\n\n" + msg.text
-                    tg_msg = self.bot.bot.send_message(tg_dest, text=msg_template + msg.text)
+                    tg_msg = self.tg_bot.send_message(tg_dest, text=msg_template + msg.text)
             elif msg.type in [MsgType.Image, MsgType.Sticker]:
-                self.bot.bot.send_chat_action(tg_dest, telegram.ChatAction.UPLOAD_PHOTO)
+                size = self._file_size(msg)
+                self._chat_action(tg_dest, telegram.ChatAction.UPLOAD_PHOTO, size)
                 self.logger.debug("%s, process_msg_step_3_2", xid)
                 self.logger.debug("Received %s\nPath: %s\nMIME: %s", msg.type, msg.path, msg.mime)
-                self.logger.debug("Path: %s\nSize: %s", msg.path, os.stat(msg.path).st_size)
-                if os.stat(msg.path).st_size == 0:
-                    os.remove(msg.path)
-                    tg_msg = self.bot.bot.send_message(tg_dest,
+                self.logger.debug("Path: %s\nSize: %s", msg.path, size)
+                if size == 0:
+                    self._remove_file(msg)
+                    tg_msg = self.tg_bot.send_message(tg_dest,
                                                        msg_template + ("Error: Empty %s received. (MS01)" % msg.type))
                 else:
                     if not msg.text:
@@ -359,34 +385,36 @@ class TelegramChannel(EFBChannel):
                         elif msg.type == MsgType.Sticker:
                             msg.text = "sent a sticker."
                     if msg.mime == "image/gif":
-                        tg_msg = self.bot.bot.sendDocument(tg_dest, msg.file, caption=msg_template + msg.text)
+                        tg_msg = self._send_file("sendDocument", tg_dest, msg, caption=msg_template + msg.text)
                     else:
                         try:
-                            tg_msg = self.bot.bot.sendPhoto(tg_dest, msg.file, caption=msg_template + msg.text)
+                            tg_msg = self._send_file("sendPhoto", tg_dest, msg, caption=msg_template + msg.text)
                         except telegram.error.BadRequest:
-                            tg_msg = self.bot.bot.sendDocument(tg_dest, msg.file, caption=msg_template + msg.text)
-                    os.remove(msg.path)
+                            tg_msg = self._send_file("sendDocument", tg_dest, msg, caption=msg_template + msg.text)
+                    self._remove_file(msg)
                 self.logger.debug("%s, process_msg_step_3_3", xid)
             elif msg.type == MsgType.File:
-                self.bot.bot.send_chat_action(tg_dest, telegram.ChatAction.UPLOAD_DOCUMENT)
-                if os.stat(msg.path).st_size == 0:
-                    os.remove(msg.path)
-                    tg_msg = self.bot.bot.send_message(tg_dest,
+                size = self._file_size(msg)
+                self._chat_action(tg_dest, telegram.ChatAction.UPLOAD_DOCUMENT, size)
+                if size == 0:
+                    self._remove_file(msg)
+                    tg_msg = self.tg_bot.send_message(tg_dest,
                                                      msg_template + ("Error: Empty %s received. (MS02)" % msg.type))
                 else:
                     if not msg.filename:
-                        file_name = os.path.basename(msg.path)
+                        file_name = os.path.basename(msg.path or getattr(msg.file, "name", ""))
                         msg.text = "sent a file."
                     else:
                         file_name = msg.filename
-                    tg_msg = self.bot.bot.send_document(tg_dest, msg.file, caption=msg_template + msg.text,
-                                                        filename=file_name)
-                    os.remove(msg.path)
+                    tg_msg = self._send_file("sendDocument", tg_dest, msg, caption=msg_template + msg.text,
+                                             filename=file_name)
+                    self._remove_file(msg)
             elif msg.type == MsgType.Audio:
-                self.bot.bot.send_chat_action(tg_dest, telegram.ChatAction.RECORD_AUDIO)
-                if os.stat(msg.path).st_size == 0:
-                    os.remove(msg.path)
-                    return self.bot.bot.send_message(tg_dest,
+                size = self._file_size(msg)
+                self._chat_action(tg_dest, telegram.ChatAction.RECORD_AUDIO, size)
+                if size == 0:
+                    self._remove_file(msg)
+                    return self.tg_bot.send_message(tg_dest,
                                                      msg_template + ("Error: Empty %s received. (MS03)" % msg.type))
                 msg.text = msg.text or ''
                 self.logger.debug("%s, process_msg_step_4_1, no_conversion = %s", xid,
@@ -394,48 +422,44 @@ class TelegramChannel(EFBChannel):
                 if self._flag("no_conversion", False):
                     self.logger.debug("%s, process_msg_step_4_2, mime = %s", xid, msg.mime)
                     if msg.mime == "audio/mpeg":
-                        tg_msg = self.bot.bot.sendAudio(tg_dest, msg.file, caption=msg_template + msg.text)
+                        tg_msg = self._send_file("sendAudio", tg_dest, msg, caption=msg_template + msg.text)
                     else:
-                        tg_msg = self.bot.bot.sendDocument(tg_dest, msg.file, caption=msg_template + msg.text)
+                        tg_msg = self._send_file("sendDocument", tg_dest, msg, caption=msg_template + msg.text)
                 else:
-                    pydub.AudioSegment.from_file(msg.file).export("%s.ogg" % msg.path,
-                                                                  format="ogg",
-                                                                  codec="libopus",
-                                                                  bitrate="65536")
-                    ogg_file = open("%s.ogg" % msg.path, 'rb')
-                    tg_msg = self.bot.bot.sendVoice(tg_dest, ogg_file, caption=msg_template + msg.text)
-                    os.remove("%s.ogg" % msg.path)
-                os.remove(msg.path)
+                    tg_msg = self._send_file("sendVoice", tg_dest, msg, convert=self._convert_voice,
+                                             caption=msg_template + msg.text)
+                self._remove_file(msg)
             elif msg.type == MsgType.Location:
-                self.bot.bot.send_chat_action(tg_dest, telegram.ChatAction.FIND_LOCATION)
+                self._chat_action(tg_dest, telegram.ChatAction.FIND_LOCATION)
                 self.logger.info("---\nsending venue\nlat: %s, long: %s\ntitle: %s\naddr: %s",
                                  msg.attributes['latitude'], msg.attributes['longitude'], msg.text, msg_template + "")
-                tg_msg = self.bot.bot.sendVenue(tg_dest, latitude=msg.attributes['latitude'],
+                tg_msg = self.tg_bot.sendVenue(tg_dest, latitude=msg.attributes['latitude'],
                                                 longitude=msg.attributes['longitude'], title=msg.text,
                                                 address=msg_template + "")
             elif msg.type == MsgType.Video:
-                self.bot.bot.send_chat_action(tg_dest, telegram.ChatAction.UPLOAD_VIDEO)
-                if os.stat(msg.path).st_size == 0:
-                    os.remove(msg.path)
-                    return self.bot.bot.send_message(tg_dest, msg_template + ("Error: Empty %s recieved" % msg.type))
+                size = self._file_size(msg)
+                self._chat_action(tg_dest, telegram.ChatAction.UPLOAD_VIDEO, size)
+                if size == 0:
+                    self._remove_file(msg)
+                    return self.tg_bot.send_message(tg_dest, msg_template + ("Error: Empty %s recieved" % msg.type))
                 if not msg.text:
                     msg.text = "sent a video."
-                tg_msg = self.bot.bot.sendVideo(tg_dest, msg.file, caption=msg_template + msg.text)
-                os.remove(msg.path)
+                tg_msg = self._send_file("sendVideo", tg_dest, msg, caption=msg_template + msg.text)
+                self._remove_file(msg)
             elif msg.type == MsgType.Command:
-                self.bot.bot.send_chat_action(tg_dest, telegram.ChatAction.TYPING)
+                self._chat_action(tg_dest, telegram.ChatAction.TYPING)
                 buttons = []
                 for i, ival in enumerate(msg.attributes['commands']):
                     buttons.append([telegram.InlineKeyboardButton(ival['name'], callback_data=str(i))])
-                tg_msg = self.bot.bot.send_message(tg_dest, msg_template + msg.text,
+                tg_msg = self.tg_bot.send_message(tg_dest, msg_template + msg.text,
                                                    reply_markup=telegram.InlineKeyboardMarkup(buttons))
                 self.msg_status["%s.%s" % (tg_dest, tg_msg.message_id)] = Flags.COMMAND_PENDING
                 self.msg_storage["%s.%s" % (tg_dest, tg_msg.message_id)] = {"channel": msg.channel_id,
                                                                             "text": msg_template + msg.text,
                                                                             "commands": msg.attributes['commands']}
             else:
-                self.bot.bot.send_chat_action(tg_dest, telegram.ChatAction.TYPING)
-                tg_msg = self.bot.bot.send_message(tg_dest, msg_template + "Unsupported incoming message type. (UT01)")
+                self._chat_action(tg_dest, telegram.ChatAction.TYPING)
+                tg_msg = self.tg_bot.send_message(tg_dest, msg_template + "Unsupported incoming message type. (UT01)")
             self.logger.debug("%s, process_msg_step_4", xid)
             if msg.source in (MsgSource.User, MsgSource.Group):
                 msg_log = {"master_msg_id": "%s.%s" % (tg_msg.chat.id, tg_msg.message_id),
@@ -454,6 +478,200 @@ class TelegramChannel(EFBChannel):
         except Exception as e:
             self.logger.error(repr(e) + traceback.format_exc())
 
+    def deliver_msg(self, msg):
+        """
+        Process a message from the global message queue, close its file,
+        and acknowledge it to the queue when done, so that it is not
+        delivered again after restart.
+
+        Args:
+            msg (EFBMsg): The message.
+        """
+        try:
+            self.process_msg(msg)
+        finally:
+            msg.close()
+            self.queue.ack(msg)
+
+    @staticmethod
+    def _file_size(msg):
+        """
+        Size of the file of a message, on disk or in memory.
+
+        Args:
+            msg (EFBMsg): The message.
+
+        Returns:
+            int: Size in bytes, 0 if the file is not available.
+        """
+        if msg.path:
+            try:
+                return os.stat(msg.path).st_size
+            except OSError:
+                return 0
+        if msg.file is None:
+            return 0
+        if isinstance(msg.file, io.BytesIO):
+            return len(msg.file.getbuffer())
+        position = msg.file.tell()
+        size = msg.file.seek(0, io.SEEK_END)
+        msg.file.seek(position)
+        return size
+
+    @staticmethod
+    def _file_hash(file):
+        """
+        Hash of the content of a file object, read from the start.
+        The file is rewound afterwards.
+
+        Args:
+            file: The file object.
+
+        Returns:
+            str: Hex digest of the content.
+        """
+        file.seek(0)
+        if isinstance(file, io.BytesIO):
+            digest = hashlib.sha1(file.getbuffer()).hexdigest()
+        else:
+            h = hashlib.sha1()
+            for chunk in iter(lambda: file.read(65536), b""):
+                h.update(chunk)
+            digest = h.hexdigest()
+        file.seek(0)
+        return digest
+
+    @staticmethod
+    def _sent_file_id(tg_msg):
+        """
+        `file_id` of the media in a message sent to Telegram.
+
+        Args:
+            tg_msg (telegram.Message): The message.
+
+        Returns:
+            str: The `file_id`, `None` if the message has no media.
+        """
+        if tg_msg.photo:
+            return tg_msg.photo[-1].file_id
+        for i in ("document", "video", "audio", "voice", "sticker"):
+            media = getattr(tg_msg, i, None)
+            if media:
+                return media.file_id
+        return None
+
+    @staticmethod
+    def _convert_voice(file):
+        """
+        Convert an audio file to a voice message in OGG Opus,
+        in the transcode process pool.
+
+        Args:
+            file: The audio file object.
+
+        Returns:
+            io.BytesIO: The converted file.
+        """
+        ogg_file = io.BytesIO(transcode.get_service().run(transcode.audio_to_ogg, file.read()))
+        ogg_file.name = "voice.ogg"
+        return ogg_file
+
+    def _send_file(self, method, chat_id, msg, convert=None, **kwargs):
+        """
+        Send the file of a message with a Bot API method. If a file with
+        the same content and original file name was sent with the same
+        method before, it is sent again by its `file_id`, without uploading
+        or converting it again.
+
+        Args:
+            method (str): Name of the Bot API method, e.g. `"sendPhoto"`.
+            chat_id (int): Telegram chat ID.
+            msg (EFBMsg): The message.
+            convert (callable): Convert the file object before uploading.
+            **kwargs: Other arguments of the method.
+
+        Returns:
+            telegram.Message: The message sent.
+        """
+        send = getattr(self.tg_bot, method)
+        # Names made up for files without one differ for each message.
+        key = (method, self._file_hash(msg.file), msg.filename)
+        file_id = self.file_id_cache.get(key)
+        if file_id is not None:
+            try:
+                return send(chat_id, file_id, **kwargs)
+            except telegram.error.BadRequest:
+                self.logger.debug("Cached file_id %s is rejected, uploading again.", file_id)
+                self.file_id_cache.pop(key)
+        file = convert(msg.file) if convert else msg.file
+        tg_msg = send(chat_id, file, **kwargs)
+        file_id = self._sent_file_id(tg_msg)
+        if file_id:
+            self.file_id_cache.put(key, file_id)
+        return tg_msg
+
+    @staticmethod
+    def _remove_file(msg):
+        """
+        Remove the file of a message from disk, if it is saved on disk.
+
+        Args:
+            msg (EFBMsg): The message.
+        """
+        if msg.path:
+            msg.close()
+            try:
+                os.remove(msg.path)
+            except FileNotFoundError:
+                pass
+
+    def _chat_action(self, chat_id, action, size=None):
+        """
+        Send a chat action only when it is worth a Bot API call: for a media
+        upload larger than `chat_action_min_size`, or for other messages when
+        no action was sent to the chat in the last `chat_action_interval`
+        seconds. Nothing is sent when calls are waiting in the send scheduler.
+
+        Args:
+            chat_id (int): Telegram chat ID.
+            action (str): Chat action, from `telegram.ChatAction`.
+            size (int): Size of the file to be uploaded, if any.
+        """
+        send = size is not None and size >= self._flag("chat_action_min_size", 524288)
+        interval = self._flag("chat_action_interval", 5)
+        with self.chat_action_lock:
+            now = time.time()
+            if size is None:
+                send = now - self.chat_action_last.get(chat_id, 0) >= interval
+            if not send or self.scheduler.backlog():
+                self.chat_action_saved += 1
+                return
+            # Actions older than the interval do not hold back any other.
+            while self.chat_action_last:
+                oldest = next(iter(self.chat_action_last))
+                if now - self.chat_action_last[oldest] < interval:
+                    break
+                del self.chat_action_last[oldest]
+            self.chat_action_last.pop(chat_id, None)
+            self.chat_action_last[chat_id] = now
+        self.tg_bot.send_chat_action(chat_id, action)
+
+    def _schedule_msg_log_archive(self, delay):
+        timer = threading.Timer(delay, self.archive_msg_log)
+        timer.daemon = True
+        timer.start()
+
+    def archive_msg_log(self):
+        """
+        Move old message logs to archives on the database writer thread,
+        and schedule the next run after `msg_log_archive_interval` seconds.
+        """
+        db.write(db.archive_msg_log,
+                 self._flag("msg_log_retention_days", 180),
+                 self._flag("msg_log_max_rows", 0),
+                 atomic=False)
+        self._schedule_msg_log_archive(self._flag("msg_log_archive_interval", 86400))
+
     @staticmethod
     def _db_slave_chat_info_as_dict(channel_id, chat_id):
         d = db.get_slave_chat_info(slave_channel_id=channel_id, slave_chat_uid=chat_id)
@@ -546,7 +764,7 @@ class TelegramChannel(EFBChannel):
                 "channels": channels.copy()
             }
 
-        threading.Thread(target=self._db_update_slave_chats_cache, args=(chats.copy(), )).start()
+        db.write(self._db_update_slave_chats_cache, chats.copy())
 
         for ch in channels:
             legend.append("%s: %s" % (channels[ch]['channel_emoji'], channels[ch]['channel_name']))
@@ -587,18 +805,17 @@ class TelegramChannel(EFBChannel):
         """
         Update all slave chats info cache to database. Triggered by retrieving
         the entire list of chats from all slaves by the method `slave_chats_pagination`.
+        Run on the database writer thread with `db.write`.
 
         Args:
             chats (list of dict): a list of dicts generated by method `_make_chat_dict`
         """
-        for i in chats:
-            db.set_slave_chat_info(slave_channel_id=i['channel_id'],
-                                   slave_channel_name=i['channel_name'],
-                                   slave_channel_emoji=i['channel_emoji'],
-                                   slave_chat_uid=i['chat_uid'],
-                                   slave_chat_name=i['chat_name'],
-                                   slave_chat_alias=i['chat_alias'],
-                                   slave_chat_type=i['type'])
+        db.set_slave_chat_info_bulk([{"slave_channel_id": i['channel_id'],
+                                      "slave_channel_emoji": i['channel_emoji'],
+                                      "slave_chat_uid": i['chat_uid'],
+                                      "slave_chat_name": i['chat_name'],
+                                      "slave_chat_alias": i['chat_alias'],
+                                      "slave_chat_type": i['type']} for i in chats])
 
     def _make_chat_dict(self, channel, chat, rfilter=None):
         """
@@ -851,6 +1068,24 @@ class TelegramChannel(EFBChannel):
                 msg += "\n- %s %s (%s)" % (self.slaves[i].channel_emoji,
                                            self.slaves[i].channel_name,
                                            i)
+            stats = self.workers.stats()
+            msg += "\n\nWorker pool: {busy}/{size} busy ({saturation:.0%}), {queued} queued, " \
+                   "{dropped} dropped, longest lane {lane_max}.\nQueue wait: {wait_avg:.2f}s avg, {wait_max:.2f}s max.".format(**stats)
+            stats = self.queue.stats()
+            msg += "\nMessage bus: {depth}/{high_water_mark} in memory, {spilled} spilled, {dropped} dropped.\n" \
+                   "Bus latency: {latency_avg:.2f}s avg, {latency_max:.2f}s max.".format(**stats)
+            stats = self.scheduler.stats()
+            msg += "\nSend scheduler: {sent} sent, {backlog} waiting, {retries} retried, " \
+                   "{wait_avg:.2f}s avg wait.".format(**stats)
+            msg += "\nChat actions skipped: %s." % self.chat_action_saved
+            stats = transcode.get_service().stats()
+            msg += "\nTranscoding: {running}/{queue_size} jobs on {workers} processes, {submitted} submitted, " \
+                   "{failed} failed, {timeouts} timed out.".format(**stats)
+            stats = transfer.get_engine().stats()
+            msg += "\nTransfers: {transfers} to {hosts} hosts, {retried} retried, {failed} failed.".format(**stats)
+            stats = self.file_id_cache.stats()
+            msg += "\nFile ID cache: {size}/{maxsize} files, {hits} reused, " \
+                   "{hit_ratio:.0%} hit ratio.".format(**stats)
         else:
             links = db.get_chat_assoc(master_uid="%s.%s" % (self.channel_id, update.message.chat_id))
             if links:  # Linked chat
@@ -863,7 +1098,7 @@ class TelegramChannel(EFBChannel):
                     try:
                         if not d:
                             d = self.slaves[channel_id].get_chat(chat_id)
-                            self._db_update_slave_chats_cache([self._make_chat_dict(self.slaves[channel_id], d, None)])
+                            db.write(self._db_update_slave_chats_cache, [self._make_chat_dict(self.slaves[channel_id], d, None)])
                         msg += "\n- {channel_emoji}{chat_type_emoji} {channel_name}: {chat_name}".format(
                             channel_emoji=self.slaves[channel_id].channel_emoji,
                             chat_type_emoji=utils.Emojis.get_source_emoji(d['type']),
@@ -1285,12 +1520,10 @@ class TelegramChannel(EFBChannel):
                 m.type = MsgType.Image
                 m.text = update.message.caption
                 m.path, m.mime = self._download_file(update.message, update.message.photo[-1], m.type)
-                m.file = open(m.path, "rb")
             elif mtype == TGMsgType.Sticker:
                 m.type = MsgType.Sticker
                 m.text = ""
                 m.path, m.mime = self._download_file(update.message, update.message.sticker, m.type)
-                m.file = open(m.path, "rb")
             elif mtype == TGMsgType.Document:
                 m.text = update.message.caption
                 self.logger.debug("tg: Document file received")
@@ -1303,12 +1536,10 @@ class TelegramChannel(EFBChannel):
                     m.type = MsgType.File
                     m.path, m.mime = self._download_file(update.message, update.message.document, m.type)
                     m.mime = update.message.document.mime_type or m.mime
-                m.file = open(m.path, "rb")
             elif mtype == TGMsgType.Video:
                 m.type = MsgType.Video
                 m.text = update.message.caption
                 m.path, m.mime = self._download_file(update.message, update.message.video, m.type)
-                m.file = open(m.path, "rb")
             elif mtype == TGMsgType.Audio:
                 m.type = MsgType.Audio
                 m.text = "%s - %s\n%s" % (
@@ -1375,10 +1606,10 @@ class TelegramChannel(EFBChannel):
         file_id = file_obj.file_id
         if size and size > telegram.constants.MAX_FILESIZE_DOWNLOAD:
             raise EFBMessageError("Attachment is too large. Maximum 20 MB. (AT01)")
-        f = self.bot.bot.getFile(file_id)
+        f = self.tg_bot.getFile(file_id)
         fname = "%s_%s_%s_%s" % (msg_type, tg_msg.chat.id, tg_msg.message_id, int(time.time()))
         fullpath = os.path.join(path, fname)
-        f.download(fullpath)
+        transfer.get_engine().download(f.file_path, fullpath).result()
         mime = getattr(file_obj, "mime_type", magic.from_file(fullpath, mime=True))
         if type(mime) is bytes:
             mime = mime.decode()
@@ -1403,7 +1634,7 @@ class TelegramChannel(EFBChannel):
             tuple of str[2]: Full path of the file, MIME type
         """
         fullpath, mime = self._download_file(tg_msg, file_id, msg_type)
-        VideoFileClip(fullpath).write_gif(fullpath + ".gif", program="ffmpeg")
+        transcode.get_service().run(transcode.video_to_gif, fullpath, fullpath + ".gif")
         return fullpath + ".gif", "image/gif"
 
     def start(self, bot, update, args=[]):
@@ -1478,16 +1709,6 @@ class TelegramChannel(EFBChannel):
             update: Message update
             args: Arguments from message
         """
-
-        class speechNotImplemented:
-            lang_list = []
-
-            def __init__(self, *args, **kwargs):
-                pass
-
-            def recognize(self, *args, **kwargs):
-                return ["Not enabled or error in configuration."]
-
         if not getattr(update.message, "reply_to_message", None):
             txt = "/recog [lang_code]\nReply to a voice with this command to recognize it.\n" \
                   "mples:\n/recog\n/recog zh\n/recog en\n(RS01)"
@@ -1495,56 +1716,114 @@ class TelegramChannel(EFBChannel):
         if not getattr(update.message.reply_to_message, "voice"):
             return self._reply_error(bot, update,
                                      "Reply only to a voice with this command to recognize it. (RS02)")
-        try:
-            baidu_speech = speech.BaiduSpeech(getattr(config, self.channel_id)['baidu_speech_api'])
-        except:
-            baidu_speech = speechNotImplemented()
-        try:
-            bing_speech = speech.BingSpeech(getattr(config, self.channel_id)['bing_speech_api'])
-        except:
-            bing_speech = speechNotImplemented()
+        baidu_speech = self.speech.baidu
+        bing_speech = self.speech.bing
         if len(args) > 0 and (args[0][:2] not in ['zh', 'en', 'ja'] and args[0] not in bing_speech.lang_list):
             return self._reply_error(bot, update, "Language is not supported. Try with zh, ja or en. (RS03)")
         if update.message.reply_to_message.voice.duration > 60:
             return self._reply_error(bot, update, "Only voice shorter than 60s is supported. (RS04)")
-        path, mime = self._download_file(update.message, update.message.reply_to_message.voice, MsgType.Audio)
-
-        results = {}
+        requests = []
         if len(args) == 0:
-            results['Baidu (English)'] = baidu_speech.recognize(path, "en")
-            results['Baidu (Mandarin)'] = baidu_speech.recognize(path, "zh")
-            results['Bing (English)'] = bing_speech.recognize(path, "en-US")
-            results['Bing (Mandarin)'] = bing_speech.recognize(path, "zh-CN")
-            results['Bing (Japanese)'] = bing_speech.recognize(path, "ja-JP")
+            requests.append(('Baidu (English)', baidu_speech, "en"))
+            requests.append(('Baidu (Mandarin)', baidu_speech, "zh"))
+            requests.append(('Bing (English)', bing_speech, "en-US"))
+            requests.append(('Bing (Mandarin)', bing_speech, "zh-CN"))
+            requests.append(('Bing (Japanese)', bing_speech, "ja-JP"))
         elif args[0][:2] == 'zh':
-            results['Baidu (Mandarin)'] = baidu_speech.recognize(path, "zh")
+            requests.append(('Baidu (Mandarin)', baidu_speech, "zh"))
             if args[0] in bing_speech.lang_list:
-                results['Bing (%s)' % args[0]] = bing_speech.recognize(path, args[0])
+                requests.append(('Bing (%s)' % args[0], bing_speech, args[0]))
             else:
-                results['Bing (Mandarin)'] = bing_speech.recognize(path, "zh-CN")
+                requests.append(('Bing (Mandarin)', bing_speech, "zh-CN"))
         elif args[0][:2] == 'en':
-            results['Baidu (English)'] = baidu_speech.recognize(path, "en")
+            requests.append(('Baidu (English)', baidu_speech, "en"))
             if args[0] in bing_speech.lang_list:
-                results['Bing (%s)' % args[0]] = bing_speech.recognize(path, args[0])
+                requests.append(('Bing (%s)' % args[0], bing_speech, args[0]))
             else:
-                results['Bing (English)'] = bing_speech.recognize(path, "en-US")
+                requests.append(('Bing (English)', bing_speech, "en-US"))
         elif args[0][:2] == 'ja':
-            results['Bing (Japanese)'] = bing_speech.recognize(path, "ja-JP")
+            requests.append(('Bing (Japanese)', bing_speech, "ja-JP"))
         elif args[0][:2] == 'ct':
-            results['Baidu (Cantonese)'] = baidu_speech.recognize(path, "ct")
+            requests.append(('Baidu (Cantonese)', baidu_speech, "ct"))
         elif args[0] in bing_speech.lang_list:
-            results['Bing (%s)' % args[0]] = bing_speech.recognize(path, args[0])
+            requests.append(('Bing (%s)' % args[0], bing_speech, args[0]))
+
+        # Results are cached by (content hash, engine, language), and the
+        # content hash by the file on Telegram, so that a voice recognized
+        # before is neither downloaded nor recognized again.
+        voice = update.message.reply_to_message.voice
+        file_key = getattr(voice, "file_unique_id", None) or voice.file_id
+        ttl = self._flag("speech_cache_ttl", 2592000)
+        results = {i[0]: None for i in requests}
+        keys = {}
+        for label, engine, lang in requests:
+            if isinstance(engine, speech.SpeechNotImplemented):
+                # Nothing to download or recognize for engines not configured.
+                results[label] = engine.recognize()
+            else:
+                keys[label] = (type(engine).__name__, lang)
+        requests = [i for i in requests if i[0] in keys]
+
+        def use_cache(audio_hash):
+            cached = db.get_speech_results(audio_hash, keys.values(), ttl)
+            for label in keys:
+                results[label] = cached.get(keys[label], None)
+            return [i for i in requests if results[i[0]] is None]
+
+        audio_hash = db.get_voice_hash(file_key)
+        known = audio_hash is not None
+        pending = use_cache(audio_hash) if known else requests
+        pcm = None
+        if pending:
+            path, mime = self._download_file(update.message, voice, MsgType.Audio)
+            try:
+                with open(path, "rb") as f:
+                    audio_hash = hashlib.sha1(f.read()).hexdigest()
+                pending = use_cache(audio_hash)
+                if pending:
+                    pcm = self.speech.decode(path)
+            finally:
+                os.remove(path)
+
+        # Results are shown in the reply as soon as each of them arrives.
+        chat_id = update.message.reply_to_message.chat.id
+        reply = bot.send_message(chat_id, self._speech_results_text(results),
+                                 reply_to_message_id=update.message.reply_to_message.message_id,
+                                 parse_mode=telegram.ParseMode.MARKDOWN)
+        new_results = {}
+        for label, result in self.speech.recognize(pcm, pending):
+            results[label] = result
+            if label in keys and result and result[0] != "ERROR!":
+                new_results[keys[label]] = result
+            bot.edit_message_text(self._speech_results_text(results),
+                                  chat_id=chat_id,
+                                  message_id=reply.message_id,
+                                  parse_mode=telegram.ParseMode.MARKDOWN)
+        if new_results or (audio_hash and not known):
+            db.add_speech_results(file_key, audio_hash, new_results, ttl=ttl,
+                                  max_rows=self._flag("speech_cache_size", 10000))
 
+    @staticmethod
+    def _speech_results_text(results):
+        """
+        Text of results of speech recognition.
+
+        Args:
+            results (dict): Results of each engine and language,
+                `None` for those not yet done.
+
+        Returns:
+            str: The text in Markdown.
+        """
         msg = ""
         for i in results:
             msg += "\n*%s*:\n" % i
+            if results[i] is None:
+                msg += "_Recognizing..._\n"
+                continue
             for j in results[i]:
                 msg += "%s\n" % j
-        msg = "Results:\n%s" % msg
-        bot.send_message(update.message.reply_to_message.chat.id, msg,
-                        reply_to_message_id=update.message.reply_to_message.message_id,
-                        parse_mode=telegram.ParseMode.MARKDOWN)
-        os.remove(path)
+        return "Results:\n%s" % msg
 
     def poll(self):
         """
@@ -1557,9 +1836,10 @@ class TelegramChannel(EFBChannel):
                 if m is None:
                     break
                 self.logger.info("Got message from queue\nType: %s\nText: %s\n----" % (m.type, m.text))
-                threading.Thread(target=self.process_msg, args=(m,)).start()
+                if not self.workers.submit(self.deliver_msg, m, key="%s.%s" % (m.channel_id, m.origin['uid'])):
+                    self.queue.ack(m)
                 self.queue.task_done()
-                self.logger.info("Msg sent to TG, task_done marked.")
+                self.logger.info("Msg submitted to worker pool, task_done marked.")
             except Exception as e:
                 self.logger.error("Error occurred during message polling")
                 self.logger.error(repr(e))
@@ -1567,6 +1847,8 @@ class TelegramChannel(EFBChannel):
                 self.poll()
 
         self.logger.debug("Gracefully stopping %s (%s).", self.channel_name, self.channel_id)
+        self.workers.shutdown()
+        db.flush()
         self.bot.stop()
         self.logger.debug("%s (%s) gracefully stopped.", self.channel_name, self.channel_id)
 
@@ -1,15 +1,71 @@
 import os
+import atexit
 import inspect
 import logging
 import datetime
+import glob
+import json
+import queue
+import sqlite3
+import threading
+import config
 from peewee import *
 from playhouse.migrate import *
 
 basePath = os.path.dirname(os.path.abspath(inspect.stack()[0][1]))
 
-db = SqliteDatabase(basePath + '/tgdata.db')
+
+def _flag(key, value):
+    """
+    Retrieve value for experimental flags of ETM.
+
+    Args:
+        key: Key of the flag.
+        value: Default/fallback value.
+
+    Returns:
+        Value for the flag.
+    """
+    return getattr(config, "eh_telegram_master", dict()).get('flags', dict()).get(key, value)
+
+
+if _flag("db_wal", True):
+    # Readers are not blocked by the writer in WAL mode,
+    # and `synchronous = NORMAL` is durable enough with WAL.
+    _pragmas = (('journal_mode', 'wal'),
+                ('synchronous', 'normal'),
+                ('cache_size', -_flag("db_cache_size", 16384)),
+                ('mmap_size', _flag("db_mmap_size", 268435456)),
+                ('busy_timeout', 5000))
+else:
+    _pragmas = ()
+
+db = SqliteDatabase(basePath + '/tgdata.db', pragmas=_pragmas)
 logger = logging.getLogger("plugins.eh_telegram_master.db")
 
+# Writes queued for the writer thread, (callable, args, atomic).
+_write_queue = queue.Queue()
+_write_batch = _flag("db_write_batch", 100)
+_writer = None
+
+# Monthly archives of old message logs, "msglog-%Y-%m.db".
+archivePath = os.path.join(basePath, "archive")
+_MSG_LOG_COLUMNS = ("master_msg_id", "slave_message_id", "text", "slave_origin_uid", "slave_origin_display_name",
+                    "slave_member_uid", "slave_member_display_name", "msg_type", "sent_to", "time", "master_chat_id")
+
+# Message logs added but not yet written, master_msg_id: MsgLog.
+_pending_lock = threading.Lock()
+_pending_msg_log = {}
+
+# UPSERT (`INSERT ... ON CONFLICT DO UPDATE`) is supported since SQLite 3.24.0.
+_upsert = sqlite3.sqlite_version_info >= (3, 24, 0)
+
+# In-memory index of chat associations, both ways.
+# Written through by `add_chat_assoc` and `remove_chat_assoc`.
+_assoc_lock = threading.RLock()
+_assoc_by_master = {}  # master_uid: [slave_uid]
+_assoc_by_slave = {}  # slave_uid: [master_uid]
+
 # Peewee Models
 
 class BaseModel(Model):
@@ -19,8 +75,8 @@ class BaseModel(Model):
 
 
 class ChatAssoc(BaseModel):
-    master_uid = TextField()
-    slave_uid = TextField()
+    master_uid = TextField(index=True)
+    slave_uid = TextField(index=True)
 
 
 class MsgLog(BaseModel):
@@ -34,6 +90,12 @@ class MsgLog(BaseModel):
     msg_type = TextField()
     sent_to = TextField()
     time = DateTimeField(default=datetime.datetime.now, null=True)
+    master_chat_id = TextField(null=True)
+
+    class Meta:
+        indexes = (
+            (('master_chat_id', 'time'), False),
+        )
 
 
 class SlaveChatInfo(BaseModel):
@@ -44,12 +106,36 @@ class SlaveChatInfo(BaseModel):
     slave_chat_alias = TextField(null=True)
     slave_chat_type = CharField()
 
+    class Meta:
+        indexes = (
+            (('slave_channel_id', 'slave_chat_uid'), True),
+        )
+
+
+class SpeechResult(BaseModel):
+    audio_hash = TextField()
+    engine = TextField()
+    lang = TextField()
+    result = TextField()  # JSON list of str
+    time = DateTimeField(default=datetime.datetime.now, index=True)
+
+    class Meta:
+        indexes = (
+            (('audio_hash', 'engine', 'lang'), True),
+        )
+
+
+class VoiceFile(BaseModel):
+    file_key = TextField(primary_key=True)
+    audio_hash = TextField()
+    time = DateTimeField(default=datetime.datetime.now, index=True)
+
 
 def _create():
     """
     Initializing tables.
     """
-    db.create_tables([ChatAssoc, MsgLog, SlaveChatInfo])
+    db.create_tables([ChatAssoc, MsgLog, SlaveChatInfo, SpeechResult, VoiceFile])
 
 
 def _migrate(i):
@@ -73,11 +159,76 @@ def _migrate(i):
         # 2017FEB25
         SlaveChatInfo.create_table()
         migrate(migrator.add_column("msglog", "slave_message_id", CharField(default="__none__")))
-
+    elif i == 2:
+        # Migration 2:
+        # Add indexes on chat links and slave chat info.
+        # Add column master_chat_id in MsgLog table, populated from master_msg_id,
+        # and indexed with time.
+        # 2017AUG20
+        with db.atomic():
+            migrate(migrator.add_column("msglog", "master_chat_id", TextField(null=True)))
+            db.execute_sql("UPDATE msglog SET master_chat_id = "
+                           "substr(master_msg_id, 1, instr(master_msg_id, '.') - 1)")
+            # SlaveChatInfo may be created with its index by migration 1.
+            db.execute_sql("CREATE INDEX IF NOT EXISTS chatassoc_master_uid ON chatassoc (master_uid)")
+            db.execute_sql("CREATE INDEX IF NOT EXISTS chatassoc_slave_uid ON chatassoc (slave_uid)")
+            db.execute_sql("CREATE INDEX IF NOT EXISTS slavechatinfo_slave_channel_id_slave_chat_uid "
+                           "ON slavechatinfo (slave_channel_id, slave_chat_uid)")
+            db.execute_sql("CREATE INDEX IF NOT EXISTS msglog_master_chat_id_time ON msglog (master_chat_id, time)")
+    elif i == 3:
+        # Migration 3:
+        # Make (slave_channel_id, slave_chat_uid) of SlaveChatInfo unique,
+        # keeping the latest of duplicate entries.
+        # 2017AUG27
+        with db.atomic():
+            db.execute_sql("DELETE FROM slavechatinfo WHERE id NOT IN "
+                           "(SELECT MAX(id) FROM slavechatinfo GROUP BY slave_channel_id, slave_chat_uid)")
+            db.execute_sql("DROP INDEX IF EXISTS slavechatinfo_slave_channel_id_slave_chat_uid")
+            db.execute_sql("CREATE UNIQUE INDEX slavechatinfo_slave_channel_id_slave_chat_uid "
+                           "ON slavechatinfo (slave_channel_id, slave_chat_uid)")
+    elif i == 4:
+        # Migration 4:
+        # Add tables: SpeechResult, VoiceFile
+        # 2017SEP03
+        db.create_tables([SpeechResult, VoiceFile], safe=True)
+    elif i == 5:
+        # Migration 5:
+        # Switch to incremental auto vacuum, so that space freed by message
+        # log archival is reclaimed in small steps.
+        # Takes a full VACUUM, which cannot be run in a transaction.
+        # 2017SEP10
+        logger.info("Switching tgdata.db to incremental auto vacuum.")
+        db.execute_sql("PRAGMA auto_vacuum = INCREMENTAL")
+        db.execute_sql("VACUUM")
     else:
         return False
 
 
+def _load_chat_assoc():
+    """
+    Load all chat associations into the in-memory index.
+    """
+    with _assoc_lock:
+        _assoc_by_master.clear()
+        _assoc_by_slave.clear()
+        for i in ChatAssoc.select().order_by(ChatAssoc.id):
+            _assoc_by_master.setdefault(i.master_uid, []).append(i.slave_uid)
+            _assoc_by_slave.setdefault(i.slave_uid, []).append(i.master_uid)
+
+
+def _uncache_chat_assoc(index, counterpart, uid):
+    """
+    Remove all associations of `uid` from `index`, and from the
+    `counterpart` index.
+    """
+    for i in index.pop(uid, []):
+        uids = counterpart.get(i, [])
+        while uid in uids:
+            uids.remove(uid)
+        if not uids:
+            counterpart.pop(i, None)
+
+
 def add_chat_assoc(master_uid, slave_uid, multiple_slave=False):
     """
     Add chat associations (chat links).
@@ -87,10 +238,14 @@ def add_chat_assoc(master_uid, slave_uid, multiple_slave=False):
         master_uid (str): Master channel UID ("%(chat_id)s")
         slave_uid (str): Slave channel UID ("%(channel_id)s.%(chat_id)s")
     """
-    if not multiple_slave:
-        remove_chat_assoc(master_uid=master_uid)
-    remove_chat_assoc(slave_uid=slave_uid)
-    return ChatAssoc.create(master_uid=master_uid, slave_uid=slave_uid)
+    with _assoc_lock:
+        if not multiple_slave:
+            remove_chat_assoc(master_uid=master_uid)
+        remove_chat_assoc(slave_uid=slave_uid)
+        assoc = ChatAssoc.create(master_uid=master_uid, slave_uid=slave_uid)
+        _assoc_by_master.setdefault(master_uid, []).append(slave_uid)
+        _assoc_by_slave.setdefault(slave_uid, []).append(master_uid)
+        return assoc
 
 
 def remove_chat_assoc(master_uid=None, slave_uid=None):
@@ -105,10 +260,14 @@ def remove_chat_assoc(master_uid=None, slave_uid=None):
     try:
         if bool(master_uid) == bool(slave_uid):
             raise ValueError("Only one parameter is to be provided.")
-        elif master_uid:
-            return ChatAssoc.delete().where(ChatAssoc.master_uid == master_uid).execute()
-        elif slave_uid:
-            return ChatAssoc.delete().where(ChatAssoc.slave_uid == slave_uid).execute()
+        with _assoc_lock:
+            if master_uid:
+                count = ChatAssoc.delete().where(ChatAssoc.master_uid == master_uid).execute()
+                _uncache_chat_assoc(_assoc_by_master, _assoc_by_slave, master_uid)
+            else:
+                count = ChatAssoc.delete().where(ChatAssoc.slave_uid == slave_uid).execute()
+                _uncache_chat_assoc(_assoc_by_slave, _assoc_by_master, slave_uid)
+            return count
     except DoesNotExist:
         return 0
 
@@ -118,6 +277,8 @@ def get_chat_assoc(master_uid=None, slave_uid=None):
     Get chat association (chat link) information.
     Only one parameter is to be provided.
 
+    Served from the in-memory index, without querying the database.
+
     Args:
         master_uid (str): Master channel UID ("%(chat_id)s")
         slave_uid (str): Slave channel UID ("%(channel_id)s.%(chat_id)s")
@@ -125,23 +286,105 @@ def get_chat_assoc(master_uid=None, slave_uid=None):
     Returns:
         list: The counterpart ID.
     """
-    try:
-        if bool(master_uid) == bool(slave_uid):
-            raise ValueError("Only one parameter is to be provided.")
-        elif master_uid:
-            slaves = ChatAssoc.select().where(ChatAssoc.master_uid == master_uid)
-            if len(slaves) > 0:
-                return [i.slave_uid for i in slaves]
-            else:
-                return []
-        elif slave_uid:
-            masters = ChatAssoc.select().where(ChatAssoc.slave_uid == slave_uid)
-            if len(masters) > 0:
-                return [i.master_uid for i in masters]
-            else:
-                return []
-    except DoesNotExist:
-        return []
+    if bool(master_uid) == bool(slave_uid):
+        raise ValueError("Only one parameter is to be provided.")
+    with _assoc_lock:
+        if master_uid:
+            return list(_assoc_by_master.get(master_uid, []))
+        else:
+            return list(_assoc_by_slave.get(slave_uid, []))
+
+
+def _write_loop():
+    """
+    Run queued writes in batches, each batch in one transaction.
+    Writes queued with `atomic=False` are run alone, outside of transactions.
+    Callables returned by writes are called after the batch is committed.
+    """
+    carry = None
+    while True:
+        item = carry or _write_queue.get()
+        carry = None
+        fn, args, atomic = item
+        if not atomic:
+            try:
+                _committed([fn(*args)])
+            except Exception:
+                logger.exception("Failed to write %s%s to database.", fn.__name__, args)
+            finally:
+                _write_queue.task_done()
+            continue
+        batch = [item]
+        while len(batch) < _write_batch:
+            try:
+                item = _write_queue.get_nowait()
+            except queue.Empty:
+                break
+            if not item[2]:
+                carry = item
+                break
+            batch.append(item)
+        results = []
+        try:
+            with db.atomic():
+                for fn, args, _ in batch:
+                    try:
+                        results.append(fn(*args))
+                    except Exception:
+                        logger.exception("Failed to write %s%s to database.", fn.__name__, args)
+        except Exception:
+            logger.exception("Failed to commit %s writes to database.", len(batch))
+        finally:
+            _committed(results)
+            for _ in batch:
+                _write_queue.task_done()
+
+
+def _committed(results):
+    """
+    Call callables returned by writes committed.
+    """
+    for i in results:
+        if callable(i):
+            try:
+                i()
+            except Exception:
+                logger.exception("Failed to run %s after commit.", i)
+
+
+def write(fn, *args, atomic=True):
+    """
+    Run a write on the writer thread.
+
+    Writes are run in order of submission, and batched into transactions.
+    Run at once on the calling thread if write-behind is disabled.
+    If `fn` returns a callable, it is called once the write is committed,
+    e.g. to drop what is kept in memory until then.
+
+    Args:
+        fn (callable): Function writing to the database.
+        *args: Arguments of `fn`.
+        atomic (bool): Run in a transaction. `False` for statements that
+            cannot be run in a transaction, e.g. `ATTACH` and `VACUUM`.
+    """
+    if _writer is None:
+        if not atomic:
+            _committed([fn(*args)])
+            return
+        with db.atomic():
+            result = fn(*args)
+        _committed([result])
+        return
+    _write_queue.put((fn, args, atomic))
+
+
+def flush():
+    """
+    Block until all queued writes are committed.
+    Also called on exit, as the writer thread does not keep the process alive.
+    """
+    if _writer is not None and _writer.is_alive():
+        _write_queue.join()
 
 
 def get_last_msg_from_chat(chat_id):
@@ -153,10 +396,15 @@ def get_last_msg_from_chat(chat_id):
     Returns:
         MsgLog: The last message from the chat
     """
+    with _pending_lock:
+        pending = [i for i in _pending_msg_log.values() if i.master_chat_id == str(chat_id)]
     try:
-        return MsgLog.select().where(MsgLog.master_msg_id.startswith("%s." % chat_id)).order_by(MsgLog.time.desc()).first()
+        last = MsgLog.select().where(MsgLog.master_chat_id == str(chat_id)).order_by(MsgLog.time.desc()).first()
     except DoesNotExist:
-        return None
+        last = None
+    if last:
+        pending.append(last)
+    return max(pending, key=lambda i: i.time) if pending else None
 
 
 def add_msg_log(**kwargs):
@@ -182,6 +430,9 @@ def add_msg_log(**kwargs):
 
     Returns:
         MsgLog: The added/updated entry.
+
+    The entry is written by the writer thread, and is available to
+    `get_msg_log` and `get_last_msg_from_chat` before it is written.
     """
     master_msg_id = kwargs.get('master_msg_id')
     text = kwargs.get('text')
@@ -194,28 +445,43 @@ def add_msg_log(**kwargs):
     slave_message_id = kwargs.get('slave_message_id')
     update = kwargs.get('update', False)
     if update:
-        msg_log = MsgLog.get(MsgLog.master_msg_id == master_msg_id)
-        msg_log.text = text
-        msg_log.msg_type = msg_type
-        msg_log.sent_to = sent_to
-        msg_log.slave_origin_uid = slave_origin_uid
-        msg_log.slave_origin_display_name = slave_origin_display_name
-        msg_log.slave_member_uid = slave_member_uid
-        msg_log.slave_member_display_name = slave_member_display_name
-        msg_log.slave_message_id = slave_message_id
-        msg_log.save()
-        return msg_log
+        old = get_msg_log(master_msg_id)
+        if old is None:
+            raise MsgLog.DoesNotExist("Message log %s is not found." % master_msg_id)
+        time = old.time
     else:
-        return MsgLog.create(master_msg_id=master_msg_id,
-                             slave_message_id=slave_message_id,
-                             text=text,
-                             slave_origin_uid=slave_origin_uid,
-                             msg_type=msg_type,
-                             sent_to=sent_to,
-                             slave_origin_display_name=slave_origin_display_name,
-                             slave_member_uid=slave_member_uid,
-                             slave_member_display_name=slave_member_display_name
-                             )
+        time = datetime.datetime.now()
+    msg_log = MsgLog(master_msg_id=master_msg_id,
+                     slave_message_id=slave_message_id,
+                     text=text,
+                     slave_origin_uid=slave_origin_uid,
+                     msg_type=msg_type,
+                     sent_to=sent_to,
+                     slave_origin_display_name=slave_origin_display_name,
+                     slave_member_uid=slave_member_uid,
+                     slave_member_display_name=slave_member_display_name,
+                     master_chat_id=master_msg_id.split(".", 1)[0],
+                     time=time)
+    with _pending_lock:
+        _pending_msg_log[master_msg_id] = msg_log
+    write(_save_msg_log, msg_log, not update)
+    return msg_log
+
+
+def _save_msg_log(msg_log, create):
+    try:
+        msg_log.save(force_insert=create)
+    except Exception:
+        _unpend_msg_log(msg_log)
+        raise
+    # Kept readable until the transaction is committed.
+    return lambda: _unpend_msg_log(msg_log)
+
+
+def _unpend_msg_log(msg_log):
+    with _pending_lock:
+        if _pending_msg_log.get(msg_log.master_msg_id) is msg_log:
+            del _pending_msg_log[msg_log.master_msg_id]
 
 
 def get_msg_log(master_msg_id):
@@ -228,10 +494,107 @@ def get_msg_log(master_msg_id):
         MsgLog|None: The queried entry, None if not exist.
     """
     logger.info("get_msg_log %s" % master_msg_id)
+    with _pending_lock:
+        if master_msg_id in _pending_msg_log:
+            return _pending_msg_log[master_msg_id]
     try:
-        return MsgLog.select().where(MsgLog.master_msg_id == master_msg_id).order_by(MsgLog.time.desc()).first()
+        msg_log = MsgLog.select().where(MsgLog.master_msg_id == master_msg_id).order_by(MsgLog.time.desc()).first()
     except DoesNotExist:
-        return None
+        msg_log = None
+    return msg_log or _get_archived_msg_log(master_msg_id)
+
+
+def _get_archived_msg_log(master_msg_id):
+    """
+    Look for a message log in archives, newest first.
+
+    Args:
+        master_msg_id (str): Telegram message ID ("%(chat_id)s.%(msg_id)s")
+
+    Returns:
+        MsgLog|None: The archived entry, None if not exist.
+    """
+    for path in sorted(glob.glob(os.path.join(archivePath, "msglog-*.db")), reverse=True):
+        conn = sqlite3.connect("file:%s?mode=ro" % path, uri=True)
+        try:
+            row = conn.execute("SELECT %s FROM msglog WHERE master_msg_id = ?" % ", ".join(_MSG_LOG_COLUMNS),
+                               (master_msg_id,)).fetchone()
+        except sqlite3.Error:
+            logger.exception("Failed to read message log archive %s.", path)
+            row = None
+        finally:
+            conn.close()
+        if row:
+            msg_log = MsgLog(**dict(zip(_MSG_LOG_COLUMNS, row)))
+            msg_log.time = MsgLog.time.python_value(msg_log.time)
+            return msg_log
+    return None
+
+
+def archive_msg_log(retention_days=180, max_rows=0):
+    """
+    Move old message logs to monthly archive databases, then start
+    reclaiming free pages incrementally.
+    Must be run outside of transactions, i.e. `write(archive_msg_log, atomic=False)`.
+
+    Args:
+        retention_days (int): Archive entries older than this many days. 0 to disable.
+        max_rows (int): Archive oldest entries beyond this many rows. 0 to disable.
+
+    Returns:
+        int: Number of entries archived.
+    """
+    cutoff = None
+    if retention_days:
+        cutoff = str(datetime.datetime.now() - datetime.timedelta(days=retention_days))
+    if max_rows:
+        row = db.execute_sql("SELECT time FROM msglog ORDER BY time DESC LIMIT 1 OFFSET ?", (max_rows,)).fetchone()
+        if row and row[0] and (cutoff is None or row[0] > cutoff):
+            # Rows at the cutoff time are kept.
+            cutoff = row[0]
+    if cutoff is None:
+        return 0
+    condition = "(time < ? OR time IS NULL)"
+    months = [i[0] for i in db.execute_sql("SELECT DISTINCT COALESCE(strftime('%%Y-%%m', time), '0000-00') "
+                                           "FROM msglog WHERE %s" % condition, (cutoff,)).fetchall()]
+    if not months:
+        return 0
+    if not os.path.exists(archivePath):
+        os.makedirs(archivePath)
+    columns = ", ".join(_MSG_LOG_COLUMNS)
+    count = 0
+    for month in months:
+        path = os.path.join(archivePath, "msglog-%s.db" % month)
+        where = "%s AND COALESCE(strftime('%%Y-%%m', time), '0000-00') = ?" % condition
+        db.execute_sql("ATTACH DATABASE ? AS archive", (path,))
+        try:
+            db.execute_sql("CREATE TABLE IF NOT EXISTS archive.msglog (master_msg_id TEXT PRIMARY KEY, "
+                           "slave_message_id TEXT, text TEXT, slave_origin_uid TEXT, "
+                           "slave_origin_display_name TEXT, slave_member_uid TEXT, slave_member_display_name TEXT, "
+                           "msg_type TEXT, sent_to TEXT, time DATETIME, master_chat_id TEXT)")
+            with db.atomic():
+                db.execute_sql("INSERT OR REPLACE INTO archive.msglog (%s) SELECT %s FROM main.msglog WHERE %s"
+                               % (columns, columns, where), (cutoff, month))
+                count += db.execute_sql("DELETE FROM main.msglog WHERE %s" % where, (cutoff, month)).rowcount
+        finally:
+            db.execute_sql("DETACH DATABASE archive")
+    logger.info("%s message logs archived to %s month(s) before %s.", count, len(months), cutoff)
+    _vacuum_step()
+    return count
+
+
+def _vacuum_step(pages=1000):
+    """
+    Reclaim some free pages of the database, and queue the next step
+    until no free page is left, so that other writes are not held for long.
+    The database is switched to incremental auto vacuum by migration 5.
+
+    Args:
+        pages (int): Maximum number of pages reclaimed in this step.
+    """
+    db.execute_sql("PRAGMA incremental_vacuum(%d)" % pages)
+    if db.execute_sql("PRAGMA freelist_count").fetchone()[0]:
+        write(_vacuum_step, pages, atomic=False)
 
 
 def get_slave_chat_info(slave_channel_id=None, slave_chat_uid=None):
@@ -291,11 +654,122 @@ def set_slave_chat_info(slave_channel_id=None,
                                     slave_chat_type=slave_chat_type)
 
 
+def set_slave_chat_info_bulk(chats):
+    """
+    Insert or update slave chat info entries in bulk, in one transaction.
+    Only entries with changes are written.
+
+    Written with UPSERT statements of up to 999 parameters each, or one
+    entry at a time with `set_slave_chat_info` if SQLite is older than 3.24.0.
+
+    Args:
+        chats (list of dict): Slave chat info, with keys `slave_channel_id`,
+            `slave_channel_emoji`, `slave_chat_uid`, `slave_chat_name`,
+            `slave_chat_alias` and `slave_chat_type`, as the arguments of
+            `set_slave_chat_info`.
+
+    Returns:
+        int: Number of entries inserted or updated.
+    """
+    columns = ("slave_channel_id", "slave_channel_emoji", "slave_chat_uid",
+               "slave_chat_name", "slave_chat_alias", "slave_chat_type")
+    updates = [i for i in columns if i not in ("slave_channel_id", "slave_chat_uid")]
+    sql = "INSERT INTO slavechatinfo (%s) VALUES %%s " \
+          "ON CONFLICT (slave_channel_id, slave_chat_uid) DO UPDATE SET %s WHERE %s" % \
+          (", ".join(columns),
+           ", ".join("%s = excluded.%s" % (i, i) for i in updates),
+           " OR ".join("%s IS NOT excluded.%s" % (i, i) for i in updates))
+    row = "(%s)" % ", ".join("?" * len(columns))
+    # Stay within the limit of 999 parameters per statement.
+    batch = 999 // len(columns)
+    count = 0
+    with db.atomic():
+        if not _upsert:
+            for i in chats:
+                chat = {j: i.get(j, "" if j == "slave_chat_alias" else None) for j in columns}
+                old = get_slave_chat_info(chat['slave_channel_id'], chat['slave_chat_uid'])
+                if old is None or any(getattr(old, j) != chat[j] for j in updates):
+                    set_slave_chat_info(**chat)
+                    count += 1
+            return count
+        for offset in range(0, len(chats), batch):
+            rows = chats[offset:offset + batch]
+            params = [i.get(j, "" if j == "slave_chat_alias" else None) for i in rows for j in columns]
+            count += db.execute_sql(sql % ", ".join([row] * len(rows)), params).rowcount
+    return count
+
+
+def get_voice_hash(file_key):
+    """
+    Get the content hash of a voice file from Telegram.
+
+    Args:
+        file_key (str): `file_unique_id` or `file_id` of the file.
+
+    Returns:
+        str|None: The hash, None if the file is not seen before.
+    """
+    try:
+        voice = VoiceFile.select().where(VoiceFile.file_key == file_key).first()
+    except DoesNotExist:
+        return None
+    return voice.audio_hash if voice else None
+
+
+def get_speech_results(audio_hash, keys, ttl=2592000):
+    """
+    Get speech recognition results of an audio content.
+
+    Args:
+        audio_hash (str): Content hash of the audio.
+        keys (list of tuple): `(engine, lang)` of results to get.
+        ttl (int): Maximum age of results in seconds.
+
+    Returns:
+        dict: Results found, `{(engine, lang): list of str}`.
+    """
+    cutoff = datetime.datetime.now() - datetime.timedelta(seconds=ttl)
+    query = SpeechResult.select().where(SpeechResult.audio_hash == audio_hash, SpeechResult.time >= cutoff)
+    keys = set(keys)
+    return {(i.engine, i.lang): json.loads(i.result) for i in query if (i.engine, i.lang) in keys}
+
+
+def add_speech_results(file_key, audio_hash, results, ttl=2592000, max_rows=10000):
+    """
+    Save speech recognition results of an audio content, and remove
+    results older than `ttl` seconds, or beyond the newest `max_rows`.
+    Written by the writer thread.
+
+    Args:
+        file_key (str): `file_unique_id` or `file_id` of the voice file.
+        audio_hash (str): Content hash of the audio.
+        results (dict): `{(engine, lang): list of str}`.
+        ttl (int): Maximum age of results in seconds.
+        max_rows (int): Maximum number of results, `0` for no limit.
+    """
+    write(_save_speech_results, file_key, audio_hash, results, ttl, max_rows)
+
+
+def _save_speech_results(file_key, audio_hash, results, ttl, max_rows):
+    now = str(datetime.datetime.now())
+    db.execute_sql("INSERT OR REPLACE INTO voicefile (file_key, audio_hash, time) VALUES (?, ?, ?)",
+                   (file_key, audio_hash, now))
+    for (engine, lang), result in results.items():
+        db.execute_sql("INSERT OR REPLACE INTO speechresult (audio_hash, engine, lang, result, time) "
+                       "VALUES (?, ?, ?, ?, ?)", (audio_hash, engine, lang, json.dumps(result), now))
+    cutoff = str(datetime.datetime.now() - datetime.timedelta(seconds=ttl))
+    for table in ("speechresult", "voicefile"):
+        db.execute_sql("DELETE FROM %s WHERE time < ?" % table, (cutoff,))
+        if max_rows:
+            db.execute_sql("DELETE FROM {0} WHERE rowid IN "
+                           "(SELECT rowid FROM {0} ORDER BY time DESC LIMIT -1 OFFSET ?)".format(table), (max_rows,))
+
+
 def get_recent_slave_chats(master_chat_id, limit=5):
     return [i.slave_origin_uid for i in
             MsgLog.select(MsgLog.slave_origin_uid)
                   .distinct()
-                  .where(MsgLog.master_msg_id.startswith("%s." % master_chat_id))
+                  .where(MsgLog.master_chat_id == str(master_chat_id))
                   .order_by(MsgLog.time.desc())
                   .limit(limit)]
 
@@ -304,7 +778,22 @@ def get_recent_slave_chats(master_chat_id, limit=5):
 db.connect()
 if not ChatAssoc.table_exists():
     _create()
-elif "time" not in [i.name for i in db.get_columns("msglog")]:
-    _migrate(0)
-elif "slavechatinfo" not in db.get_tables():
-    _migrate(1)
+else:
+    if "time" not in [i.name for i in db.get_columns("msglog")]:
+        _migrate(0)
+    if "slavechatinfo" not in db.get_tables():
+        _migrate(1)
+    if "master_chat_id" not in [i.name for i in db.get_columns("msglog")]:
+        _migrate(2)
+    if not any(i.unique for i in db.get_indexes("slavechatinfo")
+               if i.name == "slavechatinfo_slave_channel_id_slave_chat_uid"):
+        _migrate(3)
+    if "speechresult" not in db.get_tables():
+        _migrate(4)
+if db.execute_sql("PRAGMA auto_vacuum").fetchone()[0] != 2:
+    _migrate(5)
+_load_chat_assoc()
+if _flag("db_write_behind", True):
+    _writer = threading.Thread(target=_write_loop, name="tgdata-writer", daemon=True)
+    _writer.start()
+    atexit.register(flush)
@@ -0,0 +1,272 @@
+import heapq
+import itertools
+import logging
+import re
+import threading
+import time
+
+import telegram.error
+
+# Not available in earlier versions of python-telegram-bot,
+# where the retry time is only mentioned in the error message.
+RetryAfter = getattr(telegram.error, "RetryAfter", None)
+
+
+class TokenBucket:
+    """
+    Token bucket allowing `rate` calls per second on average,
+    with bursts of at most `capacity` calls.
+
+    Tokens can be reserved ahead of time, in which case the bucket goes
+    into debt, and later reservations are scheduled after the debt is
+    paid off.
+
+    Args:
+        rate (float): Tokens added per second.
+        capacity (float): Maximum number of tokens.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.last = time.time()
+        self.paused_until = 0
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+    def delay(self, now):
+        """
+        Seconds until a token is available.
+        """
+        self._refill(now)
+        wait = max(0, self.paused_until - now)
+        if self.tokens < 1:
+            wait = max(wait, (1 - self.tokens) / self.rate)
+        return wait
+
+    def consume(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+    def reserve(self, now):
+        """
+        Reserve a token.
+
+        Returns:
+            float: Time when the reserved token can be used.
+        """
+        at = now + self.delay(now)
+        self.tokens -= 1
+        return at
+
+    def pause(self, seconds):
+        self.paused_until = max(self.paused_until, time.time() + seconds)
+
+    def idle(self, now):
+        self._refill(now)
+        return self.tokens >= self.capacity and self.paused_until <= now
+
+
+class SendScheduler:
+    """
+    Schedule Telegram Bot API calls to stay within flood limits.
+
+    Each call first takes a token from the bucket of its chat (private chats
+    and groups have separate limits), then waits for a token from the global
+    bucket. Calls waiting for the global bucket are served by priority:
+    text before other messages, and chat actions last.
+
+    When Telegram asks to retry after some time, the chat is paused for that
+    time, and the call is retried up to `max_retries` times.
+
+    Args:
+        global_rate (float): Calls per second for the entire bot.
+        chat_rate (float): Calls per second for a private chat.
+        group_rate (float): Calls per second for a group.
+        burst (int): Maximum burst of calls to a chat.
+        max_retries (int): Retries of a call asked to retry later.
+    """
+
+    PRIORITY_TEXT = 0
+    PRIORITY_DEFAULT = 1
+    PRIORITY_MEDIA = 2
+    PRIORITY_ACTION = 3
+    TEXT_METHODS = {"send_message", "sendMessage", "edit_message_text", "editMessageText"}
+    MEDIA_METHODS = {"send_photo", "sendPhoto", "send_document", "sendDocument", "send_video", "sendVideo",
+                     "send_audio", "sendAudio", "send_voice", "sendVoice", "send_sticker", "sendSticker"}
+    ACTION_METHODS = {"send_chat_action", "sendChatAction"}
+    RETRY_PATTERN = re.compile(r"retry after (\d+)", re.IGNORECASE)
+    MAX_CHAT_BUCKETS = 1000
+
+    def __init__(self, global_rate=30, chat_rate=1, group_rate=20 / 60, burst=3, max_retries=3):
+        self.logger = logging.getLogger(__name__)
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate
+        self.burst = burst
+        self.max_retries = max_retries
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_buckets = {}
+        self.lock = threading.Lock()
+        self.cond = threading.Condition(self.lock)
+        # (priority, sequence) of calls waiting for the global bucket
+        self.waiting = []
+        self.counter = itertools.count()
+        self.sent = 0
+        self.retries = 0
+        self.wait_time_total = 0.0
+
+    def priority_of(self, method):
+        """
+        Get the priority of a Bot API method.
+
+        Args:
+            method (str): Name of the method of `telegram.Bot`.
+
+        Returns:
+            int: Priority, smaller is served first.
+        """
+        if method in self.TEXT_METHODS:
+            return self.PRIORITY_TEXT
+        if method in self.MEDIA_METHODS:
+            return self.PRIORITY_MEDIA
+        if method in self.ACTION_METHODS:
+            return self.PRIORITY_ACTION
+        return self.PRIORITY_DEFAULT
+
+    def _chat_bucket(self, chat_id, now):
+        bucket = self.chat_buckets.get(chat_id, None)
+        if bucket is None:
+            if len(self.chat_buckets) >= self.MAX_CHAT_BUCKETS:
+                for i in [i for i, b in self.chat_buckets.items() if b.idle(now)]:
+                    del self.chat_buckets[i]
+            # Groups and channels have negative IDs, or "@username".
+            rate = self.group_rate if str(chat_id).startswith(("-", "@")) else self.chat_rate
+            bucket = self.chat_buckets[chat_id] = TokenBucket(rate, self.burst)
+        return bucket
+
+    def _acquire(self, chat_id, priority):
+        start = time.time()
+        if chat_id is not None:
+            with self.lock:
+                at = self._chat_bucket(chat_id, start).reserve(start)
+            if at > start:
+                time.sleep(at - start)
+        with self.cond:
+            ticket = (priority, next(self.counter))
+            heapq.heappush(self.waiting, ticket)
+            while True:
+                now = time.time()
+                if self.waiting[0] == ticket:
+                    delay = self.global_bucket.delay(now)
+                    if delay <= 0:
+                        self.global_bucket.consume(now)
+                        heapq.heappop(self.waiting)
+                        self.wait_time_total += now - start
+                        self.cond.notify_all()
+                        return
+                    self.cond.wait(delay)
+                else:
+                    self.cond.wait()
+
+    def _retry_after(self, error):
+        if RetryAfter is not None and isinstance(error, RetryAfter):
+            return error.retry_after
+        match = self.RETRY_PATTERN.search(str(error))
+        if isinstance(error, telegram.error.TelegramError) and match:
+            return int(match.group(1))
+        return None
+
+    def call(self, chat_id, fn, *args, priority=PRIORITY_DEFAULT, **kwargs):
+        """
+        Call a Bot API method when the rate limits allow.
+
+        Args:
+            chat_id (int|str|None): Chat the call is sent to, `None` if not
+                specific to a chat.
+            fn (callable): The Bot API method.
+            priority (int): Priority of the call.
+            *args, **kwargs: Arguments of `fn`.
+
+        Returns:
+            The return value of `fn`.
+        """
+        attempt = 0
+        while True:
+            self._acquire(chat_id, priority)
+            try:
+                result = fn(*args, **kwargs)
+                with self.lock:
+                    self.sent += 1
+                return result
+            except Exception as e:
+                retry_after = self._retry_after(e)
+                if retry_after is None or attempt >= self.max_retries:
+                    raise
+                attempt += 1
+                with self.lock:
+                    self.retries += 1
+                    if chat_id is not None:
+                        self._chat_bucket(chat_id, time.time()).pause(retry_after)
+                    else:
+                        self.global_bucket.pause(retry_after)
+                self.logger.warning("Flood limit hit on chat %s, retrying in %s seconds. (%s/%s)",
+                                    chat_id, retry_after, attempt, self.max_retries)
+                # Files are uploaded again from the start.
+                for i in itertools.chain(args, kwargs.values()):
+                    if hasattr(i, "seek"):
+                        i.seek(0)
+
+    def backlog(self):
+        """
+        Number of calls waiting for the global bucket.
+        """
+        with self.lock:
+            return len(self.waiting)
+
+    def stats(self):
+        """
+        Metrics of the scheduler.
+
+        Returns:
+            dict: Calls sent, retried and waiting, and average wait time in seconds.
+        """
+        with self.lock:
+            return {
+                "sent": self.sent,
+                "retries": self.retries,
+                "backlog": len(self.waiting),
+                "wait_avg": self.wait_time_total / self.sent if self.sent else 0.0,
+            }
+
+
+class ScheduledBot:
+    """
+    Proxy of `telegram.Bot` sending all method calls through a `SendScheduler`.
+    The target chat is taken from the `chat_id` argument, or the first
+    positional argument of chat-specific methods.
+
+    Args:
+        bot (telegram.Bot): The bot.
+        scheduler (SendScheduler): The scheduler.
+    """
+
+    def __init__(self, bot, scheduler):
+        self.bot = bot
+        self.scheduler = scheduler
+
+    def __getattr__(self, name):
+        attr = getattr(self.bot, name)
+        if not callable(attr) or name.startswith("_") or not name[:1].islower() \
+                or name.startswith("get") and name not in ("getFile", "get_file"):
+            return attr
+        priority = self.scheduler.priority_of(name)
+        chat_specific = name.startswith(("send", "edit", "forward", "delete"))
+
+        def scheduled(*args, **kwargs):
+            chat_id = kwargs.get("chat_id", args[0] if args and chat_specific else None)
+            return self.scheduler.call(chat_id, attr, *args, priority=priority, **kwargs)
+
+        return scheduled
@@ -1,37 +1,93 @@
-import requests
-import pydub
+import transcode
+import transfer
 import base64
+import concurrent.futures
+import io
+import threading
+import time
 import uuid
-import os
+import wave
+
+# Sample rate of audio sent to speech APIs
+RATE = 16000
+
+
+class AccessToken:
+    """
+    An access token of a speech API, fetched on first use and fetched
+    again `margin` seconds before it expires, or when it is rejected.
+
+    Args:
+        fetch (callable): Fetch a new token, returns `(token, seconds before expiry)`.
+        margin (float): Seconds before expiry to fetch a new token.
+    """
+
+    def __init__(self, fetch, margin=60):
+        self.fetch = fetch
+        self.margin = margin
+        self.lock = threading.Lock()
+        self.token = None
+        self.expiry = 0
+
+    def get(self):
+        with self.lock:
+            if self.token is None or time.time() >= self.expiry - self.margin:
+                token, expires_in = self.fetch()
+                self.token, self.expiry = token, time.time() + expires_in
+            return self.token
+
+    def invalidate(self, token):
+        """
+        Discard a token rejected by the API, unless it is already replaced.
+        """
+        with self.lock:
+            if self.token == token:
+                self.token = None
+
 
 class BingSpeech:
     keys = None
-    access_token = None
     lang_list = ['de-DE', 'zh-TW', 'zh-HK', 'ru-RU', 'es-ES', 'ja-JP', 'ar-EG', 'da-DK', 'en-GB', 'en-IN', 'fi-FI', 'nl-NL', 'en-US', 'pt-BR', 'pt-PT', 'ca-ES', 'fr-FR', 'ko-KR', 'en-NZ', 'nb-NO', 'it-IT', 'fr-CA', 'pl-PL', 'es-MX', 'zh-CN', 'en-AU', 'en-CA', 'sv-SE']
+    # Tokens are valid for 10 minutes.
+    token_lifetime = 600
 
     def __init__(self, keys):
         self.keys = keys
+        self.token = AccessToken(self._fetch_token)
+
+    def _fetch_token(self):
         h = {
-            "Ocp-Apim-Subscription-Key": keys[0]
+            "Ocp-Apim-Subscription-Key": self.keys[0]
         }
-        r = requests.post("https://api.cognitive.microsoft.com/sts/v1.0/issueToken", headers=h)
-        self.access_token = r.text
+        r = transfer.get_engine().post("https://api.cognitive.microsoft.com/sts/v1.0/issueToken", headers=h).result()
+        r.raise_for_status()
+        return r.text, self.token_lifetime
 
-    def recognize(self, path, lang="zh-CN"):
-        if isinstance(path, str):
-            file = open(path, 'rb')
-        else:
-            return ["ERROR!", "File must by a path string."]
-        if lang not in self.lang_list:
-            return ["ERROR!", "Invalid language."]
+    @property
+    def access_token(self):
+        return self.token.get()
 
-        audio = pydub.AudioSegment.from_file(file)
-        audio = audio.set_frame_rate(16000)
-        audio.export("%s.wav" % path, format="wav")
-        header = {
-            "Authorization": "Bearer %s" % self.access_token,
-            "Content-Type": "audio/wav; samplerate=16000"
-        }
+    def supports(self, lang):
+        return lang in self.lang_list
+
+    def submit(self, pcm, lang="zh-CN"):
+        """
+        Submit a recognition to the transfer engine.
+
+        Args:
+            pcm (bytes): 16-bit mono PCM audio at `RATE` Hz.
+            lang (str): Language code.
+
+        Returns:
+            tuple: Access token used, and `concurrent.futures.Future` of
+                the `requests.Response`.
+        """
+        data = io.BytesIO()
+        with wave.open(data, "wb") as w:
+            w.setnchannels(1)
+            w.setsampwidth(2)
+            w.setframerate(RATE)
+            w.writeframes(pcm)
         d = {
             "version": "3.0",
             "requestid": str(uuid.uuid1()),
@@ -43,9 +99,27 @@ class BingSpeech:
             "instanceid": uuid.uuid3(uuid.NAMESPACE_DNS, 'com.1a23.eh_telegram_master'),
             "maxnbest": 5
         }
-        with open("%s.wav" % path, 'rb') as f:
-            r = requests.post("https://speech.platform.bing.com/recognize", params=d, data=f.read(), headers=header)
-        os.remove("%s.wav" % path)
+        token = self.access_token
+        header = {
+            "Authorization": "Bearer %s" % token,
+            "Content-Type": "audio/wav; samplerate=%s" % RATE
+        }
+        return token, transfer.get_engine().post("https://speech.platform.bing.com/recognize", params=d,
+                                                 data=data.getvalue(), headers=header)
+
+    @staticmethod
+    def rejected(r):
+        """
+        Whether the access token of a request is rejected.
+        """
+        return r.status_code in (401, 403)
+
+    @staticmethod
+    def parse(r):
+        """
+        Returns:
+            list of str: Results, or `"ERROR!"` and the error.
+        """
         try:
             rjson = r.json()
         except:
@@ -58,46 +132,165 @@ class BingSpeech:
 
 class BaiduSpeech:
     key_dict = None
-    access_token = None
-    full_token = None
     lang_list = ['zh', 'ct', 'en']
+    # Error numbers of invalid or expired tokens
+    token_errors = (3302,)
 
     def __init__(self, key_dict):
         self.key_dict = key_dict
+        self.full_token = None
+        self.token = AccessToken(self._fetch_token)
+
+    def _fetch_token(self):
         d = {
             "grant_type": "client_credentials",
-            "client_id": key_dict['api_key'],
-            "client_secret": key_dict['secret_key']
+            "client_id": self.key_dict['api_key'],
+            "client_secret": self.key_dict['secret_key']
         }
-        r = requests.post("https://openapi.baidu.com/oauth/2.0/token", data=d).json()
-        self.access_token = r['access_token']
+        r = transfer.get_engine().post("https://openapi.baidu.com/oauth/2.0/token", data=d).result().json()
         self.full_token = r
+        return r['access_token'], r.get('expires_in', 2592000)
 
-    def recognize(self, file, lang="zh"):
-        if hasattr(file, 'read'):
-            pass
-        elif isinstance(file, str):
-            file = open(file, 'rb')
-        else:
-            return ["ERROR!", "File must by a path string or a file object in `rb` mode."]
-        if lang.lower() not in self.lang_list:
-            return ["ERROR!", "Invalid language."]
+    @property
+    def access_token(self):
+        return self.token.get()
 
-        audio = pydub.AudioSegment.from_file(file)
-        audio = audio.set_frame_rate(16000)
+    def supports(self, lang):
+        return lang.lower() in self.lang_list
+
+    def submit(self, pcm, lang="zh"):
+        """
+        Submit a recognition to the transfer engine.
+
+        Args:
+            pcm (bytes): 16-bit mono PCM audio at `RATE` Hz.
+            lang (str): Language code.
+
+        Returns:
+            tuple: Access token used, and `concurrent.futures.Future` of
+                the `requests.Response`.
+        """
+        token = self.access_token
         d = {
             "format": "pcm",
-            "rate": 16000,
+            "rate": RATE,
             "channel": 1,
             "cuid": "testing_user",
-            "token": self.access_token,
             "lan": lang,
-            "len": len(audio.raw_data),
-            "speech": base64.b64encode(audio.raw_data).decode()
+            "len": len(pcm),
+            "speech": base64.b64encode(pcm).decode(),
+            "token": token
         }
-        r = requests.post("http://vop.baidu.com/server_api", json=d)
+        return token, transfer.get_engine().post("http://vop.baidu.com/server_api", json=d)
+
+    def rejected(self, r):
+        """
+        Whether the access token of a request is rejected.
+        """
+        return r.json()['err_no'] in self.token_errors
+
+    @staticmethod
+    def parse(r):
+        """
+        Returns:
+            list of str: Results, or `"ERROR!"` and the error.
+        """
         rjson = r.json()
         if rjson['err_no'] == 0:
             return rjson['result']
         else:
             return ["ERROR!", rjson['err_msg']]
+
+
+class SpeechNotImplemented:
+    lang_list = []
+
+    def recognize(self, *args, **kwargs):
+        return ["Not enabled or error in configuration."]
+
+
+class SpeechService:
+    """
+    Speech recognition engines kept for the lifetime of the channel, so
+    that access tokens are reused across recognitions.
+    Engines not configured are replaced by `SpeechNotImplemented`.
+
+    Audio is decoded once, and requests of all engines and languages are
+    submitted to the transfer engine at the same time. A request with an
+    access token rejected is submitted again once with a new token.
+
+    Args:
+        config (dict): Configuration of the channel.
+    """
+
+    def __init__(self, config):
+        self.bing = BingSpeech(config['bing_speech_api']) if config.get('bing_speech_api') \
+            else SpeechNotImplemented()
+        self.baidu = BaiduSpeech(config['baidu_speech_api']) if config.get('baidu_speech_api') \
+            else SpeechNotImplemented()
+
+    @staticmethod
+    def decode(path):
+        """
+        Decode an audio file for recognition, in the transcode process pool.
+
+        Args:
+            path (str): Path to the audio file.
+
+        Returns:
+            bytes: 16-bit mono PCM audio at `RATE` Hz.
+        """
+        with open(path, "rb") as f:
+            data = f.read()
+        return transcode.get_service().run(transcode.audio_to_pcm, data, RATE)
+
+    @staticmethod
+    def _submit(futures, pcm, request, retried=False):
+        """
+        Submit a recognition, and add its future to `futures`.
+
+        Returns:
+            list of str: Error of a recognition not submitted, `None` otherwise.
+        """
+        label, engine, lang = request
+        if not engine.supports(lang):
+            return ["ERROR!", "Invalid language."]
+        try:
+            token, future = engine.submit(pcm, lang)
+        except Exception as e:
+            return ["ERROR!", repr(e)]
+        futures[future] = (request, token, retried)
+        return None
+
+    def recognize(self, pcm, requests):
+        """
+        Recognize audio with several engines and languages at the same time.
+
+        Args:
+            pcm (bytes): 16-bit mono PCM audio at `RATE` Hz.
+            requests (list of tuple): `(label, engine, language)` of each recognition.
+
+        Yields:
+            tuple: `(label, results)` of each recognition, as soon as it is done.
+        """
+        futures = {}
+        for request in requests:
+            error = self._submit(futures, pcm, request)
+            if error is not None:
+                yield request[0], error
+        while futures:
+            done, _ = concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                request, token, retried = futures.pop(future)
+                engine = request[1]
+                try:
+                    r = future.result()
+                    if not retried and engine.rejected(r):
+                        engine.token.invalidate(token)
+                        result = self._submit(futures, pcm, request, retried=True)
+                    else:
+                        result = engine.parse(r)
+                except Exception as e:
+                    result = ["ERROR!", repr(e)]
+                if result is not None:
+                    yield request[0], result
@@ -0,0 +1,161 @@
+import itertools
+import logging
+import queue
+import threading
+import time
+from binascii import crc32
+
+
+class WorkerPool:
+    """
+    A fixed-size pool of worker threads, each draining its own bounded
+    task queue ("lane").
+
+    Tasks submitted with the same `key` always go to the same lane, so they
+    are run one after another in the order of submission, while tasks with
+    different keys are run in parallel on other lanes. Tasks without a key
+    are spread across lanes in turn.
+
+    Args:
+        size (int): Number of worker threads (lanes).
+        queue_size (int): Maximum number of tasks waiting for workers,
+            divided evenly among lanes. 0 for unlimited.
+        overflow (str): What to do when the task queue is full.
+            "block": wait until a slot is free.
+            "drop": discard the new task.
+            Tasks are never run on the submitting thread, as they would
+            overtake tasks queued earlier with the same key.
+        name (str): Name prefix of worker threads.
+    """
+
+    OVERFLOW_POLICIES = ("block", "drop")
+
+    def __init__(self, size=8, queue_size=1000, overflow="block", name="WorkerPool"):
+        if size < 1:
+            raise ValueError("Worker pool size must be at least 1.")
+        if overflow not in self.OVERFLOW_POLICIES:
+            raise ValueError("Overflow policy must be one of %s." % (self.OVERFLOW_POLICIES,))
+        self.size = size
+        self.overflow = overflow
+        self.name = name
+        self.logger = logging.getLogger("%s.%s" % (__name__, name))
+        lane_size = max(1, queue_size // size) if queue_size else 0
+        self.lanes = [queue.Queue(lane_size) for _ in range(size)]
+        self.round_robin = itertools.cycle(range(size))
+        self.lock = threading.Lock()
+        self.busy = 0
+        self.submitted = 0
+        self.completed = 0
+        self.dropped = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+        self.threads = [threading.Thread(target=self._worker, args=(self.lanes[i],),
+                                         name="%s-%s" % (name, i), daemon=True)
+                        for i in range(size)]
+        for i in self.threads:
+            i.start()
+
+    def lane_of(self, key):
+        """
+        Get the lane a key is assigned to.
+
+        Args:
+            key (str): Ordering key of tasks.
+
+        Returns:
+            int: Index of the lane.
+        """
+        return crc32(str(key).encode("utf-8")) % self.size
+
+    def submit(self, fn, *args, key=None, **kwargs):
+        """
+        Submit a task to the pool.
+
+        Args:
+            fn (callable): Function to run.
+            *args: Positional arguments to `fn`.
+            key (str): Ordering key. Tasks with the same key are run in order
+                of submission. `None` to run on any lane.
+            **kwargs: Keyword arguments to `fn`.
+
+        Returns:
+            bool: `False` if the task is dropped, `True` otherwise.
+        """
+        task = (time.time(), fn, args, kwargs)
+        with self.lock:
+            self.submitted += 1
+            lane = self.lanes[next(self.round_robin) if key is None else self.lane_of(key)]
+        if self.overflow == "block":
+            lane.put(task)
+            return True
+        try:
+            lane.put_nowait(task)
+        except queue.Full:
+            with self.lock:
+                self.dropped += 1
+            self.logger.warning("Worker lane saturated (%s queued), task %s dropped.",
+                                lane.qsize(), fn)
+            return False
+        return True
+
+    def _worker(self, lane):
+        while True:
+            task = lane.get()
+            if task is None:
+                lane.task_done()
+                break
+            self._run(task)
+            lane.task_done()
+
+    def _run(self, task):
+        enqueued, fn, args, kwargs = task
+        wait = time.time() - enqueued
+        with self.lock:
+            self.busy += 1
+            self.wait_time_total += wait
+            self.wait_time_max = max(self.wait_time_max, wait)
+        try:
+            fn(*args, **kwargs)
+        except Exception:
+            self.logger.exception("Unhandled exception in worker task %s.", fn)
+        finally:
+            with self.lock:
+                self.busy -= 1
+                self.completed += 1
+
+    def stats(self):
+        """
+        Metrics of the pool.
+
+        Returns:
+            dict: Pool size, busy workers, queued tasks, longest lane,
+                saturation (busy / size), counts of submitted, completed and
+                dropped tasks, average and maximum time (in seconds) spent
+                waiting in queue.
+        """
+        with self.lock:
+            return {
+                "size": self.size,
+                "busy": self.busy,
+                "queued": sum(i.qsize() for i in self.lanes),
+                "lane_max": max(i.qsize() for i in self.lanes),
+                "saturation": self.busy / self.size,
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "dropped": self.dropped,
+                "wait_avg": self.wait_time_total / self.completed if self.completed else 0.0,
+                "wait_max": self.wait_time_max,
+            }
+
+    def shutdown(self, wait=True):
+        """
+        Stop all workers after queued tasks are finished.
+
+        Args:
+            wait (bool): Block until all workers exit.
+        """
+        for i in self.lanes:
+            i.put(None)
+        if wait:
+            for i in self.threads:
+                i.join()
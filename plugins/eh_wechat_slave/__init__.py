@@ -1,4 +1,5 @@
 import base64
+import functools
 import logging
 import mimetypes
 import os
@@ -10,15 +11,21 @@ import html
 from binascii import crc32
 
 import itchat
+import itchat.utils
 import magic
 import xmltodict
+from itchat.components.contact import update_local_friends
 from pyqrcode import QRCode
-from PIL import Image
 
 import config
+import transcode
+import transfer
 from channel import EFBChannel, EFBMsg, MsgType, MsgSource, TargetType, ChannelType
 from channelExceptions import EFBMessageTypeNotSupported, EFBMessageError, EFBChatNotFound
-from utils import extra
+from utils import extra, LRUCache
+from .directory import ContactDirectory
+from .hydration import MemberHydrator
+from .media import MediaCache
 
 
 def wechat_msg_meta(func):
@@ -48,7 +55,16 @@ def wechat_msg_meta(func):
                           "Uin": self.itchat.loginInfo['User']['Uin']}
             else:
                 logger.debug("search_user")
-                member = self.search_user(UserName=msg['FromUserName'], ActualUserName=msg['ActualUserName'])[0]['MemberList'][0]
+                self.hydrator.touch(msg['FromUserName'])
+                member = self.search_user(UserName=msg['FromUserName'], ActualUserName=msg['ActualUserName'])
+                member = member and member[0]['MemberList']
+                if member:
+                    member = member[0]
+                else:
+                    # Member list is not yet fetched, use the name from the message.
+                    member = {"NickName": msg.get('ActualNickName', ''),
+                              "DisplayName": msg.get('ActualNickName', ''),
+                              "Uin": None}
                 logger.debug("search_user.done")
             mobj.source = MsgSource.Group
             logger.debug("Group. member: %s", member)
@@ -113,12 +129,34 @@ class WeChatChannel(EFBChannel):
     qr_uuid = ""
     done_reauth = threading.Event()
     _stop_polling = False
+    # Bytes of a file used to detect its MIME type
+    MIME_SNIFF_SIZE = 65536
+    # Bytes of a file read at a time when it is downloaded
+    MEDIA_CHUNK_SIZE = 65536
+    # Content types of error pages returned instead of files
+    MEDIA_ERROR_TYPES = ("text/html", "application/json")
 
     def __init__(self, queue, mutex):
         super().__init__(queue, mutex)
         self.itchat = itchat.new_instance()
+        self.uid_order = [i.lower() for i in self._flag("uid_order", ["NickName"])]
+        self.uid_cache = LRUCache(self._flag("uid_cache_size", 10000))
+        self.directory = ContactDirectory(self,
+                                          miss_ttl=self._flag("search_miss_ttl", 60),
+                                          refresh_interval=self._flag("refresh_interval", 300))
+        self.hydrator = MemberHydrator(self.directory,
+                                       batch_size=self._flag("hydrate_batch_size", 20),
+                                       interval=self._flag("hydrate_interval", 1),
+                                       min_age=self._flag("hydrate_min_age", 60))
+        self.directory.hydrator = self.hydrator
+        self.media_cache = MediaCache(self,
+                                      ttl=self._flag("media_id_ttl", 86400),
+                                      maxsize=self._flag("media_cache_size", 1000))
+        # MD5 of an image: content of the image converted to GIF
+        self.gif_cache = LRUCache(self._flag("gif_cache_size", 256))
         itchat.set_logging(loggingLevel=logging.getLogger().level, showOnCmd=False)
         self.itchat_msg_register()
+        self.itchat_contact_register()
         with mutex:
             self.itchat.auto_login(enableCmdQR=2,
                                    hotReload=True,
@@ -126,6 +164,7 @@ class WeChatChannel(EFBChannel):
                                    exitCallback=self.exit_callback,
                                    qrCallback=self.console_qr_code)
         mimetypes.init(files=["mimetypes"])
+        self.hydrator.start()
         self.logger.info("EWS Inited!!!\n---")
 
     #
@@ -188,7 +227,6 @@ class WeChatChannel(EFBChannel):
             QRCode(qr_url).png(path, scale=10)
             msg.text = 'Scan this QR Code with WeChat to continue.'
             msg.path = path
-            msg.file = open(path, 'rb')
             msg.mime = 'image/jpeg'
         if status in (200, 201) or uuid != self.qr_uuid:
             self.queue.put(msg)
@@ -255,9 +293,14 @@ class WeChatChannel(EFBChannel):
             data = {"nickname": r[0]['NickName'], "alias": r[0]["RemarkName"], "uin": r[0]["Uin"]}
         return self.encode_uid(data)
 
+    @staticmethod
+    def _uid_key(data):
+        return tuple(None if data[i] is None else str(data[i]) for i in ("nickname", "alias", "uin"))
+
     def encode_uid(self, data):
         """
         Encode uid by a predefined order in configuration.
+        Results are memorized in `self.uid_cache`.
 
         Args:
             data (dict): a dict with keys `{"nickname", "alias", "uin"}`
@@ -265,13 +308,27 @@ class WeChatChannel(EFBChannel):
         Returns:
             str: Encoded uid
         """
-        fallback_order = self._flag("uid_order", ["NickName"])
-        uid = data[fallback_order[-1].lower()]
-        for i in fallback_order:
-            if data[i.lower()]:
-                uid = data[i.lower()]
+        key = self._uid_key(data)
+        uid = self.uid_cache.get(key)
+        if uid is not None:
+            return uid
+        value = data[self.uid_order[-1]]
+        for i in self.uid_order:
+            if data[i]:
+                value = data[i]
                 break
-        return str(crc32(str(uid).encode("utf-8")))
+        uid = str(crc32(str(value).encode("utf-8")))
+        self.uid_cache.put(key, uid)
+        return uid
+
+    def forget_uid(self, data):
+        """
+        Remove a memorized uid, when the contact it belongs to is changed.
+
+        Args:
+            data (dict): a dict with keys `{"nickname", "alias", "uin"}`
+        """
+        self.uid_cache.pop(self._uid_key(data))
 
     def get_UserName(self, uid, refresh=False):
         """
@@ -295,6 +352,7 @@ class WeChatChannel(EFBChannel):
         """
         Search for a WeChat "User" (a user, a group/chat room or an MP account,
         by `UserName`, unique ID, WeChat ID, name/alias, and/or group member `UserName`.
+        Looked up in the contact directory (`self.directory`).
 
         At least one of `UserName`, `uid`, `wid`, or `name` should be provided.
 
@@ -308,11 +366,11 @@ class WeChatChannel(EFBChannel):
             name (str): Name or Alias
             ActualUserName (str): UserName of a group member, used only when a group is matched.
             refresh (bool): Refresh the user list, False by default.
+                Refreshes are throttled by the `refresh_interval` flag.
 
         Returns:
             list of dict: A list of matching users in ItChat user dict format.
         """
-        result = []
         UserName = None if UserName is None else str(UserName)
         uid = None if uid is None else str(uid)
         uin = None if uin is None else str(uin)
@@ -329,44 +387,20 @@ class WeChatChannel(EFBChannel):
                      "RemarkName": "System (%s)" % sys_chat_id,
                      "Uin": sys_chat_id}]
 
-        for i in self.itchat.get_friends(refresh) + self.itchat.get_mps(refresh):
-            data = {"nickname": self._wechat_html_unescape(i.get('NickName', None)),
-                    "alias": self._wechat_html_unescape(i.get("RemarkName", None)),
-                    "uin": i.get("Uin", None)}
-            if self.encode_uid(data) == uid or \
-                            str(i.get('UserName', '')) == UserName or \
-                            str(i.get('AttrStatus', '')) == uid or \
-                            str(i.get('Uin', '')) == uin or \
-                            str(i.get('NickName', '')) == name or \
-                            str(i.get('DisplayName', '')) == name:
-                i['NickName'] = self._wechat_html_unescape(i.get('NickName', ''))
-                i['DisplayName'] = self._wechat_html_unescape(i.get('DisplayName', ''))
-                result.append(i.copy())
-        for i in self.itchat.get_chatrooms(refresh):
-            if not i['UserName'].startswith('@@'):
-                continue
-            if not i.get('MemberList', ''):
-                i = self.itchat.update_chatroom(i.get('UserName', ''))
-            data = {"nickname": self._wechat_html_unescape(i.get('NickName', None)),
-                    "alias": self._wechat_html_unescape(i.get("RemarkName", None)),
-                    "uin": i.get("Uin", None)}
-            if self.encode_uid(data) == uid or \
-                            str(i.get('Uin', '')) == uin or \
-                            str(i.get('NickName', '')) == name or \
-                            str(i.get('DisplayName', '')) == name or \
-                            str(i.get('UserName', '')) == UserName:
-                i['NickName'] = self._wechat_html_unescape(i.get('NickName', ''))
-                i['DisplayName'] = self._wechat_html_unescape(i.get('DisplayName', ''))
-                result.append(i.copy())
-                result[-1]['MemberList'] = []
-                if ActualUserName:
-                    for j in i['MemberList']:
-                        if str(j['UserName']) == ActualUserName:
-                            j['NickName'] = self._wechat_html_unescape(j.get('NickName', ''))
-                            j['DisplayName'] = self._wechat_html_unescape(j.get('DisplayName', ''))
-                            result[-1]['MemberList'].append(j)
+        key = (UserName, uid, uin, name, ActualUserName)
+        if self.directory.is_missing(key):
+            return []
+        if refresh:
+            self.directory.refresh()
+        result = self.directory.search(UserName, uid, uin, name, ActualUserName)
         if not result and not refresh:
-            return self.search_user(UserName, uid, uin, name, ActualUserName, refresh=True)
+            # Contact lists of itchat may have changed since the directory is built.
+            self.directory.rebuild()
+            result = self.directory.search(UserName, uid, uin, name, ActualUserName)
+            if not result:
+                return self.search_user(UserName, uid, uin, name, ActualUserName, refresh=True)
+        if not result:
+            self.directory.set_missing(key)
         return result
 
     def poll(self):
@@ -381,6 +415,7 @@ class WeChatChannel(EFBChannel):
             self.itchat.dump_login_status("storage/%s.pkl" % self.channel_id)
 
         self.itchat.alive = False
+        self.hydrator.stop()
         self.logger.debug("%s (%s) gracefully stopped.", self.channel_name, self.channel_id)
 
     def itchat_msg_register(self):
@@ -398,6 +433,36 @@ class WeChatChannel(EFBChannel):
         @self.itchat.msg_register(["System"], isFriendChat=True, isMpChat=True, isGroupChat=True)
         def wc_msg_system_log(msg):
             self.logger.debug("WeChat \"System\" message:\n%s", repr(msg))
+            if msg.get('SystemInfo', None) == 'chatrooms':
+                # `UserName` of chat rooms changed.
+                self.directory.update_chatrooms(msg['Text'])
+
+    def itchat_contact_register(self):
+        """
+        Update the contact directory with friends and MP accounts changed.
+
+        Changes of contacts are sent by WeChat along with messages. itchat
+        merges changes of chat rooms into its contact list and reports them
+        with a "System" message, but updates friends and MP accounts
+        silently, so they are picked up here from `get_msg`.
+        """
+        get_msg = self.itchat.get_msg
+
+        @functools.wraps(get_msg)
+        def wc_get_msg():
+            msg_list, contact_list = get_msg()
+            friends = [i for i in contact_list or [] if not str(i.get('UserName', '')).startswith('@@')]
+            if friends:
+                # Merged again by itchat right after, which changes nothing.
+                update_local_friends(self.itchat, friends)
+                contacts = self.itchat.memberList + self.itchat.mpList
+                for i in friends:
+                    contact = itchat.utils.search_dict_list(contacts, 'UserName', i['UserName'])
+                    if contact is not None:
+                        self.directory.update_contact(contact)
+            return msg_list, contact_list
+
+        self.itchat.get_msg = wc_get_msg
 
     @wechat_msg_meta
     def wechat_text_msg(self, msg):
@@ -493,38 +558,33 @@ class WeChatChannel(EFBChannel):
     def wechat_picture_msg(self, msg):
         mobj = EFBMsg(self)
         mobj.type = MsgType.Image if msg['MsgType'] == 3 else MsgType.Sticker
-        mobj.path, mime = self.save_file(msg, mobj.type)
+        self.save_file(msg, mobj)
         mobj.text = None
-        mobj.file = open(mobj.path, "rb")
-        mobj.mime = mime
         return mobj
 
     @wechat_msg_meta
     def wechat_file_msg(self, msg):
         mobj = EFBMsg(self)
         mobj.type = MsgType.File
-        mobj.path, mobj.mime = self.save_file(msg, mobj.type)
+        self.save_file(msg, mobj)
         mobj.text = msg['FileName']
         mobj.filename = msg['FileName'] or None
-        mobj.file = open(mobj.path, "rb")
         return mobj
 
     @wechat_msg_meta
     def wechat_voice_msg(self, msg):
         mobj = EFBMsg(self)
         mobj.type = MsgType.Audio
-        mobj.path, mobj.mime = self.save_file(msg, mobj.type)
+        self.save_file(msg, mobj)
         mobj.text = None
-        mobj.file = open(mobj.path, "rb")
         return mobj
 
     @wechat_msg_meta
     def wechat_video_msg(self, msg):
         mobj = EFBMsg(self)
-        mobj.path, mobj.mime = self.save_file(msg, MsgType.Video)
         mobj.type = MsgType.Video
+        self.save_file(msg, mobj)
         mobj.text = None
-        mobj.file = open(mobj.path, "rb")
         return mobj
 
     @wechat_msg_meta
@@ -585,24 +645,145 @@ class WeChatChannel(EFBChannel):
         }
         return mobj
 
-    def save_file(self, msg, msg_type):
-        path = os.path.join("storage", self.channel_id)
-        if not os.path.exists(path):
-            os.makedirs(path)
-        filename = "%s_%s_%s" % (msg_type, msg['NewMsgId'], int(time.time()))
-        fullpath = os.path.join(path, filename)
-        msg['Text'](fullpath)
-        mime = magic.from_file(fullpath, mime=True)
+    def _media_request(self, msg):
+        """
+        Request of the file of a WeChat message, as made by ItChat, so that
+        the file can be streamed instead of read into memory at once.
+
+        Args:
+            msg (dict): The WeChat message.
+
+        Returns:
+            tuple: URL, parameters and headers of the request.
+        """
+        from itchat import config
+        login = self.itchat.loginInfo
+        headers = {'User-Agent': config.USER_AGENT}
+        if msg['MsgType'] == 49 and msg['AppMsgType'] == 6:
+            url = '%s/webwxgetmedia' % login['fileUrl']
+            params = {
+                'sender': msg['FromUserName'],
+                'mediaid': msg['MediaId'],
+                'filename': msg['FileName'],
+                'fromuser': login['wxuin'],
+                'pass_ticket': 'undefined',
+                'webwx_data_ticket': self.itchat.s.cookies.get('webwx_data_ticket'),
+            }
+            return url, params, headers
+        if msg['MsgType'] in (43, 62):
+            url, msg_id = '%s/webwxgetvideo' % login['url'], msg['MsgId']
+            headers['Range'] = 'bytes=0-'
+        elif msg['MsgType'] == 34:
+            url, msg_id = '%s/webwxgetvoice' % login['url'], msg['NewMsgId']
+        else:
+            url, msg_id = '%s/webwxgetmsgimg' % login['url'], msg['NewMsgId']
+        return url, {'msgid': msg_id, 'skey': login['skey']}, headers
+
+    def _media_response(self, msg):
+        """
+        Start streaming the file of a WeChat message.
+
+        Args:
+            msg (dict): The WeChat message.
+
+        Returns:
+            requests.Response: The response with the file, `None` if the
+                request fails or returns something else than the file.
+        """
+        r = None
+        try:
+            url, params, headers = self._media_request(msg)
+            r = self.itchat.s.get(url, params=params, headers=headers, stream=True)
+            r.raise_for_status()
+            content_type = r.headers.get('Content-Type', '').split(';')[0].strip().lower()
+            if content_type in self.MEDIA_ERROR_TYPES:
+                raise ValueError("Unexpected content type %s." % content_type)
+            return r
+        except Exception as e:
+            if r is not None:
+                r.close()
+            self.logger.warning("Failed to stream file of message %s (%r), downloading it with ItChat.",
+                                msg.get('NewMsgId', None), e)
+            return None
+
+    def _media_filename(self, msg, mobj, head):
+        """
+        Detect the MIME type of a file, and name the file after it.
+
+        Args:
+            msg (dict): The WeChat message.
+            mobj (EFBMsg): The message object, with `type` set.
+            head (bytes): First bytes of the file.
+
+        Returns:
+            tuple: MIME type and file name.
+        """
+        mime = magic.from_buffer(head, mime=True)
         if isinstance(mime, bytes):
             mime = mime.decode()
+        filename = "%s_%s_%s" % (mobj.type, msg['NewMsgId'], int(time.time()))
         guess_ext = mimetypes.guess_extension(mime) or ".unknown"
         if guess_ext == ".unknown":
-            self.logger.warning("File %s with mime %s has no matching extensions.", fullpath, mime)
+            self.logger.warning("File %s with mime %s has no matching extensions.", filename, mime)
         ext = ".jpeg" if mime == "image/jpeg" else guess_ext
-        os.rename(fullpath, "%s%s" % (fullpath, ext))
-        fullpath = "%s%s" % (fullpath, ext)
-        self.logger.info("File saved from WeChat\nFull path: %s\nMIME: %s", fullpath, mime)
-        return fullpath, mime
+        return mime, filename + ext
+
+    def save_file(self, msg, mobj):
+        """
+        Download the file of a WeChat message to a message object.
+
+        The file is streamed into memory, and its MIME type is detected
+        from the first bytes. If it cannot be streamed, it is downloaded
+        with ItChat, which reads it into memory at once. Files smaller than `in_memory_media_size`
+        bytes are kept in memory as `mobj.file`, with `mobj.path` left
+        `None`. Once a file reaches the size, it is written to the storage
+        directory, and the rest of it is streamed to disk.
+
+        Args:
+            msg (dict): The WeChat message.
+            mobj (EFBMsg): The message object, with `type` set.
+        """
+        threshold = self._flag("in_memory_media_size", 256 * 2 ** 10)
+        data = io.BytesIO()
+        f = None
+        size = 0
+        r = self._media_response(msg)
+        chunks = r.iter_content(self.MEDIA_CHUNK_SIZE) if r is not None else [msg['Text']()]
+        try:
+            for chunk in chunks:
+                size += len(chunk)
+                if f is not None:
+                    f.write(chunk)
+                    continue
+                data.write(chunk)
+                if size < threshold:
+                    continue
+                # Too large to be kept in memory.
+                mime, filename = self._media_filename(msg, mobj, bytes(data.getbuffer()[:self.MIME_SNIFF_SIZE]))
+                path = os.path.join("storage", self.channel_id)
+                if not os.path.exists(path):
+                    os.makedirs(path)
+                fullpath = os.path.join(path, filename)
+                f = open(fullpath, "wb")
+                f.write(data.getbuffer())
+                data = None
+        finally:
+            if r is not None:
+                r.close()
+            if f is not None:
+                f.close()
+        if f is not None:
+            mobj.mime = mime
+            mobj.path = fullpath
+            self.logger.info("File saved from WeChat\nFull path: %s\nMIME: %s", fullpath, mime)
+            return
+        mime, filename = self._media_filename(msg, mobj, bytes(data.getbuffer()[:self.MIME_SNIFF_SIZE]))
+        mobj.mime = mime
+        data.seek(0)
+        data.name = filename
+        mobj.file = data
+        self.logger.info("File kept in memory from WeChat\nName: %s\nSize: %s\nMIME: %s",
+                         filename, size, mime)
 
     def send_message(self, msg):
         """Send a message to WeChat.
@@ -653,7 +834,8 @@ class WeChatChannel(EFBChannel):
             r = self._itchat_send_msg(msg.text, UserName)
         elif msg.type in [MsgType.Image, MsgType.Sticker]:
             self.logger.info("Image/Sticker %s, %s", msg.type, msg.path)
-            if msg.mime in ["image/gif", "image/jpeg"]:
+            if msg.mime in ["image/gif", "image/jpeg"] or \
+                    msg.type == MsgType.Image and msg.mime in self._flag("image_passthrough_formats", []):
                 try:
                     if os.path.getsize(msg.path) > 5 * 2 ** 20:
                         raise EFBMessageError("Image sent is too large. (IS01)")
@@ -663,15 +845,15 @@ class WeChatChannel(EFBChannel):
                 except FileNotFoundError:
                     pass
             else:  # Convert Image format
-                img = Image.open(msg.path)
-                try:
-                    alpha = img.split()[3]
-                    mask = Image.eval(alpha, lambda a: 255 if a <= 128 else 0)
-                except IndexError:
-                    mask = Image.eval(img.split()[0], lambda a: 0)
-                img = img.convert('RGB').convert('P', palette=Image.ADAPTIVE, colors=255)
-                img.paste(255, mask)
-                img.save("%s.gif" % msg.path, transparency=255)
+                key = MediaCache.file_hash(msg.path)
+                gif = self.gif_cache.get(key)
+                if gif is None:
+                    transcode.get_service().run(transcode.image_to_gif, msg.path, "%s.gif" % msg.path)
+                    with open("%s.gif" % msg.path, "rb") as f:
+                        self.gif_cache.put(key, f.read())
+                else:
+                    with open("%s.gif" % msg.path, "wb") as f:
+                        f.write(gif)
                 msg.path = "%s.gif" % msg.path
                 self.logger.info('Image converted to GIF: %s', msg.path)
                 self.logger.debug("Sending %s (image) to ItChat.", msg.path)
@@ -795,13 +977,15 @@ class WeChatChannel(EFBChannel):
         groups_all = 0
         members_uin = 0
         members_all = 0
-        for i in self.itchat.get_chatrooms(True):
+        rooms = self.itchat.get_chatrooms(True)
+        fetched = {i['UserName']: i for i in self.hydrator.fetch([i['UserName'] for i in rooms
+                                                                    if not i.get('MemberList', '')])}
+        for i in rooms:
             groups_all += 1
             if i.get("Uin", None):
                 groups_uin += 1
-            if not i.get('MemberList', ''):
-                i = self.itchat.update_chatroom(i.get('UserName', ''))
-            for j in i['MemberList']:
+            i = fetched.get(i['UserName'], i)
+            for j in i.get('MemberList', None) or []:
                 members_all += 1
                 if j.get("Uin", None):
                     members_uin += 1
@@ -820,6 +1004,19 @@ class WeChatChannel(EFBChannel):
                 groups_uin, groups_all, 100 * groups_uin / groups_all,
                 members_uin, members_all, 100 * members_uin / members_all)
 
+    @extra(name="Cache stats",
+           desc="For debug purpose only.\n"
+                "Usage: {function_name}")
+    def cache_stats(self, param=""):
+        return "uid cache: {size}/{maxsize} entries, {hits} hits, {misses} misses, " \
+               "{hit_ratio:.1%} hit ratio.".format(**self.uid_cache.stats()) + \
+               "\nMember lists: {pending} chat rooms pending, {fetched} fetched " \
+               "in {requests} requests.".format(**self.hydrator.stats()) + \
+               "\nMediaId cache: {size}/{maxsize} files, {hits} hits, {misses} misses, " \
+               "{hit_ratio:.1%} hit ratio.".format(**self.media_cache.stats()) + \
+               "\nGIF cache: {size}/{maxsize} images, {hits} hits, {misses} misses, " \
+               "{hit_ratio:.1%} hit ratio.".format(**self.gif_cache.stats())
+
     @extra(name="Force log out",
            desc="Force log out WeChat session.\n"
                 "Usage: {function_name}")
@@ -985,27 +1182,58 @@ class WeChatChannel(EFBChannel):
             headers = {
                 'User-Agent': config.USER_AGENT,
                 'Content-Type': 'application/json;charset=UTF-8', }
-            r = self.s.post(url, headers=headers,
-                            data=json.dumps(data, ensure_ascii=False).encode('utf8'))
+            # Cookies of the login are kept in the session of ItChat.
+            r = transfer.get_engine().post(url, session=self.s, headers=headers,
+                                           data=json.dumps(data, ensure_ascii=False).encode('utf8')).result()
             return ReturnValue(rawResponse=r)
 
         try:
-            return _itchat_send_fn(self.itchat, *args, **kwargs)
+            return self._itchat_send_media(functools.partial(_itchat_send_fn, self.itchat), "doc", *args, **kwargs)
         except Exception as e:
             raise EFBMessageError(repr(e))
 
-    def _itchat_send_image(self, *args, **kwargs):
+    def _itchat_send_image(self, fileDir, *args, **kwargs):
+        # GIF is uploaded as file by ItChat.
+        kind = "doc" if fileDir[-4:] == ".gif" else "pic"
         try:
-            return self.itchat.send_image(*args, **kwargs)
+            return self._itchat_send_media(self.itchat.send_image, kind, fileDir, *args, **kwargs)
         except Exception as e:
             raise EFBMessageError(repr(e))
 
     def _itchat_send_video(self, *args, **kwargs):
         try:
-            return self.itchat.send_video(*args, **kwargs)
+            return self._itchat_send_media(self.itchat.send_video, "video", *args, **kwargs)
         except Exception as e:
             raise EFBMessageError(repr(e))
 
+    def _itchat_send_media(self, send, kind, fileDir, *args, **kwargs):
+        """
+        Send a file with the `MediaId` of the same file uploaded before,
+        or upload it first and remember its `MediaId`.
+
+        Args:
+            send (callable): ItChat send function accepting `mediaId`.
+            kind (str): Kind of upload, `"pic"`, `"video"` or `"doc"`.
+            fileDir (str): Path to the file.
+            *args, **kwargs: Other arguments of `send`.
+
+        Returns:
+            itchat.returnvalues.ReturnValue: Result of the sending or upload.
+        """
+        key = "%s:%s:%s" % (self.itchat.loginInfo.get('wxuin', ''), kind, MediaCache.file_hash(fileDir))
+        media_id = self.media_cache.get(key)
+        if media_id is not None:
+            r = send(fileDir, *args, mediaId=media_id, **kwargs)
+            if r:
+                return r
+            self.logger.debug("Cached MediaId of %s is rejected, uploading again: %s", fileDir, r)
+            self.media_cache.pop(key)
+        r = self.itchat.upload_file(fileDir, isPicture=kind == "pic", isVideo=kind == "video")
+        if not r:
+            return r
+        self.media_cache.put(key, r['MediaId'])
+        return send(fileDir, *args, mediaId=r['MediaId'], **kwargs)
+
     @staticmethod
     def _wechat_html_unescape(content):
         """
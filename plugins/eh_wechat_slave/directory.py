@@ -0,0 +1,305 @@
+import itertools
+import logging
+import threading
+import time
+
+
+class ContactDirectory:
+    """
+    Indexes of WeChat contacts (friends, MP accounts and chat rooms) for
+    constant-time lookup by `UserName`, uid, `Uin` and name (`NickName`,
+    `RemarkName` or `DisplayName`), and of members of each chat room by
+    `UserName`.
+
+    The directory is built from the contact lists kept by itchat, and is
+    updated per chat room when itchat reports changes of chat rooms, and
+    per contact when WeChat sends changes of friends and MP accounts.
+    Memorized uid of contacts changed or removed are forgotten.
+    A lookup that finds nothing rebuilds the directory from itchat once,
+    and then from WeChat servers, like a linear search with `refresh` does.
+
+    Lookups that still find nothing are remembered for `miss_ttl` seconds,
+    and are not looked up again in the meantime. Contact lists are fetched
+    from WeChat servers at most once every `refresh_interval` seconds, and
+    lookups missing at the same time wait for the same refresh.
+
+    Member lists of chat rooms are fetched by `hydrator` in background, if
+    set. Until then, members are looked up in what is already fetched.
+
+    Args:
+        channel (WeChatChannel): The WeChat slave channel.
+        miss_ttl (float): Seconds to remember a lookup finding nothing.
+        refresh_interval (float): Minimum seconds between two refreshes.
+    """
+
+    MAX_MISSES = 10000
+
+    def __init__(self, channel, miss_ttl=60, refresh_interval=300):
+        self.channel = channel
+        self.miss_ttl = miss_ttl
+        self.refresh_interval = refresh_interval
+        self.logger = logging.getLogger("plugins.%s.ContactDirectory" % channel.channel_id)
+        self.lock = threading.RLock()
+        self.counter = itertools.count()
+        # UserName: (order, contact, is chat room, index keys)
+        self.contacts = {}
+        # key: set of UserName
+        self.by_uid = {}
+        self.by_uin = {}
+        self.by_name = {}
+        # chat room UserName: {member UserName: member}
+        self.members = {}
+        self.built = False
+        # lookup key: expiry time
+        self.misses = {}
+        self.refresh_lock = threading.Lock()
+        self.last_refresh = 0
+        # MemberHydrator
+        self.hydrator = None
+
+    @staticmethod
+    def _index_add(index, key, user_name):
+        if key:
+            index.setdefault(str(key), set()).add(user_name)
+
+    @staticmethod
+    def _index_remove(index, key, user_name):
+        if not key:
+            return
+        names = index.get(str(key), None)
+        if names is not None:
+            names.discard(user_name)
+            if not names:
+                del index[str(key)]
+
+    def _keys(self, contact):
+        """
+        Index keys of a contact.
+
+        Returns:
+            tuple: (uid, `Uin`, names, data of uid)
+        """
+        unescape = self.channel._wechat_html_unescape
+        data = {"nickname": unescape(contact.get('NickName', None)),
+                "alias": unescape(contact.get("RemarkName", None)),
+                "uin": contact.get("Uin", None)}
+        uids = {self.channel.encode_uid(data)}
+        names = set()
+        for i in ('NickName', 'RemarkName', 'DisplayName'):
+            names.update((contact.get(i, None), unescape(contact.get(i, ''))))
+        return uids, contact.get('Uin', None), names, data
+
+    def _add(self, contact, room=False):
+        user_name = str(contact.get('UserName', ''))
+        if not user_name:
+            return
+        keys = self._keys(contact)
+        self._remove(user_name, keep=keys[3])
+        uids, uin, names, _ = keys
+        self.contacts[user_name] = (next(self.counter), contact, room, keys)
+        for i in uids:
+            self._index_add(self.by_uid, i, user_name)
+        self._index_add(self.by_uin, uin, user_name)
+        for i in names:
+            self._index_add(self.by_name, i, user_name)
+        if room:
+            self.members[user_name] = {str(i['UserName']): i for i in contact.get('MemberList', None) or []}
+
+    def _remove(self, user_name, keep=None):
+        entry = self.contacts.pop(user_name, None)
+        if entry is None:
+            return
+        # Contacts may be changed in place by itchat, so use the keys indexed.
+        uids, uin, names, data = entry[3]
+        if data != keep:
+            self.channel.forget_uid(data)
+        for i in uids:
+            self._index_remove(self.by_uid, i, user_name)
+        self._index_remove(self.by_uin, uin, user_name)
+        for i in names:
+            self._index_remove(self.by_name, i, user_name)
+        self.members.pop(user_name, None)
+
+    def rebuild(self, refresh=False):
+        """
+        Build all indexes from contact lists.
+
+        Args:
+            refresh (bool): Fetch contact lists from WeChat servers.
+        """
+        itchat = self.channel.itchat
+        contacts = itchat.get_friends(refresh) + itchat.get_mps(refresh)
+        rooms = [i for i in itchat.get_chatrooms(refresh) if str(i.get('UserName', '')).startswith('@@')]
+        with self.lock:
+            old = self.contacts
+            self.contacts = {}
+            self.by_uid.clear()
+            self.by_uin.clear()
+            self.by_name.clear()
+            self.members.clear()
+            for i in contacts:
+                self._add(i)
+            for i in rooms:
+                self._add(i, room=True)
+            self.built = True
+            # Forget uid of contacts changed or removed.
+            for user_name, entry in old.items():
+                new = self.contacts.get(user_name, None)
+                if new is None or new[3][3] != entry[3][3]:
+                    self.channel.forget_uid(entry[3][3])
+            empty_rooms = [i for i, members in self.members.items() if not members]
+        if self.hydrator is not None:
+            self.hydrator.request(empty_rooms)
+        self.logger.debug("Contact directory built with %s contacts and %s chat rooms.", len(contacts), len(rooms))
+
+    def refresh(self):
+        """
+        Rebuild the directory from WeChat servers, unless it is refreshed
+        in the last `refresh_interval` seconds. If another refresh is
+        running, wait for it instead of starting a new one.
+
+        Returns:
+            bool: `True` if a refresh is done by this call.
+        """
+        start = time.time()
+        with self.refresh_lock:
+            if self.last_refresh > start or start - self.last_refresh < self.refresh_interval:
+                return False
+            self.rebuild(refresh=True)
+            self.last_refresh = time.time()
+        with self.lock:
+            self.misses.clear()
+        return True
+
+    def is_missing(self, key):
+        """
+        Check if a lookup recently found nothing.
+
+        Args:
+            key (tuple): Arguments of the lookup.
+        """
+        with self.lock:
+            expiry = self.misses.get(key, None)
+            if expiry is None:
+                return False
+            if expiry < time.time():
+                del self.misses[key]
+                return False
+            return True
+
+    def set_missing(self, key):
+        """
+        Remember that a lookup found nothing.
+
+        Args:
+            key (tuple): Arguments of the lookup.
+        """
+        now = time.time()
+        with self.lock:
+            if len(self.misses) >= self.MAX_MISSES:
+                self.misses = {k: v for k, v in self.misses.items() if v >= now}
+            self.misses[key] = now + self.miss_ttl
+
+    def _forget_misses(self, user_name):
+        """
+        Forget lookups found nothing that may find a contact updated: by its
+        `UserName` or keys indexed, or of members of the chat room.
+        Other lookups found nothing are kept.
+
+        Args:
+            user_name (str): `UserName` of the contact.
+        """
+        values = {user_name}
+        entry = self.contacts.get(user_name, None)
+        if entry is not None:
+            uids, uin, names, _ = entry[3]
+            values.update(uids, names, (uin,))
+        values.difference_update((None, ""))
+        self.misses = {k: v for k, v in self.misses.items() if values.isdisjoint(k)}
+
+    def update_chatrooms(self, user_names):
+        """
+        Update indexes of chat rooms changed, from the contact list of itchat.
+
+        Args:
+            user_names (list of str): `UserName` of chat rooms.
+        """
+        itchat = self.channel.itchat
+        for user_name in user_names:
+            room = itchat.search_chatrooms(userName=user_name)
+            with self.lock:
+                if room:
+                    self._add(room, room=True)
+                else:
+                    self._remove(str(user_name))
+                self._forget_misses(str(user_name))
+
+    def update_contact(self, contact):
+        """
+        Add or update a contact.
+
+        Args:
+            contact (dict): The contact in itchat format.
+        """
+        user_name = str(contact.get('UserName', ''))
+        with self.lock:
+            self._add(contact, room=user_name.startswith('@@'))
+            self._forget_misses(user_name)
+
+    def _member(self, room, actual_user_name):
+        """
+        Get a member of a chat room. If it is not there, fetch the member
+        list from WeChat servers, in background if `hydrator` is set.
+        """
+        with self.lock:
+            member = self.members.get(room, {}).get(actual_user_name, None)
+        key = ("member", room, actual_user_name)
+        if member is None and not self.is_missing(key):
+            if self.hydrator is not None:
+                self.hydrator.request([room])
+                return None
+            contact = self.channel.itchat.update_chatroom(room)
+            if contact:
+                with self.lock:
+                    self._add(contact, room=True)
+                    member = self.members[room].get(actual_user_name, None)
+            if member is None:
+                self.set_missing(key)
+        return member
+
+    def _copy(self, contact):
+        unescape = self.channel._wechat_html_unescape
+        contact = contact.copy()
+        contact['NickName'] = unescape(contact.get('NickName', ''))
+        contact['DisplayName'] = unescape(contact.get('DisplayName', ''))
+        return contact
+
+    def search(self, UserName=None, uid=None, uin=None, name=None, ActualUserName=None):
+        """
+        Look for contacts matching any of the given keys.
+        See `WeChatChannel.search_user` for details.
+
+        Returns:
+            list of dict: Matching contacts, friends and MP accounts first,
+                then chat rooms, each in the order of the contact list.
+        """
+        with self.lock:
+            if not self.built:
+                self.rebuild()
+            names = set()
+            if UserName is not None and UserName in self.contacts:
+                names.add(UserName)
+            for index, key in ((self.by_uid, uid), (self.by_uin, uin), (self.by_name, name)):
+                if key is not None:
+                    names.update(index.get(key, ()))
+            entries = sorted((self.contacts[i] for i in names), key=lambda i: (i[2], i[0]))
+        result = []
+        for _, contact, room, _ in entries:
+            result.append(self._copy(contact))
+            if room:
+                result[-1]['MemberList'] = []
+                if ActualUserName:
+                    member = self._member(str(contact['UserName']), ActualUserName)
+                    if member is not None:
+                        result[-1]['MemberList'].append(self._copy(member))
+        return result
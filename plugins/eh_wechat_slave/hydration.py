@@ -0,0 +1,140 @@
+import heapq
+import logging
+import threading
+import time
+
+
+class MemberHydrator:
+    """
+    Fetch member lists of chat rooms on a background thread, so that
+    lookups never wait for WeChat servers.
+
+    Chat rooms requested are fetched in batches of `batch_size` with one
+    request each, rooms with the most recent messages first. A chat room
+    is not fetched again within `min_age` seconds.
+
+    Args:
+        directory (ContactDirectory): Contact directory to be updated.
+        batch_size (int): Maximum number of chat rooms fetched per request.
+        interval (float): Seconds to wait between two requests.
+        min_age (float): Minimum seconds before a chat room is fetched again.
+    """
+
+    def __init__(self, directory, batch_size=20, interval=1.0, min_age=60):
+        self.directory = directory
+        self.batch_size = batch_size
+        self.interval = interval
+        self.min_age = min_age
+        self.logger = logging.getLogger("plugins.%s.MemberHydrator" % directory.channel.channel_id)
+        self.cond = threading.Condition()
+        # chat room UserName: priority (time of the last message)
+        self.pending = {}
+        # chat room UserName: time of the last message
+        self.activity = {}
+        # chat room UserName: time fetched
+        self.fetched = {}
+        self.fetched_count = 0
+        self.requests = 0
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self._loop, name="%s-hydrator" % self.directory.channel.channel_id,
+                                       daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+
+    def touch(self, room):
+        """
+        Record a message from a chat room, to prioritize the chat room.
+
+        Args:
+            room (str): `UserName` of the chat room.
+        """
+        now = time.time()
+        with self.cond:
+            self.activity[room] = now
+            if room in self.pending:
+                self.pending[room] = now
+
+    def request(self, rooms, force=False):
+        """
+        Request member lists of chat rooms to be fetched.
+
+        Args:
+            rooms (list of str): `UserName` of chat rooms.
+            force (bool): Fetch even if the chat room is fetched recently.
+        """
+        now = time.time()
+        with self.cond:
+            for room in rooms:
+                if not force and now - self.fetched.get(room, 0) < self.min_age:
+                    continue
+                self.pending[room] = self.activity.get(room, 0)
+            if self.pending:
+                self.cond.notify()
+
+    def fetch(self, rooms):
+        """
+        Fetch member lists of chat rooms now, and update the directory.
+
+        Args:
+            rooms (list of str): `UserName` of chat rooms.
+
+        Returns:
+            list of dict: Chat rooms fetched, in itchat format.
+        """
+        result = []
+        for offset in range(0, len(rooms), self.batch_size):
+            batch = rooms[offset:offset + self.batch_size]
+            r = self.directory.channel.itchat.update_chatroom(batch)
+            # itchat returns a dict instead of a list for one chat room,
+            # and an error dict without `UserName` if nothing is found.
+            r = [r] if isinstance(r, dict) else list(r or [])
+            r = [i for i in r if i.get('UserName', None)]
+            now = time.time()
+            with self.cond:
+                self.requests += 1
+                self.fetched_count += len(r)
+                for i in batch:
+                    self.fetched[i] = now
+            for i in r:
+                self.directory.update_contact(i)
+            result += r
+        return result
+
+    def _loop(self):
+        while True:
+            with self.cond:
+                while self.running and not self.pending:
+                    self.cond.wait()
+                if not self.running:
+                    return
+                batch = heapq.nlargest(self.batch_size, self.pending, key=self.pending.get)
+                for i in batch:
+                    del self.pending[i]
+            try:
+                self.fetch(batch)
+                self.logger.debug("Member lists of %s chat rooms fetched.", len(batch))
+            except Exception:
+                self.logger.exception("Failed to fetch member lists of chat rooms %s.", batch)
+            time.sleep(self.interval)
+
+    def stats(self):
+        """
+        Returns:
+            dict: Chat rooms pending and fetched, and requests made.
+        """
+        with self.cond:
+            return {
+                "pending": len(self.pending),
+                "fetched": self.fetched_count,
+                "requests": self.requests,
+            }
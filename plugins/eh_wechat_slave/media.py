@@ -0,0 +1,131 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+
+class MediaCache:
+    """
+    Persistent cache of `MediaId` of files uploaded to WeChat, by the MD5
+    hash of their content, so that a file sent again is not uploaded again.
+
+    Entries expire `ttl` seconds after upload, and at most `maxsize`
+    entries are kept, the oldest dropped first. Entries are kept per
+    account, as `MediaId` of one account is not valid for another.
+
+    The cache is saved in `media_cache.json` in the storage directory of
+    the channel.
+
+    Args:
+        channel (WeChatChannel): The WeChat slave channel.
+        ttl (float): Seconds before an entry expires.
+        maxsize (int): Maximum number of entries.
+    """
+
+    def __init__(self, channel, ttl=86400, maxsize=1000):
+        self.channel = channel
+        self.path = os.path.join("storage", channel.channel_id, "media_cache.json")
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.logger = logging.getLogger("plugins.%s.MediaCache" % channel.channel_id)
+        self.lock = threading.Lock()
+        # "account:kind:md5": [MediaId, expiry time]
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                self.entries = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError):
+            self.logger.exception("Failed to load media cache from %s, starting empty.", self.path)
+            return
+        self._expire()
+
+    def _save(self):
+        directory = os.path.dirname(self.path)
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        tmp = "%s.tmp" % self.path
+        with open(tmp, "w") as f:
+            json.dump(self.entries, f)
+        os.replace(tmp, self.path)
+
+    def _expire(self):
+        now = time.time()
+        self.entries = {k: v for k, v in self.entries.items() if v[1] >= now}
+
+    @staticmethod
+    def file_hash(path):
+        """
+        MD5 hash of a file, as used by WeChat for uploads.
+
+        Args:
+            path (str): Path to the file.
+
+        Returns:
+            str: Hex digest of the content.
+        """
+        h = hashlib.md5()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(65536), b""):
+                h.update(chunk)
+        return h.hexdigest()
+
+    def get(self, key):
+        """
+        Args:
+            key (str): Key of the file.
+
+        Returns:
+            str: `MediaId` of the file, `None` if not cached or expired.
+        """
+        with self.lock:
+            entry = self.entries.get(key, None)
+            if entry is None or entry[1] < time.time():
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, media_id):
+        """
+        Args:
+            key (str): Key of the file.
+            media_id (str): `MediaId` of the file uploaded.
+        """
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = [media_id, time.time() + self.ttl]
+            if len(self.entries) > self.maxsize:
+                self._expire()
+                # Entries are kept in order of insertion.
+                for i in list(self.entries)[:len(self.entries) - self.maxsize]:
+                    del self.entries[i]
+            self._save()
+
+    def pop(self, key):
+        with self.lock:
+            if self.entries.pop(key, None) is not None:
+                self._save()
+
+    def stats(self):
+        """
+        Returns:
+            dict: Size, maximum size, hits, misses and hit ratio.
+        """
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self.entries),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / total if total else 0.0,
+            }
@@ -0,0 +1,206 @@
+import logging
+import os
+import pickle
+import struct
+import threading
+
+
+class Spool:
+    """
+    Append-only on-disk journal of messages in flight, so that messages
+    not yet delivered by the master channel survive a restart.
+
+    Each record is a header `(op, seq, length)` followed by `length` bytes
+    of payload. A "put" record carries a pickled `EFBMsg` (metadata and
+    path of its media file, which is reopened lazily), and a "done"
+    record marks the message with the same `seq` as delivered. A torn
+    record at the end of the journal (e.g. after a power loss) is
+    discarded when loading.
+
+    Writes are flushed and `fsync`ed in batches: after `fsync_batch`
+    records, or `fsync_interval` seconds after the first unsynced record,
+    whichever comes first. When `compact_threshold` messages are marked
+    as done, the journal is rewritten with only pending messages.
+
+    Args:
+        path (str): Path to the journal file.
+        fsync_interval (float): Maximum seconds before records are synced.
+        fsync_batch (int): Maximum number of unsynced records.
+        compact_threshold (int): Number of "done" records that triggers
+            compaction.
+    """
+
+    OP_PUT = 1
+    OP_DONE = 2
+    HEADER = struct.Struct("<BQI")
+
+    def __init__(self, path=os.path.join("storage", "spool.journal"), fsync_interval=1.0, fsync_batch=64,
+                 compact_threshold=1000):
+        self.path = path
+        self.fsync_interval = fsync_interval
+        self.fsync_batch = fsync_batch
+        self.compact_threshold = compact_threshold
+        self.logger = logging.getLogger(__name__)
+        self.lock = threading.RLock()
+        # seq: (offset, length) of the payload of pending messages
+        self.pending = {}
+        self.seq = 0
+        self.done_count = 0
+        self.unsynced = 0
+        self.closed = False
+        dirname = os.path.dirname(self.path)
+        if dirname and not os.path.exists(dirname):
+            os.makedirs(dirname)
+        self._load()
+        self.file = open(self.path, "ab")
+        self.sync_event = threading.Event()
+        self.sync_thread = threading.Thread(target=self._sync_loop, name="Spool-fsync", daemon=True)
+        self.sync_thread.start()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb") as f:
+            data = f.read()
+        offset = 0
+        while offset + self.HEADER.size <= len(data):
+            op, seq, length = self.HEADER.unpack_from(data, offset)
+            start = offset + self.HEADER.size
+            if start + length > len(data):
+                break
+            if op == self.OP_PUT:
+                self.pending[seq] = (start, length)
+            elif self.pending.pop(seq, None) is not None:
+                self.done_count += 1
+            self.seq = max(self.seq, seq + 1)
+            offset = start + length
+        if offset < len(data):
+            self.logger.warning("Torn record found at the end of spool %s, %s bytes discarded.",
+                                self.path, len(data) - offset)
+            with open(self.path, "r+b") as f:
+                f.truncate(offset)
+
+    def _write(self, op, seq, payload=b""):
+        offset = self.file.tell() + self.HEADER.size
+        self.file.write(self.HEADER.pack(op, seq, len(payload)))
+        self.file.write(payload)
+        self.unsynced += 1
+        if self.unsynced == 1 or self.unsynced >= self.fsync_batch:
+            self.sync_event.set()
+        return offset
+
+    def _sync_loop(self):
+        while not self.closed:
+            self.sync_event.wait()
+            self.sync_event.clear()
+            if self.unsynced < self.fsync_batch:
+                self.sync_event.wait(self.fsync_interval)
+                self.sync_event.clear()
+            self.sync()
+
+    def sync(self):
+        """
+        Flush and `fsync` all records written so far.
+        """
+        with self.lock:
+            if not self.unsynced or self.file.closed:
+                return
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.unsynced = 0
+
+    def append(self, msg):
+        """
+        Save a message to the spool.
+
+        Args:
+            msg (EFBMsg): The message.
+
+        Returns:
+            int: Sequence number of the message in the spool.
+        """
+        payload = pickle.dumps(msg)
+        with self.lock:
+            seq = self.seq
+            self.seq += 1
+            self.pending[seq] = (self._write(self.OP_PUT, seq, payload), len(payload))
+            return seq
+
+    def done(self, seq):
+        """
+        Mark a message as delivered.
+
+        Args:
+            seq (int): Sequence number of the message.
+        """
+        with self.lock:
+            if self.pending.pop(seq, None) is None:
+                return
+            self._write(self.OP_DONE, seq)
+            self.done_count += 1
+            if self.done_count >= self.compact_threshold:
+                self.compact()
+
+    def load(self, seq):
+        """
+        Read a pending message back from the spool.
+
+        Args:
+            seq (int): Sequence number of the message.
+
+        Returns:
+            EFBMsg: The message.
+        """
+        with self.lock:
+            offset, length = self.pending[seq]
+            self.file.flush()
+            with open(self.path, "rb") as f:
+                f.seek(offset)
+                payload = f.read(length)
+        return pickle.loads(payload)
+
+    def replay(self):
+        """
+        Get all pending messages in the order they were saved.
+
+        Returns:
+            list of int: Sequence numbers of pending messages.
+        """
+        with self.lock:
+            return sorted(self.pending)
+
+    def compact(self):
+        """
+        Rewrite the journal with only pending messages.
+        """
+        with self.lock:
+            self.file.flush()
+            tmp_path = self.path + ".compact"
+            pending = {}
+            with open(self.path, "rb") as src, open(tmp_path, "wb") as dst:
+                for seq in sorted(self.pending):
+                    offset, length = self.pending[seq]
+                    src.seek(offset)
+                    payload = src.read(length)
+                    dst.write(self.HEADER.pack(self.OP_PUT, seq, length))
+                    pending[seq] = (dst.tell(), length)
+                    dst.write(payload)
+                dst.flush()
+                os.fsync(dst.fileno())
+            self.file.close()
+            os.replace(tmp_path, self.path)
+            self.file = open(self.path, "ab")
+            self.pending = pending
+            self.done_count = 0
+            self.unsynced = 0
+            self.logger.debug("Spool %s compacted, %s messages pending.", self.path, len(pending))
+
+    def close(self):
+        """
+        Sync and close the journal.
+        """
+        with self.lock:
+            self.sync()
+            self.closed = True
+            self.file.close()
+        self.sync_event.set()
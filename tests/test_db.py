@@ -0,0 +1,158 @@
+import datetime
+import os
+import sys
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+# Imported alone, as the package of the Telegram master channel needs
+# python-telegram-bot.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                "plugins", "eh_telegram_master"))
+try:
+    import db
+except ImportError:  # config.py is not found
+    db = None
+
+tmp = None
+
+
+def setUpModule():
+    global tmp
+    if db is None:
+        return
+    tmp = tempfile.TemporaryDirectory()
+    db.flush()
+    db.db.close()
+    db.db.init(os.path.join(tmp.name, "tgdata.db"), pragmas=db._pragmas)
+    db.db.connect()
+    db._create()
+
+
+def tearDownModule():
+    if tmp is not None:
+        db.flush()
+        db.db.close()
+        tmp.cleanup()
+
+
+@unittest.skipIf(db is None, "config.py is not found")
+class WriteBehindTest(unittest.TestCase):
+    def setUp(self):
+        db.flush()
+        db.MsgLog.delete().execute()
+
+    def add_msg_log(self, msg_id, text, update=False):
+        return db.add_msg_log(master_msg_id="1.%s" % msg_id, text=text, slave_origin_uid="test.1",
+                              msg_type="Text", sent_to="master", slave_message_id=str(msg_id), update=update)
+
+    def test_flush_persists_writes_in_order(self):
+        for i in range(250):
+            self.add_msg_log(i, "a")
+        self.add_msg_log(7, "b", update=True)
+        # A write outside of transactions runs after the writes queued before it.
+        count = []
+        db.write(lambda: count.append(db.MsgLog.select().count()), atomic=False)
+        self.add_msg_log(7, "c", update=True)
+        db.flush()
+        self.assertEqual(count, [250])
+        self.assertEqual(db.MsgLog.select().count(), 250)
+        self.assertEqual(db.MsgLog.get(db.MsgLog.master_msg_id == "1.7").text, "c")
+        self.assertEqual(db._pending_msg_log, {})
+
+    def test_pending_msg_log_readable_before_flush(self):
+        msg_log = self.add_msg_log(1, "a")
+        self.assertEqual(db.get_msg_log("1.1").text, "a")
+        self.assertEqual(db.get_last_msg_from_chat(1).master_msg_id, msg_log.master_msg_id)
+        db.flush()
+        self.assertEqual(db.get_msg_log("1.1").text, "a")
+
+    def test_msg_log_readable_until_committed(self):
+        started, saved = threading.Event(), threading.Event()
+        resume, release = threading.Event(), threading.Event()
+        db.write(lambda: started.set() or resume.wait(5), atomic=False)
+        started.wait(5)
+        self.add_msg_log(1, "a")
+        # Run in the same transaction as the message log, after it is saved.
+        db.write(lambda: saved.set() or release.wait(5))
+        resume.set()
+        self.assertTrue(saved.wait(5))
+        try:
+            self.assertEqual(db.get_msg_log("1.1").text, "a")
+        finally:
+            release.set()
+        db.flush()
+        self.assertEqual(db._pending_msg_log, {})
+
+
+
+@unittest.skipIf(db is None, "config.py is not found")
+class SlaveChatInfoBulkTest(unittest.TestCase):
+    def setUp(self):
+        db.SlaveChatInfo.delete().execute()
+
+    @staticmethod
+    def chat(uid, name, alias=""):
+        return {"slave_channel_id": "test", "slave_channel_emoji": "T", "slave_chat_uid": uid,
+                "slave_chat_name": name, "slave_chat_alias": alias, "slave_chat_type": "User"}
+
+    def check_bulk(self):
+        self.assertEqual(db.set_slave_chat_info_bulk([self.chat("1", "Alice"), self.chat("2", "Bob")]), 2)
+        # Entries without changes are not written.
+        self.assertEqual(db.set_slave_chat_info_bulk([self.chat("1", "Alice"), self.chat("2", "Bob")]), 0)
+        self.assertEqual(db.set_slave_chat_info_bulk([self.chat("1", "Alice"), self.chat("2", "Bob", "Bobby")]), 1)
+        self.assertEqual(db.SlaveChatInfo.select().count(), 2)
+        self.assertEqual(db.get_slave_chat_info("test", "2").slave_chat_alias, "Bobby")
+        self.assertEqual(db.get_slave_chat_info("test", "1").slave_chat_name, "Alice")
+
+    @unittest.skipUnless(db and db._upsert, "SQLite is older than 3.24.0")
+    def test_upsert(self):
+        self.check_bulk()
+
+    def test_upsert_many(self):
+        chats = [self.chat(str(i), "Chat %s" % i) for i in range(400)]
+        self.assertEqual(db.set_slave_chat_info_bulk(chats), 400)
+        self.assertEqual(db.SlaveChatInfo.select().count(), 400)
+
+    def test_fallback_per_row(self):
+        with mock.patch.object(db, "_upsert", False):
+            self.check_bulk()
+
+
+
+@unittest.skipIf(db is None, "config.py is not found")
+class ArchiveTest(unittest.TestCase):
+    def setUp(self):
+        db.flush()
+        db.MsgLog.delete().execute()
+        patcher = mock.patch.object(db, "archivePath", os.path.join(tmp.name, "archive"))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_migrate_to_incremental_vacuum(self):
+        db.MsgLog.create(master_msg_id="1.0", slave_message_id="0", text="a", slave_origin_uid="test.1",
+                         msg_type="Text", sent_to="master", master_chat_id="1")
+        db.db.execute_sql("PRAGMA auto_vacuum = NONE")
+        db.db.execute_sql("VACUUM")
+        self.assertEqual(db.db.execute_sql("PRAGMA auto_vacuum").fetchone()[0], 0)
+        db._migrate(5)
+        self.assertEqual(db.db.execute_sql("PRAGMA auto_vacuum").fetchone()[0], 2)
+        self.assertEqual(db.get_msg_log("1.0").text, "a")
+
+    def test_archive_reclaims_space_in_steps(self):
+        old = datetime.datetime.now() - datetime.timedelta(days=200)
+        for i, time in enumerate((old, old, datetime.datetime.now())):
+            db.MsgLog.create(master_msg_id="1.%s" % i, slave_message_id=str(i), text="a",
+                             slave_origin_uid="test.1", msg_type="Text", sent_to="master",
+                             master_chat_id="1", time=time)
+        with mock.patch.object(db, "_vacuum_step") as vacuum_step:
+            self.assertEqual(db.archive_msg_log(retention_days=180), 2)
+        vacuum_step.assert_called_once_with()
+        self.assertEqual(db.MsgLog.select().count(), 1)
+        self.assertEqual(db.get_msg_log("1.0").master_msg_id, "1.0")
+
+
+if __name__ == "__main__":
+    unittest.main()
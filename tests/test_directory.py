@@ -0,0 +1,153 @@
+import os
+import sys
+import unittest
+from unittest import mock
+from binascii import crc32
+
+# Imported alone, as the package of the WeChat slave channel needs `config`.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                "plugins", "eh_wechat_slave"))
+from directory import ContactDirectory
+
+
+class FakeItChat:
+    def __init__(self, friends=(), mps=(), chatrooms=()):
+        self.friends = list(friends)
+        self.mps = list(mps)
+        self.chatrooms = list(chatrooms)
+
+    def get_friends(self, update=False):
+        return self.friends
+
+    def get_mps(self, update=False):
+        return self.mps
+
+    def get_chatrooms(self, update=False):
+        return self.chatrooms
+
+    def search_chatrooms(self, userName=None):
+        for i in self.chatrooms:
+            if i['UserName'] == userName:
+                return i
+        return None
+
+    def update_chatroom(self, userName):
+        return self.search_chatrooms(userName)
+
+
+class FakeChannel:
+    channel_id = "eh_wechat_slave"
+
+    def __init__(self, itchat):
+        self.itchat = itchat
+        self.forgotten = []
+
+    @staticmethod
+    def _wechat_html_unescape(content):
+        return content
+
+    @staticmethod
+    def encode_uid(data):
+        return str(crc32(str(data["nickname"]).encode("utf-8")))
+
+    def forget_uid(self, data):
+        self.forgotten.append(data)
+
+
+ALICE = {'UserName': '@alice', 'NickName': 'Alice', 'RemarkName': 'Ally', 'DisplayName': '',
+         'Uin': 1001, 'AttrStatus': 0}
+BOB = {'UserName': '@bob', 'NickName': 'Bob', 'RemarkName': '', 'DisplayName': 'Bobby',
+       'Uin': 1002, 'AttrStatus': 0}
+ROOM = {'UserName': '@@room', 'NickName': 'Room', 'RemarkName': '', 'Uin': 0, 'AttrStatus': 0,
+        'MemberList': [{'UserName': '@carol', 'NickName': 'Carol', 'DisplayName': ''}]}
+
+
+class ContactDirectorySearchTest(unittest.TestCase):
+    def setUp(self):
+        self.itchat = FakeItChat(friends=[ALICE, BOB], chatrooms=[ROOM])
+        self.channel = FakeChannel(self.itchat)
+        self.directory = ContactDirectory(self.channel)
+
+    def user_names(self, **kwargs):
+        return [i['UserName'] for i in self.directory.search(**kwargs)]
+
+    def test_search_by_user_name(self):
+        self.assertEqual(self.user_names(UserName='@alice'), ['@alice'])
+        self.assertEqual(self.user_names(UserName='@@room'), ['@@room'])
+        self.assertEqual(self.user_names(UserName='@nobody'), [])
+
+    def test_search_by_uid(self):
+        uid = FakeChannel.encode_uid({"nickname": "Bob"})
+        self.assertEqual(self.user_names(uid=uid), ['@bob'])
+
+    def test_search_by_uin(self):
+        self.assertEqual(self.user_names(uin='1001'), ['@alice'])
+
+    def test_search_by_name(self):
+        self.assertEqual(self.user_names(name='Alice'), ['@alice'])
+        self.assertEqual(self.user_names(name='Ally'), ['@alice'])
+        self.assertEqual(self.user_names(name='Bobby'), ['@bob'])
+
+    def test_attr_status_not_indexed(self):
+        # Chat rooms and many contacts share the same `AttrStatus`.
+        self.assertEqual(self.user_names(uid='0'), [])
+
+    def test_friends_before_chat_rooms(self):
+        self.assertEqual(self.user_names(UserName='@@room', uin='1002', name='Alice'), ['@alice', '@bob', '@@room'])
+
+    def test_member_of_chat_room(self):
+        result = self.directory.search(UserName='@@room', ActualUserName='@carol')
+        self.assertEqual([i['UserName'] for i in result[0]['MemberList']], ['@carol'])
+
+    def test_update_contact(self):
+        self.directory.search(UserName='@alice')
+        self.directory.update_contact(dict(ALICE, NickName='Alicia', RemarkName=''))
+        self.assertEqual(self.user_names(name='Alicia'), ['@alice'])
+        self.assertEqual(self.user_names(name='Ally'), [])
+        uid = FakeChannel.encode_uid({"nickname": "Alicia"})
+        self.assertEqual(self.user_names(uid=uid), ['@alice'])
+        self.assertEqual(self.channel.forgotten[-1]["nickname"], "Alice")
+
+
+
+class ContactDirectoryMissTest(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch("directory.time.time", lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.itchat = FakeItChat(friends=[ALICE])
+        self.directory = ContactDirectory(FakeChannel(self.itchat), miss_ttl=60, refresh_interval=300)
+
+    def test_miss_expires_after_ttl(self):
+        key = (None, None, None, "Nobody", None)
+        self.directory.set_missing(key)
+        self.now += 59
+        self.assertTrue(self.directory.is_missing(key))
+        self.now += 2
+        self.assertFalse(self.directory.is_missing(key))
+        self.assertNotIn(key, self.directory.misses)
+
+    def test_update_contact_forgets_matching_misses(self):
+        self.directory.search(UserName='@alice')
+        bob = (None, None, None, "Bob", None)
+        nobody = (None, None, None, "Nobody", None)
+        self.directory.set_missing(bob)
+        self.directory.set_missing(nobody)
+        self.directory.update_contact(BOB)
+        self.assertFalse(self.directory.is_missing(bob))
+        self.assertTrue(self.directory.is_missing(nobody))
+
+    def test_refresh_throttled(self):
+        self.directory.set_missing((None, None, None, "Nobody", None))
+        self.now += 300
+        self.assertTrue(self.directory.refresh())
+        self.assertEqual(self.directory.misses, {})
+        self.now += 299
+        self.assertFalse(self.directory.refresh())
+        self.now += 1
+        self.assertTrue(self.directory.refresh())
+
+
+if __name__ == "__main__":
+    unittest.main()
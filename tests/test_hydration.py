@@ -0,0 +1,105 @@
+import os
+import sys
+import threading
+import time
+import unittest
+from unittest import mock
+
+# Imported alone, as the package of the WeChat slave channel needs `config`.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                "plugins", "eh_wechat_slave"))
+from hydration import MemberHydrator
+
+
+class FakeItChat:
+    def __init__(self):
+        self.requests = []
+        self.fetched = threading.Event()
+
+    def update_chatroom(self, user_names):
+        self.requests.append(list(user_names))
+        self.fetched.set()
+        # One chat room is returned as a dict by itchat.
+        rooms = [{'UserName': i, 'MemberList': [{'UserName': '@member'}]} for i in user_names]
+        return rooms[0] if len(rooms) == 1 else rooms
+
+
+class FakeDirectory:
+    def __init__(self):
+        self.channel = mock.Mock(channel_id="eh_wechat_slave", itchat=FakeItChat())
+        self.updated = []
+
+    def update_contact(self, contact):
+        self.updated.append(contact['UserName'])
+
+
+class MemberHydratorTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = FakeDirectory()
+        self.itchat = self.directory.channel.itchat
+
+    def hydrator(self, **kwargs):
+        hydrator = MemberHydrator(self.directory, **kwargs)
+        self.addCleanup(hydrator.stop)
+        return hydrator
+
+    def wait_idle(self, hydrator, requests):
+        deadline = time.monotonic() + 5
+        while hydrator.stats()["requests"] < requests and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(hydrator.stats()["requests"], requests)
+
+    def test_fetch_in_batches(self):
+        hydrator = self.hydrator(batch_size=2)
+        rooms = ["@@%s" % i for i in range(5)]
+        self.assertEqual([i['UserName'] for i in hydrator.fetch(rooms)], rooms)
+        self.assertEqual(self.itchat.requests, [rooms[0:2], rooms[2:4], rooms[4:]])
+        self.assertEqual(self.directory.updated, rooms)
+        self.assertEqual(hydrator.stats(), {"pending": 0, "fetched": 5, "requests": 3})
+
+    def test_not_fetched_again_within_min_age(self):
+        hydrator = self.hydrator(min_age=60)
+        hydrator.fetch(["@@1"])
+        hydrator.request(["@@1", "@@2"])
+        self.assertEqual(list(hydrator.pending), ["@@2"])
+        hydrator.request(["@@1"], force=True)
+        self.assertEqual(sorted(hydrator.pending), ["@@1", "@@2"])
+
+    def test_recent_activity_first(self):
+        hydrator = self.hydrator(batch_size=2, interval=0)
+        for i, room in enumerate(["@@quiet", "@@busy", "@@new", "@@recent"]):
+            with mock.patch("hydration.time.time", return_value=1000 + i):
+                hydrator.touch(room)
+        hydrator.request(["@@never", "@@quiet", "@@busy", "@@recent"])
+        with mock.patch("hydration.time.time", return_value=2000):
+            hydrator.touch("@@busy")
+        hydrator.start()
+        self.wait_idle(hydrator, 2)
+        self.assertEqual(self.itchat.requests, [["@@busy", "@@recent"], ["@@quiet", "@@never"]])
+
+    def test_stop(self):
+        hydrator = self.hydrator(interval=0)
+        hydrator.start()
+        hydrator.request(["@@1"])
+        self.assertTrue(self.itchat.fetched.wait(5))
+        hydrator.stop()
+        hydrator.thread.join(5)
+        self.assertFalse(hydrator.thread.is_alive())
+        # Requests after stopping are not fetched.
+        hydrator.request(["@@2"])
+        self.assertEqual(self.itchat.requests, [["@@1"]])
+
+    def test_failed_fetch_does_not_stop_thread(self):
+        hydrator = self.hydrator(batch_size=1, interval=0)
+        self.itchat.update_chatroom = mock.Mock(side_effect=[ValueError("Network error"), {'UserName': '@@2'}])
+        hydrator.start()
+        with mock.patch.object(hydrator.logger, "exception") as log_exception:
+            hydrator.request(["@@1"])
+            hydrator.request(["@@2"])
+            self.wait_idle(hydrator, 1)
+        log_exception.assert_called_once_with("Failed to fetch member lists of chat rooms %s.", ["@@1"])
+        self.assertEqual(self.directory.updated, ["@@2"])
+
+
+if __name__ == "__main__":
+    unittest.main()
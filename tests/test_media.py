@@ -0,0 +1,86 @@
+import json
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+# Imported alone, as the package of the WeChat slave channel needs `config`.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                "plugins", "eh_wechat_slave"))
+from media import MediaCache
+
+
+class FakeChannel:
+    channel_id = "eh_wechat_slave"
+
+
+class MediaCacheTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        # The cache is saved relative to the working directory, as EFB runs.
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(tmp.name)
+        self.path = os.path.join("storage", "eh_wechat_slave", "media_cache.json")
+        self.now = 1000.0
+        patcher = mock.patch("media.time.time", lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def cache(self, **kwargs):
+        return MediaCache(FakeChannel(), **kwargs)
+
+    def test_saved_and_loaded(self):
+        cache = self.cache()
+        self.assertIsNone(cache.get("me:pic:1"))
+        cache.put("me:pic:1", "media_1")
+        self.assertEqual(cache.get("me:pic:1"), "media_1")
+        with open(self.path) as f:
+            self.assertEqual(json.load(f), {"me:pic:1": ["media_1", 1000.0 + 86400]})
+        self.assertEqual(self.cache().get("me:pic:1"), "media_1")
+        cache.pop("me:pic:1")
+        self.assertIsNone(self.cache().get("me:pic:1"))
+        self.assertEqual(cache.stats()["hits"], 1)
+        self.assertEqual(cache.stats()["misses"], 1)
+
+    def test_expiry(self):
+        cache = self.cache(ttl=60)
+        cache.put("me:pic:1", "media_1")
+        self.now += 30
+        cache.put("me:pic:2", "media_2")
+        self.now += 31
+        self.assertIsNone(cache.get("me:pic:1"))
+        self.assertEqual(cache.get("me:pic:2"), "media_2")
+        # Expired entries are dropped when loaded.
+        self.assertEqual(list(self.cache(ttl=60).entries), ["me:pic:2"])
+
+    def test_maxsize(self):
+        cache = self.cache(maxsize=2)
+        cache.put("me:pic:1", "media_1")
+        cache.put("me:pic:2", "media_2")
+        # Put again as the newest entry.
+        cache.put("me:pic:1", "media_1")
+        cache.put("me:pic:3", "media_3")
+        self.assertEqual(list(cache.entries), ["me:pic:1", "me:pic:3"])
+        self.assertIsNone(cache.get("me:pic:2"))
+        self.assertEqual(cache.stats()["size"], 2)
+
+    def test_corrupt_file_ignored(self):
+        os.makedirs(os.path.dirname(self.path))
+        with open(self.path, "w") as f:
+            f.write('{"me:pic:1": ["media_')
+        with self.assertLogs("plugins.eh_wechat_slave.MediaCache", "ERROR"):
+            cache = self.cache()
+        self.assertEqual(cache.entries, {})
+        cache.put("me:pic:1", "media_1")
+        self.assertEqual(self.cache().get("me:pic:1"), "media_1")
+
+    def test_file_hash(self):
+        with open("file", "wb") as f:
+            f.write(b"content")
+        self.assertEqual(MediaCache.file_hash("file"), "9a0364b9e99bb480dd25e1f0284c8555")
+
+
+if __name__ == "__main__":
+    unittest.main()
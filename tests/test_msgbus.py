@@ -0,0 +1,145 @@
+import copy
+import io
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from channel import EFBMsg, MsgType
+from msgbus import MessageBus
+
+
+class MessageBusSpillTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def image_in_memory(self, data=b"\x89PNG\r\n\x1a\n image"):
+        msg = EFBMsg()
+        msg.type = MsgType.Image
+        msg.mime = "image/png"
+        msg.file = io.BytesIO(data)
+        msg.file.name = "Image_1.png"
+        return msg
+
+    def assert_spilled_and_read_back(self, bus):
+        msg = self.image_in_memory()
+        bus.put(msg)
+        self.assertEqual(bus.stats()["spilled"], 1)
+        got = bus.get(block=False)
+        self.assertIsNone(got.path)
+        self.assertIsNotNone(got.file)
+        self.assertEqual(got.file.name, "Image_1.png")
+        self.assertEqual(got.file.read(), b"\x89PNG\r\n\x1a\n image")
+
+    def test_spill_in_memory_file(self):
+        bus = MessageBus(high_water_mark=0, spill_path=os.path.join(self.tmp.name, "bus"))
+        self.assert_spilled_and_read_back(bus)
+
+    def test_spill_in_memory_file_with_spool(self):
+        bus = MessageBus(high_water_mark=0, spill_path=os.path.join(self.tmp.name, "bus"),
+                         spool_path=os.path.join(self.tmp.name, "spool.journal"))
+        self.addCleanup(bus.close)
+        self.assert_spilled_and_read_back(bus)
+
+    def test_spill_file_on_disk(self):
+        path = os.path.join(self.tmp.name, "Image_2.png")
+        with open(path, "wb") as f:
+            f.write(b"on disk")
+        msg = EFBMsg()
+        msg.type = MsgType.Image
+        msg.path = path
+        msg.file.read()
+        bus = MessageBus(high_water_mark=0, spill_path=os.path.join(self.tmp.name, "bus"))
+        bus.put(msg)
+        # The file handle is not kept open while the message is spilled.
+        self.assertIsNone(msg._file)
+        got = bus.get(block=False)
+        self.assertEqual(got.file.read(), b"on disk")
+        got.close()
+
+
+class MessageBusOrderTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def message(self, type, text):
+        msg = EFBMsg()
+        msg.type = type
+        msg.text = text
+        return msg
+
+    def test_spilled_messages_delivered_in_order(self):
+        bus = MessageBus(high_water_mark=2, spill_path=os.path.join(self.tmp.name, "bus"))
+        bus.put(self.message(MsgType.Text, "1"))
+        bus.put(self.message(MsgType.Text, "2"))
+        bus.put(self.message(MsgType.Image, "3"))
+        self.assertEqual(bus.stats()["spilled"], 1)
+        self.assertEqual(bus.get(block=False).text, "1")
+        bus.put(self.message(MsgType.Text, "4"))
+        self.assertEqual([bus.get(block=False).text for _ in range(3)], ["2", "3", "4"])
+        self.assertTrue(bus.empty())
+
+    def test_spilled_messages_recovered_in_order(self):
+        spill_path = os.path.join(self.tmp.name, "bus")
+        bus = MessageBus(high_water_mark=0, spill_path=spill_path)
+        for i in "123":
+            bus.put(self.message(MsgType.Image, i))
+        with open(os.path.join(spill_path, "unknown.msg"), "wb") as f:
+            f.write(b"not a message")
+        with self.assertLogs("msgbus", "WARNING"):
+            bus = MessageBus(high_water_mark=0, spill_path=spill_path)
+        self.assertEqual(bus.qsize(), 3)
+        self.assertEqual([bus.get(block=False).text for _ in range(3)], ["1", "2", "3"])
+        bus.put(self.message(MsgType.Image, "4"))
+        self.assertEqual(bus.get(block=False).text, "4")
+
+
+
+class MessageBusAckTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def open(self, **kwargs):
+        bus = MessageBus(spill_path=os.path.join(self.tmp.name, "bus"),
+                         spool_path=os.path.join(self.tmp.name, "spool.journal"), **kwargs)
+        self.addCleanup(bus.close)
+        return bus
+
+    def message(self, text):
+        msg = EFBMsg()
+        msg.type = MsgType.Text
+        msg.text = text
+        return msg
+
+    def test_ack_by_spool_seq(self):
+        bus = self.open()
+        for i in "123":
+            bus.put(self.message(i))
+        msgs = [bus.get(block=False) for _ in range(3)]
+        self.assertEqual(len({i.spool_seq for i in msgs}), 3)
+        # A copy of the message is acknowledged the same.
+        bus.ack(copy.copy(msgs[1]))
+        bus.ack(msgs[1])
+        self.assertEqual(bus.stats()["in_flight"], 2)
+        bus.close()
+        bus = self.open()
+        self.assertEqual([bus.get(block=False).text for _ in range(2)], ["1", "3"])
+        self.assertTrue(bus.empty())
+
+    def test_spilled_message_acked(self):
+        bus = self.open(high_water_mark=0, default_policy="spill")
+        bus.put(self.message("1"))
+        msg = bus.get(block=False)
+        self.assertIsNotNone(msg.spool_seq)
+        bus.ack(msg)
+        self.assertEqual(bus.stats()["in_flight"], 0)
+        bus.close()
+        self.assertTrue(self.open().empty())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,218 @@
+import io
+import os
+import sys
+import threading
+import time
+import unittest
+from unittest import mock
+
+# Imported alone, as the package of the Telegram master channel needs `config`.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                "plugins", "eh_telegram_master"))
+try:
+    import telegram.error
+    import ratelimit
+except ImportError:  # python-telegram-bot is not installed
+    ratelimit = None
+
+
+class FakeClock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class FakeCondition:
+    """
+    Condition of a single thread, passing the time waited on the clock.
+    """
+
+    def __init__(self, lock, clock):
+        self.lock = lock
+        self.clock = clock
+
+    def __enter__(self):
+        return self.lock.__enter__()
+
+    def __exit__(self, *args):
+        return self.lock.__exit__(*args)
+
+    def wait(self, timeout=None):
+        assert timeout is not None, "waiting forever on a single thread"
+        self.clock.sleep(timeout)
+
+    def notify_all(self):
+        pass
+
+
+@unittest.skipIf(ratelimit is None, "python-telegram-bot is not installed")
+class FakeClockTestCase(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch.object(ratelimit, "time", self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def scheduler(self, **kwargs):
+        scheduler = ratelimit.SendScheduler(**kwargs)
+        scheduler.cond = FakeCondition(scheduler.lock, self.clock)
+        return scheduler
+
+
+class TokenBucketTest(FakeClockTestCase):
+    def test_refill(self):
+        bucket = ratelimit.TokenBucket(rate=2, capacity=4)
+        for _ in range(4):
+            self.assertEqual(bucket.delay(self.clock.now), 0)
+            bucket.consume(self.clock.now)
+        self.assertEqual(bucket.delay(self.clock.now), 0.5)
+        self.clock.now += 1
+        self.assertEqual(bucket.delay(self.clock.now), 0)
+        self.assertEqual(bucket.tokens, 2)
+        # Never more than the capacity.
+        self.clock.now += 60
+        self.assertTrue(bucket.idle(self.clock.now))
+        self.assertEqual(bucket.tokens, 4)
+
+    def test_reserve_in_debt(self):
+        bucket = ratelimit.TokenBucket(rate=2, capacity=1)
+        now = self.clock.now
+        self.assertEqual([bucket.reserve(now) for _ in range(3)], [now, now + 0.5, now + 1.0])
+
+    def test_pause(self):
+        bucket = ratelimit.TokenBucket(rate=2, capacity=1)
+        bucket.pause(5)
+        self.assertEqual(bucket.delay(self.clock.now), 5)
+        self.assertFalse(bucket.idle(self.clock.now))
+
+
+class SendSchedulerTest(FakeClockTestCase):
+    def call_times(self, scheduler, chat_ids):
+        times = []
+        for i in chat_ids:
+            scheduler.call(i, lambda: times.append(self.clock.now - 1000))
+        return times
+
+    def test_private_chat_limit(self):
+        scheduler = self.scheduler(global_rate=30, chat_rate=1, burst=3)
+        self.assertEqual(self.call_times(scheduler, [1] * 5), [0, 0, 0, 1, 2])
+
+    def test_group_limit(self):
+        scheduler = self.scheduler(global_rate=30, group_rate=0.5, burst=1)
+        self.assertEqual(self.call_times(scheduler, [-100, "@channel", -100]), [0, 0, 2])
+
+    def test_chats_limited_separately(self):
+        scheduler = self.scheduler(global_rate=30, chat_rate=1, burst=1)
+        self.assertEqual(self.call_times(scheduler, [1, 2, 3, 1]), [0, 0, 0, 1])
+
+    def test_global_limit(self):
+        scheduler = self.scheduler(global_rate=2, chat_rate=1, burst=1)
+        self.assertEqual(self.call_times(scheduler, [1, 2, 3, None, 4]), [0, 0, 0.5, 1, 1.5])
+        self.assertEqual(scheduler.stats()["sent"], 5)
+
+    def test_retry_after(self):
+        scheduler = self.scheduler(global_rate=30, chat_rate=1, burst=3)
+        photo = io.BytesIO(b"photo")
+        calls = []
+
+        def send_photo(chat_id, photo):
+            calls.append((self.clock.now - 1000, photo.read()))
+            if len(calls) == 1:
+                raise telegram.error.RetryAfter(5)
+            return "sent"
+
+        self.assertEqual(scheduler.call(1, send_photo, 1, photo), "sent")
+        # Uploaded again from the start, after the chat is paused.
+        self.assertEqual(calls, [(0, b"photo"), (5, b"photo")])
+        self.assertEqual(scheduler.stats()["retries"], 1)
+        # Other chats are not paused.
+        self.assertEqual(self.call_times(scheduler, [2]), [5])
+
+    def test_retry_after_in_message(self):
+        scheduler = self.scheduler(max_retries=1)
+        error = telegram.error.TelegramError("Flood control exceeded. Retry after 3 seconds")
+
+        def send_message(chat_id, text):
+            raise error
+
+        with self.assertRaises(telegram.error.TelegramError):
+            scheduler.call(1, send_message, 1, "text")
+        self.assertEqual(self.clock.now - 1000, 3)
+        self.assertEqual(scheduler.stats()["retries"], 1)
+
+    def test_other_errors_not_retried(self):
+        scheduler = self.scheduler()
+        fn = mock.Mock(side_effect=telegram.error.BadRequest("Chat not found"))
+        with self.assertRaises(telegram.error.BadRequest):
+            scheduler.call(1, fn)
+        self.assertEqual(fn.call_count, 1)
+
+
+@unittest.skipIf(ratelimit is None, "python-telegram-bot is not installed")
+class SendSchedulerPriorityTest(unittest.TestCase):
+    def test_priority_order(self):
+        scheduler = ratelimit.SendScheduler(global_rate=1)
+        # Hold all calls until tokens are given one at a time.
+        scheduler.global_bucket = ratelimit.TokenBucket(rate=1e-6, capacity=1)
+        scheduler.global_bucket.tokens = 0
+        done = {}
+        threads = {}
+        for priority in (scheduler.PRIORITY_ACTION, scheduler.PRIORITY_MEDIA, scheduler.PRIORITY_TEXT):
+            done[priority] = threading.Event()
+            threads[priority] = threading.Thread(
+                target=scheduler.call, args=(None, done[priority].set), kwargs={"priority": priority}, daemon=True)
+            threads[priority].start()
+            while scheduler.backlog() < len(threads):
+                threads[priority].join(0.01)
+        order = []
+        for _ in range(len(threads)):
+            with scheduler.cond:
+                scheduler.global_bucket.tokens = 1
+                scheduler.cond.notify_all()
+            deadline = time.time() + 5
+            while len(order) == sum(i.is_set() for i in done.values()) and time.time() < deadline:
+                time.sleep(0.01)
+            order.extend(i for i, event in done.items() if event.is_set() and i not in order)
+        self.assertEqual(order, [scheduler.PRIORITY_TEXT, scheduler.PRIORITY_MEDIA, scheduler.PRIORITY_ACTION])
+
+
+@unittest.skipIf(ratelimit is None, "python-telegram-bot is not installed")
+class ScheduledBotTest(unittest.TestCase):
+    def setUp(self):
+        self.bot = mock.Mock(spec=["send_message", "sendChatAction", "edit_message_text", "get_me",
+                                   "getFile", "answer_callback_query", "token"])
+        self.bot.token = "123:abc"
+        self.scheduler = mock.Mock(spec=ratelimit.SendScheduler)
+        self.scheduler.priority_of.side_effect = ratelimit.SendScheduler().priority_of
+        self.scheduled = ratelimit.ScheduledBot(self.bot, self.scheduler)
+
+    def test_chat_of_calls(self):
+        self.scheduled.send_message(1, "text")
+        self.scheduled.edit_message_text("text", chat_id=2, message_id=3)
+        self.scheduled.sendChatAction(4, "typing")
+        self.scheduled.answer_callback_query("query")
+        self.assertEqual(self.scheduler.call.call_args_list, [
+            mock.call(1, self.bot.send_message, 1, "text", priority=ratelimit.SendScheduler.PRIORITY_TEXT),
+            mock.call(2, self.bot.edit_message_text, "text", chat_id=2, message_id=3,
+                      priority=ratelimit.SendScheduler.PRIORITY_TEXT),
+            mock.call(4, self.bot.sendChatAction, 4, "typing", priority=ratelimit.SendScheduler.PRIORITY_ACTION),
+            mock.call(None, self.bot.answer_callback_query, "query",
+                      priority=ratelimit.SendScheduler.PRIORITY_DEFAULT),
+        ])
+
+    def test_not_scheduled(self):
+        self.scheduled.get_me()
+        self.assertEqual(self.scheduled.token, "123:abc")
+        self.bot.get_me.assert_called_once_with()
+        self.scheduler.call.assert_not_called()
+        self.scheduled.getFile("file")
+        self.assertEqual(self.scheduler.call.call_args[0][:2], (None, self.bot.getFile))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,118 @@
+import concurrent.futures
+import os
+import sys
+import unittest
+from unittest import mock
+
+# Imported alone, as the package of the Telegram master channel needs `config`.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                "plugins", "eh_telegram_master"))
+try:
+    import speech
+except ImportError:  # requests is not installed
+    speech = None
+
+
+class FakeEngine:
+    """Engine rejecting the first `rejections` responses as of expired tokens."""
+
+    def __init__(self, rejections=0):
+        self.rejections = rejections
+        self.fetched = 0
+        self.submitted = []
+        self.token = speech.AccessToken(self.fetch)
+
+    def fetch(self):
+        self.fetched += 1
+        return "token_%s" % self.fetched, 3600
+
+    def supports(self, lang):
+        return lang == "en"
+
+    def submit(self, pcm, lang):
+        token = self.token.get()
+        self.submitted.append(token)
+        future = concurrent.futures.Future()
+        if len(self.submitted) <= self.rejections:
+            future.set_result({"error": "expired", "token": token})
+        else:
+            future.set_result({"text": "Hello", "token": token})
+        return token, future
+
+    @staticmethod
+    def rejected(r):
+        return r.get("error") == "expired"
+
+    @staticmethod
+    def parse(r):
+        return [r["text"]] if "text" in r else ["ERROR!", r["error"]]
+
+
+@unittest.skipIf(speech is None, "requests is not installed")
+class AccessTokenTest(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch.object(speech.time, "time", lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.fetch = mock.Mock(side_effect=lambda: ("token_%s" % self.fetch.call_count, 600))
+        self.token = speech.AccessToken(self.fetch, margin=60)
+
+    def test_fetched_once(self):
+        self.assertEqual(self.token.get(), "token_1")
+        self.now += 539
+        self.assertEqual(self.token.get(), "token_1")
+        self.assertEqual(self.fetch.call_count, 1)
+
+    def test_fetched_again_near_expiry(self):
+        self.token.get()
+        self.now += 540
+        self.assertEqual(self.token.get(), "token_2")
+        # Expiry is counted from the new token.
+        self.now += 539
+        self.assertEqual(self.token.get(), "token_2")
+        self.assertEqual(self.fetch.call_count, 2)
+
+    def test_invalidate(self):
+        self.token.get()
+        # A token already replaced is not discarded again.
+        self.token.invalidate("token_0")
+        self.assertEqual(self.token.get(), "token_1")
+        self.token.invalidate("token_1")
+        self.assertEqual(self.token.get(), "token_2")
+        self.assertEqual(self.fetch.call_count, 2)
+
+
+@unittest.skipIf(speech is None, "requests is not installed")
+class SpeechServiceRetryTest(unittest.TestCase):
+    def recognize(self, engine, lang="en"):
+        service = speech.SpeechService({})
+        return list(service.recognize(b"pcm", [("Fake", engine, lang)]))
+
+    def test_rejected_token_retried_once(self):
+        engine = FakeEngine(rejections=1)
+        self.assertEqual(self.recognize(engine), [("Fake", ["Hello"])])
+        self.assertEqual(engine.submitted, ["token_1", "token_2"])
+
+    def test_not_retried_again(self):
+        engine = FakeEngine(rejections=2)
+        self.assertEqual(self.recognize(engine), [("Fake", ["ERROR!", "expired"])])
+        self.assertEqual(engine.submitted, ["token_1", "token_2"])
+        self.assertEqual(engine.fetched, 2)
+
+    def test_not_rejected(self):
+        engine = FakeEngine()
+        self.assertEqual(self.recognize(engine), [("Fake", ["Hello"])])
+        self.assertEqual(self.recognize(engine), [("Fake", ["Hello"])])
+        # The token is reused by later recognitions.
+        self.assertEqual(engine.submitted, ["token_1", "token_1"])
+
+    def test_unsupported_language(self):
+        engine = FakeEngine()
+        self.assertEqual(self.recognize(engine, "xx"), [("Fake", ["ERROR!", "Invalid language."])])
+        self.assertEqual(engine.submitted, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
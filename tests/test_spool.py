@@ -0,0 +1,100 @@
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from channel import EFBMsg
+from spool import Spool
+
+
+def message(text):
+    msg = EFBMsg()
+    msg.text = text
+    return msg
+
+
+def records(path):
+    """(op, seq) of all records in a journal file."""
+    result = []
+    with open(path, "rb") as f:
+        data = f.read()
+    offset = 0
+    while offset < len(data):
+        op, seq, length = Spool.HEADER.unpack_from(data, offset)
+        result.append((op, seq))
+        offset += Spool.HEADER.size + length
+    return result
+
+
+class SpoolTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.path = os.path.join(self.tmp.name, "spool.journal")
+
+    def open(self, **kwargs):
+        spool = Spool(self.path, **kwargs)
+        self.addCleanup(spool.close)
+        return spool
+
+    def test_replay_after_restart(self):
+        spool = self.open()
+        seqs = [spool.append(message(i)) for i in ("a", "b", "c")]
+        spool.done(seqs[1])
+        spool.close()
+
+        spool = self.open()
+        self.assertEqual(spool.replay(), [seqs[0], seqs[2]])
+        self.assertEqual([spool.load(i).text for i in spool.replay()], ["a", "c"])
+        # Sequence numbers are not reused after a restart.
+        self.assertGreater(spool.append(message("d")), seqs[2])
+
+    def test_torn_record_discarded(self):
+        spool = self.open()
+        spool.append(message("a"))
+        spool.close()
+        size = os.path.getsize(self.path)
+        with open(self.path, "ab") as f:
+            f.write(Spool.HEADER.pack(Spool.OP_PUT, 1, 1000) + b"partial")
+
+        spool = self.open()
+        self.assertEqual(os.path.getsize(self.path), size)
+        self.assertEqual(spool.replay(), [0])
+        seq = spool.append(message("b"))
+        spool.close()
+
+        spool = self.open()
+        self.assertEqual([spool.load(i).text for i in spool.replay()], ["a", "b"])
+        self.assertEqual(spool.replay(), [0, seq])
+
+    def test_compaction_keeps_pending_records(self):
+        spool = self.open(compact_threshold=2)
+        seqs = [spool.append(message(i)) for i in ("a", "b", "c")]
+        spool.done(seqs[0])
+        spool.sync()
+        self.assertEqual(len(records(self.path)), 4)
+        spool.done(seqs[2])
+        spool.sync()
+        self.assertEqual(records(self.path), [(Spool.OP_PUT, seqs[1])])
+        self.assertEqual(spool.load(seqs[1]).text, "b")
+        spool.close()
+
+        spool = self.open()
+        self.assertEqual(spool.replay(), [seqs[1]])
+
+    def test_records_synced_in_background(self):
+        spool = self.open(fsync_interval=0.05)
+        spool.append(message("a"))
+        deadline = time.time() + 5
+        while spool.unsynced and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(spool.unsynced, 0)
+        spool.close()
+        spool.sync_thread.join(5)
+        self.assertFalse(spool.sync_thread.is_alive())
+
+
+if __name__ == "__main__":
+    unittest.main()
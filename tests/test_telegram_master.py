@@ -0,0 +1,195 @@
+import io
+import os
+import sys
+import tempfile
+import types
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from channel import EFBMsg, MsgType
+from utils import LRUCache
+try:
+    import telegram.error
+    from plugins.eh_telegram_master import TelegramChannel, db, speech
+except ImportError:  # python-telegram-bot or config.py is not found
+    TelegramChannel = None
+
+tmp = None
+
+
+def setUpModule():
+    global tmp
+    if TelegramChannel is None:
+        return
+    tmp = tempfile.TemporaryDirectory()
+    db.flush()
+    db.db.close()
+    db.db.init(os.path.join(tmp.name, "tgdata.db"), pragmas=db._pragmas)
+    db.db.connect()
+    db._create()
+
+
+def tearDownModule():
+    if tmp is not None:
+        db.flush()
+        db.db.close()
+        tmp.cleanup()
+
+
+class FakeBot:
+    """Bot API accepting uploads and `file_id`s it has given."""
+
+    def __init__(self):
+        self.uploads = []
+        self.file_ids = []
+        self.rejected = set()
+
+    def sendPhoto(self, chat_id, photo, **kwargs):
+        if isinstance(photo, str):
+            self.file_ids.append(photo)
+            if photo in self.rejected:
+                raise telegram.error.BadRequest("Wrong file identifier/http url specified")
+            file_id = photo
+        else:
+            self.uploads.append(photo.read())
+            file_id = "file_%s" % len(self.uploads)
+        return types.SimpleNamespace(photo=[types.SimpleNamespace(file_id=file_id)])
+
+
+@unittest.skipIf(TelegramChannel is None, "python-telegram-bot or config.py is not found")
+class SendFileTest(unittest.TestCase):
+    def setUp(self):
+        self.channel = TelegramChannel.__new__(TelegramChannel)
+        self.channel.tg_bot = self.bot = FakeBot()
+        self.channel.file_id_cache = LRUCache(16)
+        self.channel.logger = mock.Mock()
+
+    @staticmethod
+    def message(data=b"image", filename="image.png"):
+        msg = EFBMsg()
+        msg.type = MsgType.Image
+        msg.file = io.BytesIO(data)
+        msg.filename = filename
+        return msg
+
+    def send(self, msg, convert=None):
+        return self.channel._send_file("sendPhoto", 1, msg, convert=convert, caption="text")
+
+    def test_same_content_sent_by_file_id(self):
+        convert = mock.Mock(side_effect=lambda f: f)
+        self.assertEqual(self.send(self.message(), convert).photo[0].file_id, "file_1")
+        self.assertEqual(self.send(self.message(), convert).photo[0].file_id, "file_1")
+        self.assertEqual(self.bot.uploads, [b"image"])
+        self.assertEqual(self.bot.file_ids, ["file_1"])
+        # Not converted again.
+        self.assertEqual(convert.call_count, 1)
+        self.assertEqual(self.channel.file_id_cache.stats()["hits"], 1)
+
+    def test_different_content_or_name_uploaded(self):
+        self.send(self.message())
+        self.send(self.message(data=b"other"))
+        self.send(self.message(filename="other.png"))
+        self.assertEqual(self.bot.uploads, [b"image", b"other", b"image"])
+        self.assertEqual(self.bot.file_ids, [])
+
+    def test_rejected_file_id_uploaded_again(self):
+        self.send(self.message())
+        self.bot.rejected.add("file_1")
+        self.assertEqual(self.send(self.message()).photo[0].file_id, "file_2")
+        self.assertEqual(self.bot.uploads, [b"image", b"image"])
+        self.assertEqual(self.bot.file_ids, ["file_1"])
+        # The new file_id replaces the one rejected.
+        self.send(self.message())
+        self.assertEqual(self.bot.file_ids, ["file_1", "file_2"])
+        self.assertEqual(len(self.bot.uploads), 2)
+
+
+class FakeSpeechService:
+    """Speech service giving results of each label from `results`."""
+
+    def __init__(self, results):
+        self.bing = speech.BingSpeech(["key"])
+        self.baidu = speech.BaiduSpeech({"app_id": "id", "api_key": "key", "secret_key": "secret"})
+        self.results = results
+        self.decoded = []
+        self.requested = []
+
+    def decode(self, path):
+        with open(path, "rb") as f:
+            self.decoded.append(f.read())
+        return b"pcm"
+
+    def recognize(self, pcm, requests):
+        self.requested.append([i[0] for i in requests])
+        for label, engine, lang in requests:
+            yield label, self.results[label]
+
+
+@unittest.skipIf(TelegramChannel is None, "python-telegram-bot or config.py is not found")
+class SpeechCacheTest(unittest.TestCase):
+    def setUp(self):
+        db.flush()
+        db.VoiceFile.delete().execute()
+        db.SpeechResult.delete().execute()
+        self.channel = TelegramChannel.__new__(TelegramChannel)
+        self.channel.speech = self.speech = FakeSpeechService({
+            "Baidu (Mandarin)": ["你好"],
+            "Bing (zh-CN)": ["Hello"],
+        })
+        self.channel._flag = lambda key, value: value
+        self.channel._download_file = mock.Mock(side_effect=self.download)
+        self.bot = mock.Mock()
+        self.audio = b"voice"
+
+    def download(self, message, file, msg_type):
+        fd, path = tempfile.mkstemp(dir=tmp.name)
+        with os.fdopen(fd, "wb") as f:
+            f.write(self.audio)
+        return path, "audio/ogg"
+
+    def recognize(self, file_key="voice_1"):
+        voice = types.SimpleNamespace(file_id="id_%s" % file_key, file_unique_id=file_key, duration=5)
+        reply_to = types.SimpleNamespace(voice=voice, chat=types.SimpleNamespace(id=1), message_id=2)
+        update = types.SimpleNamespace(message=types.SimpleNamespace(reply_to_message=reply_to))
+        self.channel.recognize_speech(self.bot, update, ["zh-CN"])
+        db.flush()
+        # Text of the last edit, or of the reply when nothing is recognized.
+        return self.bot.edit_message_text.call_args[0][0] if self.speech.requested[-1] \
+            else self.bot.send_message.call_args[0][1]
+
+    def test_same_voice_not_recognized_again(self):
+        text = self.recognize()
+        self.assertIn("你好", text)
+        self.assertIn("Hello", text)
+        self.assertEqual(self.recognize(), text)
+        self.assertEqual(self.channel._download_file.call_count, 1)
+        self.assertEqual(self.speech.requested, [["Baidu (Mandarin)", "Bing (zh-CN)"], []])
+
+    def test_same_content_not_recognized_again(self):
+        self.recognize("voice_1")
+        # Forwarded voices are downloaded again, but not recognized.
+        self.recognize("voice_2")
+        self.assertEqual(self.channel._download_file.call_count, 2)
+        self.assertEqual(self.speech.decoded, [b"voice"])
+        self.assertEqual(self.speech.requested[-1], [])
+        self.recognize("voice_2")
+        self.assertEqual(self.channel._download_file.call_count, 2)
+
+    def test_failed_result_not_cached(self):
+        self.speech.results["Bing (zh-CN)"] = ["ERROR!", "Timeout"]
+        self.recognize()
+        audio_hash = db.get_voice_hash("voice_1")
+        self.assertEqual(db.get_speech_results(audio_hash, [("BaiduSpeech", "zh"), ("BingSpeech", "zh-CN")]),
+                         {("BaiduSpeech", "zh"): ["你好"]})
+        self.speech.results["Bing (zh-CN)"] = ["Hello"]
+        text = self.recognize()
+        self.assertIn("你好", text)
+        self.assertIn("Hello", text)
+        # Only the failed recognition is done again.
+        self.assertEqual(self.speech.requested, [["Baidu (Mandarin)", "Bing (zh-CN)"], ["Bing (zh-CN)"]])
+        self.assertEqual(self.channel._download_file.call_count, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,132 @@
+import concurrent.futures
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from transcode import TranscodeService, TranscodeTimeout
+
+
+# Jobs run in worker processes.
+
+def square(x):
+    return x * x
+
+
+def sleep(seconds):
+    time.sleep(seconds)
+    return seconds
+
+
+def alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    # Stopped, but not yet reaped by the executor.
+    try:
+        with open("/proc/%s/stat" % pid) as f:
+            return f.read().split(") ", 1)[1][0] != "Z"
+    except OSError:
+        return True
+
+
+class TranscodeServiceTest(unittest.TestCase):
+    def service(self, **kwargs):
+        service = TranscodeService(**kwargs)
+        self.addCleanup(service.shutdown)
+        return service
+
+    def wait_running(self, future):
+        deadline = time.monotonic() + 10
+        while not future.running() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertTrue(future.running())
+
+    def wait_dead(self, pids):
+        deadline = time.monotonic() + 10
+        while any(alive(i) for i in pids) and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.assertFalse([i for i in pids if alive(i)])
+
+    def test_run(self):
+        service = self.service(workers=2)
+        self.assertEqual(service.run(square, 7), 49)
+        self.assertEqual(service.stats()["submitted"], 1)
+
+    def test_timeout_restarts_pool(self):
+        service = self.service(workers=1)
+        self.assertEqual(service.run(square, 2), 4)
+        with service.lock:
+            pids = service._worker_pids()
+        self.assertTrue(pids)
+        start = time.monotonic()
+        with self.assertRaises(TranscodeTimeout):
+            service.run(sleep, 30, timeout=0.5)
+        self.assertLess(time.monotonic() - start, 10)
+        self.wait_dead(pids)
+        stats = service.stats()
+        self.assertEqual((stats["timeouts"], stats["restarts"]), (1, 1))
+        # Jobs are run in a new pool.
+        self.assertEqual(service.run(square, 3), 9)
+
+    def test_other_jobs_submitted_again(self):
+        service = self.service(workers=2)
+        results = []
+        other = threading.Thread(target=lambda: results.append(service.run(sleep, 1, timeout=20)))
+        other.start()
+        deadline = time.monotonic() + 10
+        while not service.stats()["running"] and time.monotonic() < deadline:
+            time.sleep(0.01)
+        with self.assertRaises(TranscodeTimeout):
+            service.run(sleep, 30, timeout=0.5)
+        other.join(20)
+        self.assertEqual(results, [1])
+        self.assertEqual(service.stats()["submitted"], 3)
+
+    def test_cancel_running_job(self):
+        service = self.service(workers=1)
+        future = service.submit(sleep, 30)
+        self.wait_running(future)
+        with service.lock:
+            pids = service._worker_pids()
+        self.assertTrue(service.cancel(future))
+        with self.assertRaises(concurrent.futures.process.BrokenProcessPool):
+            future.result(10)
+        self.wait_dead(pids)
+        self.assertEqual(service.stats()["restarts"], 1)
+        self.assertEqual(service.stats()["running"], 0)
+
+    def test_cancel_waiting_job(self):
+        service = self.service(workers=1)
+        running = service.submit(sleep, 0.5)
+        # Queued in the executor, not yet sent to the worker.
+        futures = [service.submit(square, i) for i in range(3)]
+        self.assertTrue(service.cancel(futures[-1]))
+        self.assertTrue(futures[-1].cancelled())
+        self.assertEqual(running.result(10), 0.5)
+        self.assertEqual([i.result(10) for i in futures[:-1]], [0, 1])
+        self.assertEqual(service.stats()["restarts"], 0)
+        self.assertFalse(service.cancel(running))
+
+    def test_queue_size(self):
+        service = self.service(workers=1, queue_size=1)
+        future = service.submit(sleep, 0.5)
+        with self.assertRaises(TranscodeTimeout):
+            service.submit(square, 1, timeout=0.1)
+        future.result(10)
+        self.assertEqual(service.submit(square, 2, timeout=1).result(10), 4)
+
+    def test_shutdown_cancels_waiting_jobs(self):
+        service = self.service(workers=1)
+        running = service.submit(sleep, 0.5)
+        futures = [service.submit(square, i) for i in range(3)]
+        service.shutdown()
+        self.assertTrue(futures[-1].cancelled())
+        self.assertEqual(running.result(10), 0.5)
+
+
+if __name__ == "__main__":
+    unittest.main()
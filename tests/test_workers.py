@@ -0,0 +1,134 @@
+import os
+import sys
+import threading
+import unittest
+
+# Imported alone, as the package of the Telegram master channel needs `config`.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                "plugins", "eh_telegram_master"))
+from workers import WorkerPool
+
+
+class WorkerPoolLaneTest(unittest.TestCase):
+    def pool(self, **kwargs):
+        pool = WorkerPool(**kwargs)
+        self.addCleanup(pool.shutdown)
+        return pool
+
+    def test_lane_of_key(self):
+        pool = self.pool(size=4)
+        lanes = {pool.lane_of("chat %s" % i) for i in range(100)}
+        self.assertEqual(lanes, {0, 1, 2, 3})
+        self.assertEqual(pool.lane_of(42), pool.lane_of("42"))
+        self.assertEqual(self.pool(size=4, name="Other").lane_of("chat 1"), pool.lane_of("chat 1"))
+
+    def test_same_key_in_order(self):
+        pool = self.pool(size=4, queue_size=0)
+        results = {}
+        lock = threading.Lock()
+
+        def task(key, i):
+            with lock:
+                results.setdefault(key, []).append(i)
+
+        for i in range(200):
+            key = "chat %s" % (i % 7)
+            pool.submit(task, key, i, key=key)
+        pool.shutdown()
+        for key, values in results.items():
+            self.assertEqual(values, sorted(values), key)
+        self.assertEqual(sum(len(i) for i in results.values()), 200)
+
+    def test_same_key_same_thread(self):
+        pool = self.pool(size=4)
+        threads = {}
+        lock = threading.Lock()
+
+        def task(key):
+            with lock:
+                threads.setdefault(key, set()).add(threading.current_thread().name)
+
+        for i in range(40):
+            pool.submit(task, i % 5, key=i % 5)
+        pool.shutdown()
+        for key, names in threads.items():
+            self.assertEqual(names, {"WorkerPool-%s" % pool.lane_of(key)})
+
+    def test_tasks_without_key_spread(self):
+        pool = self.pool(size=3)
+        names = set()
+        barrier = threading.Barrier(3, timeout=5)
+
+        def task():
+            names.add(threading.current_thread().name)
+            barrier.wait()
+
+        for _ in range(3):
+            pool.submit(task)
+        pool.shutdown()
+        self.assertEqual(names, {"WorkerPool-0", "WorkerPool-1", "WorkerPool-2"})
+
+    def test_caller_policy_removed(self):
+        with self.assertRaises(ValueError):
+            WorkerPool(overflow="caller")
+
+
+
+class WorkerPoolOverflowTest(unittest.TestCase):
+    def setUp(self):
+        self.release = threading.Event()
+        self.started = threading.Event()
+
+    def busy_pool(self, overflow):
+        """A pool of one worker, busy, with a full queue of one task."""
+        pool = WorkerPool(size=1, queue_size=1, overflow=overflow)
+        self.addCleanup(pool.shutdown)
+        self.addCleanup(self.release.set)
+        pool.submit(lambda: self.started.set() or self.release.wait(5))
+        self.assertTrue(self.started.wait(5))
+        self.assertTrue(pool.submit(lambda: None))
+        return pool
+
+    def test_drop(self):
+        pool = self.busy_pool("drop")
+        ran = []
+        self.assertFalse(pool.submit(ran.append, 1))
+        self.release.set()
+        pool.shutdown()
+        self.assertEqual(ran, [])
+        stats = pool.stats()
+        self.assertEqual((stats["submitted"], stats["completed"], stats["dropped"]), (3, 2, 1))
+
+    def test_block(self):
+        pool = self.busy_pool("block")
+        ran = []
+        submitter = threading.Thread(target=pool.submit, args=(ran.append, 1), daemon=True)
+        submitter.start()
+        submitter.join(0.1)
+        self.assertTrue(submitter.is_alive())
+        self.release.set()
+        submitter.join(5)
+        self.assertFalse(submitter.is_alive())
+        pool.shutdown()
+        self.assertEqual(ran, [1])
+        self.assertEqual(pool.stats()["dropped"], 0)
+
+    def test_stats(self):
+        pool = self.busy_pool("block")
+        stats = pool.stats()
+        self.assertEqual((stats["busy"], stats["queued"], stats["saturation"]), (1, 1, 1.0))
+
+    def test_failed_task_does_not_stop_worker(self):
+        pool = WorkerPool(size=1)
+        self.addCleanup(pool.shutdown)
+        ran = []
+        with self.assertLogs("workers.WorkerPool", "ERROR"):
+            pool.submit(lambda: 1 / 0)
+            pool.submit(ran.append, 1)
+            pool.shutdown()
+        self.assertEqual(ran, [1])
+        self.assertEqual(pool.stats()["completed"], 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
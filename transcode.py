@@ -0,0 +1,371 @@
+import concurrent.futures
+import concurrent.futures.process
+import io
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+import time
+
+
+class TranscodeError(Exception):
+    """Raised when a transcoding job cannot be run."""
+    pass
+
+
+class TranscodeTimeout(TranscodeError):
+    """Raised when a transcoding job is not done in time."""
+    pass
+
+
+class TranscodeService:
+    """
+    Process pool for CPU-heavy media conversions, shared by all channels,
+    so that conversions run on all cores and do not hold the GIL of the
+    threads calling them.
+
+    At most `queue_size` jobs are waiting or running at the same time,
+    further jobs wait for a free slot. A job not done within its timeout
+    is cancelled: a waiting job is removed from the queue, and a running
+    job is stopped by restarting the pool. Other jobs running in the pool
+    restarted are submitted again once.
+
+    Process IDs of workers are reported by the workers themselves when
+    they start, so that they can be stopped without internals of
+    `concurrent.futures`. Requires Python 3.7.
+
+    Args:
+        workers (int): Number of worker processes. `None` for the number
+            of CPUs.
+        queue_size (int): Maximum number of jobs waiting or running.
+        timeout (float): Default timeout of a job in seconds.
+    """
+
+    def __init__(self, workers=None, queue_size=16, timeout=120):
+        self.workers = workers or os.cpu_count() or 1
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.logger = logging.getLogger(__name__)
+        self.slots = threading.BoundedSemaphore(queue_size)
+        self.lock = threading.Lock()
+        self.executor = None
+        # Queue of worker PIDs reported, and PIDs known, of `self.executor`
+        self.pid_queue = None
+        self.pids = set()
+        # Jobs not done
+        self.futures = set()
+        self.closed = False
+        self.submitted = 0
+        self.failed = 0
+        self.timeouts = 0
+        self.restarts = 0
+        self.running = 0
+
+    def _get_executor(self):
+        with self.lock:
+            if self.closed:
+                raise TranscodeError("Transcode service is shut down.")
+            if self.executor is None:
+                # Workers are forked from a server process without threads,
+                # as a thread of this process may hold a lock while forking.
+                context = multiprocessing.get_context("forkserver")
+                self.pid_queue = context.Queue()
+                self.pids = set()
+                self.executor = concurrent.futures.ProcessPoolExecutor(
+                    self.workers, mp_context=context, initializer=_report_pid, initargs=(self.pid_queue,))
+            return self.executor
+
+    def submit(self, fn, *args, timeout=None):
+        """
+        Submit a job to the pool.
+
+        Args:
+            fn (callable): Function of the job, defined at module level.
+            *args: Arguments of the function, picklable.
+            timeout (float): Seconds to wait for a free slot. `None` to
+                wait forever.
+
+        Returns:
+            concurrent.futures.Future: The job.
+
+        Raises:
+            TranscodeTimeout: No free slot within `timeout`.
+        """
+        if not self.slots.acquire(timeout=timeout):
+            raise TranscodeTimeout("No free slot for %s in %s seconds." % (fn.__name__, timeout))
+        try:
+            executor = self._get_executor()
+            future = executor.submit(fn, *args)
+        except BaseException:
+            self.slots.release()
+            raise
+        future.executor = executor
+        with self.lock:
+            self.submitted += 1
+            self.running += 1
+            self.futures.add(future)
+        future.add_done_callback(self._done)
+        return future
+
+    def _done(self, future):
+        with self.lock:
+            self.running -= 1
+            self.futures.discard(future)
+            if future.cancelled() or future.exception() is not None:
+                self.failed += 1
+        self.slots.release()
+
+    def cancel(self, future):
+        """
+        Cancel a job. A running job is stopped by restarting the pool.
+
+        Args:
+            future (concurrent.futures.Future): The job.
+
+        Returns:
+            bool: `True` if the job is cancelled, `False` if it is done.
+        """
+        if future.cancel():
+            return True
+        if future.done():
+            return False
+        self._restart(future.executor)
+        return True
+
+    def _worker_pids(self):
+        """
+        PIDs of workers of `self.executor` started so far.
+        Called with `self.lock` held.
+        """
+        while True:
+            try:
+                self.pids.add(self.pid_queue.get_nowait())
+            except (queue.Empty, AttributeError):
+                return set(self.pids)
+
+    def _restart(self, executor):
+        with self.lock:
+            if self.executor is not executor:
+                return
+            pids = self._worker_pids()
+            pid_queue = self.pid_queue
+            futures = [i for i in self.futures if i.executor is executor]
+            self.executor = None
+            self.pid_queue = None
+            self.pids = set()
+            self.restarts += 1
+        self.logger.warning("Restarting transcode pool to stop a running job.")
+        executor.shutdown(wait=False)
+        threading.Thread(target=self._stop_workers, args=(pids, pid_queue, futures),
+                         name="Transcode-restart", daemon=True).start()
+
+    @staticmethod
+    def _stop_workers(pids, pid_queue, futures):
+        """
+        Stop workers of a pool restarted, including workers still starting,
+        until all jobs of the pool are done. Once a worker is gone, the
+        executor fails all its jobs and stops other workers.
+        """
+        while True:
+            for pid in pids:
+                try:
+                    os.kill(pid, signal.SIGTERM)
+                except OSError:
+                    pass
+            if all(i.done() for i in futures):
+                break
+            try:
+                pids = [pid_queue.get(timeout=0.1)]
+            except queue.Empty:
+                pids = []
+        pid_queue.close()
+
+    def run(self, fn, *args, timeout=None):
+        """
+        Run a job in the pool and wait for its result.
+
+        Args:
+            fn (callable): Function of the job, defined at module level.
+            *args: Arguments of the function, picklable.
+            timeout (float): Seconds to wait for the job, including time
+                waiting for a free slot. Default to `self.timeout`.
+
+        Returns:
+            Result of the function.
+
+        Raises:
+            TranscodeTimeout: The job is not done within `timeout`.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        for retry in (False, True):
+            future = self.submit(fn, *args, timeout=max(0, deadline - time.monotonic()))
+            try:
+                return future.result(max(0, deadline - time.monotonic()))
+            except concurrent.futures.TimeoutError:
+                self.cancel(future)
+                with self.lock:
+                    self.timeouts += 1
+                raise TranscodeTimeout("%s is not done in %s seconds." % (fn.__name__, timeout))
+            except concurrent.futures.process.BrokenProcessPool:
+                # The pool is restarted to stop another job, or a worker died.
+                self._restart(future.executor)
+                if retry:
+                    raise
+
+    def shutdown(self):
+        """
+        Stop accepting jobs and cancel jobs waiting.
+        """
+        with self.lock:
+            self.closed = True
+            executor, self.executor = self.executor, None
+            futures = list(self.futures)
+        for i in futures:
+            # Running jobs cannot be cancelled, and are left to finish.
+            i.cancel()
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+    def stats(self):
+        """
+        Returns:
+            dict: Workers, jobs running or waiting, submitted, failed,
+                timed out, and restarts of the pool.
+        """
+        with self.lock:
+            return {
+                "workers": self.workers,
+                "running": self.running,
+                "queue_size": self.queue_size,
+                "submitted": self.submitted,
+                "failed": self.failed,
+                "timeouts": self.timeouts,
+                "restarts": self.restarts,
+            }
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def configure(**kwargs):
+    """
+    Create the transcode service shared by all channels.
+
+    Args:
+        **kwargs: Arguments of `TranscodeService`.
+    """
+    global _service
+    with _service_lock:
+        if _service is not None:
+            _service.shutdown()
+        _service = TranscodeService(**kwargs)
+
+
+def get_service():
+    """
+    Get the transcode service shared by all channels, created with
+    default settings if it is not configured.
+
+    Returns:
+        TranscodeService: The service.
+    """
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = TranscodeService()
+        return _service
+
+
+def shutdown():
+    """
+    Shut down the shared transcode service, if it is created.
+    """
+    with _service_lock:
+        if _service is not None:
+            _service.shutdown()
+
+
+def _report_pid(pid_queue):
+    """
+    Initializer of worker processes, reporting their PIDs.
+    """
+    pid_queue.put(os.getpid())
+
+
+# Jobs run in worker processes. Libraries are imported there, so that
+# channels only depend on those they use.
+
+# Alpha to GIF mask: pixels at most half opaque are transparent.
+_GIF_ALPHA_MASK = [255] * 129 + [0] * 127
+
+
+def image_to_gif(src, dst):
+    """
+    Convert an image to GIF, with pixels at most half opaque transparent.
+    Color index 255 is the transparent color.
+
+    Args:
+        src (str): Path to the image.
+        dst (str): Path to the GIF image.
+    """
+    from PIL import Image
+    img = Image.open(src)
+    mask = None
+    if img.mode in ("RGBA", "LA", "PA") or "transparency" in img.info:
+        img = img.convert("RGBA")
+        # Thresholding with a lookup table runs in C, over the alpha band only.
+        mask = img.getchannel("A").point(_GIF_ALPHA_MASK)
+    img = img.convert("RGB").quantize(colors=255, method=Image.FASTOCTREE)
+    if mask is not None:
+        img.paste(255, mask)
+    img.save(dst, "GIF", transparency=255)
+
+
+def audio_to_ogg(data):
+    """
+    Convert audio to OGG Opus for voice messages.
+
+    Args:
+        data (bytes): Content of the audio file.
+
+    Returns:
+        bytes: Content of the OGG file.
+    """
+    import pydub
+    ogg_file = pydub.AudioSegment.from_file(io.BytesIO(data)).export(io.BytesIO(),
+                                                                      format="ogg",
+                                                                      codec="libopus",
+                                                                      bitrate="65536")
+    return ogg_file.getvalue()
+
+
+def audio_to_pcm(data, rate=16000):
+    """
+    Decode audio to 16-bit mono PCM for speech recognition.
+
+    Args:
+        data (bytes): Content of the audio file.
+        rate (int): Sample rate in Hz.
+
+    Returns:
+        bytes: Raw PCM samples, little-endian.
+    """
+    import pydub
+    audio = pydub.AudioSegment.from_file(io.BytesIO(data))
+    return audio.set_frame_rate(rate).set_channels(1).set_sample_width(2).raw_data
+
+
+def video_to_gif(src, dst):
+    """
+    Convert a video to GIF.
+
+    Args:
+        src (str): Path to the video.
+        dst (str): Path to the GIF image.
+    """
+    from moviepy.editor import VideoFileClip
+    VideoFileClip(src).write_gif(dst, program="ffmpeg")
@@ -0,0 +1,252 @@
+import concurrent.futures
+import logging
+import random
+import threading
+import time
+import urllib.parse
+
+import requests
+import requests.adapters
+
+
+class TransferEngine:
+    """
+    HTTP transfers shared by all channels, run on a pool of threads.
+    Transfers are submitted and return futures, so that a caller can make
+    several transfers at the same time, and wait only where it needs
+    their results.
+
+    Connections are kept alive in a pool per host, and reused by all
+    transfers to the host. Downloads are streamed to disk in chunks.
+    Transfers failing with a connection error, a timeout, or a status
+    code in `RETRY_STATUS` are retried with exponential backoff and full
+    jitter. Requests that may not be repeated safely (e.g. `POST`) are
+    only retried when the connection is not established, or when the
+    server asks to retry later, unless `retry=True` is given.
+
+    Args:
+        concurrency (int): Maximum number of transfers at the same time.
+        pool_size (int): Maximum number of connections kept per host.
+        retries (int): Maximum number of retries of a transfer.
+        backoff (float): Base delay of retries in seconds.
+        timeout (float): Default timeout of connections and reads in seconds.
+        chunk_size (int): Size of chunks of streamed bodies in bytes.
+    """
+
+    RETRY_STATUS = frozenset((429, 500, 502, 503, 504))
+    # Status codes of responses not processed by the server
+    RETRY_STATUS_UNSAFE = frozenset((429, 503))
+    IDEMPOTENT_METHODS = frozenset(("GET", "HEAD", "PUT", "DELETE", "OPTIONS"))
+
+    def __init__(self, concurrency=8, pool_size=10, retries=3, backoff=0.5, timeout=60, chunk_size=65536):
+        self.concurrency = concurrency
+        self.pool_size = pool_size
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+        self.logger = logging.getLogger(__name__)
+        self.executor = concurrent.futures.ThreadPoolExecutor(concurrency, thread_name_prefix="transfer")
+        self.lock = threading.Lock()
+        # (scheme, host): requests.Session
+        self.sessions = {}
+        self.transfers = 0
+        self.retried = 0
+        self.failed = 0
+        self.bytes_received = 0
+
+    def session(self, url):
+        """
+        Get the session holding the connection pool of the host of a URL.
+
+        Args:
+            url (str): The URL.
+
+        Returns:
+            requests.Session: The session.
+        """
+        parts = urllib.parse.urlsplit(url)
+        key = (parts.scheme, parts.netloc)
+        with self.lock:
+            session = self.sessions.get(key, None)
+            if session is None:
+                session = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                session.mount("%s://" % parts.scheme, adapter)
+                self.sessions[key] = session
+            return session
+
+    def _delay(self, attempt):
+        # Full jitter: uniform between 0 and the exponential backoff.
+        return random.uniform(0, self.backoff * 2 ** attempt)
+
+    def _request(self, method, url, session=None, retry=None, **kwargs):
+        session = session or self.session(url)
+        kwargs.setdefault("timeout", self.timeout)
+        safe = method.upper() in self.IDEMPOTENT_METHODS if retry is None else retry
+        statuses = self.RETRY_STATUS if safe else self.RETRY_STATUS_UNSAFE
+        attempt = 0
+        while True:
+            try:
+                r = session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt >= self.retries or not (safe or isinstance(e, requests.exceptions.ConnectTimeout)):
+                    with self.lock:
+                        self.failed += 1
+                    raise
+                self.logger.debug("%s %s failed (%r), retrying.", method, url, e)
+            else:
+                if r.status_code not in statuses or attempt >= self.retries:
+                    return r
+                self.logger.debug("%s %s returned %s, retrying.", method, url, r.status_code)
+                r.close()
+            if hasattr(kwargs.get("data", None), "seek"):
+                kwargs["data"].seek(0)
+            with self.lock:
+                self.retried += 1
+            time.sleep(self._delay(attempt))
+            attempt += 1
+
+    def request(self, method, url, session=None, retry=None, **kwargs):
+        """
+        Submit an HTTP request.
+
+        Args:
+            method (str): HTTP method.
+            url (str): URL.
+            session (requests.Session): Session to use instead of the pool
+                of the host, e.g. one holding cookies of a login.
+            retry (bool): Whether the request may be repeated safely.
+                Default to `True` for idempotent methods.
+            **kwargs: Other arguments of `requests.request`. Bodies given
+                as file objects or iterators are streamed.
+
+        Returns:
+            concurrent.futures.Future: Future of the `requests.Response`.
+        """
+        with self.lock:
+            self.transfers += 1
+        return self.executor.submit(self._request, method, url, session, retry, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def _download(self, url, path, session=None, **kwargs):
+        # Retried here as a whole, as the connection may be lost in the
+        # middle of the body.
+        session = session or self.session(url)
+        kwargs.setdefault("timeout", self.timeout)
+        attempt = 0
+        while True:
+            try:
+                with session.get(url, stream=True, **kwargs) as r:
+                    if r.status_code in self.RETRY_STATUS and attempt < self.retries:
+                        self.logger.debug("GET %s returned %s, retrying.", url, r.status_code)
+                    else:
+                        r.raise_for_status()
+                        with open(path, "wb") as f:
+                            for chunk in r.iter_content(self.chunk_size):
+                                f.write(chunk)
+                                with self.lock:
+                                    self.bytes_received += len(chunk)
+                        return path
+            except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+                if attempt >= self.retries:
+                    with self.lock:
+                        self.failed += 1
+                    raise
+                self.logger.debug("Download of %s failed (%r), retrying.", url, e)
+            except requests.HTTPError:
+                with self.lock:
+                    self.failed += 1
+                raise
+            with self.lock:
+                self.retried += 1
+            time.sleep(self._delay(attempt))
+            attempt += 1
+
+    def download(self, url, path, **kwargs):
+        """
+        Submit a download of a URL to a file, streamed in chunks.
+
+        Args:
+            url (str): URL.
+            path (str): Path to save the file to.
+            **kwargs: Other arguments of `requests.get`.
+
+        Returns:
+            concurrent.futures.Future: Future of the path.
+        """
+        with self.lock:
+            self.transfers += 1
+        return self.executor.submit(self._download, url, path, **kwargs)
+
+    def shutdown(self):
+        """
+        Wait for transfers submitted, and close all connections.
+        """
+        self.executor.shutdown(wait=True)
+        with self.lock:
+            for session in self.sessions.values():
+                session.close()
+            self.sessions.clear()
+
+    def stats(self):
+        """
+        Returns:
+            dict: Hosts connected, transfers, retries, failures and bytes
+                downloaded.
+        """
+        with self.lock:
+            return {
+                "hosts": len(self.sessions),
+                "transfers": self.transfers,
+                "retried": self.retried,
+                "failed": self.failed,
+                "bytes_received": self.bytes_received,
+            }
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def configure(**kwargs):
+    """
+    Create the transfer engine shared by all channels.
+
+    Args:
+        **kwargs: Arguments of `TransferEngine`.
+    """
+    global _engine
+    with _engine_lock:
+        if _engine is not None:
+            _engine.shutdown()
+        _engine = TransferEngine(**kwargs)
+
+
+def get_engine():
+    """
+    Get the transfer engine shared by all channels, created with default
+    settings if it is not configured.
+
+    Returns:
+        TransferEngine: The engine.
+    """
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = TransferEngine()
+        return _engine
+
+
+def shutdown():
+    """
+    Shut down the shared transfer engine, if it is created.
+    """
+    with _engine_lock:
+        if _engine is not None:
+            _engine.shutdown()